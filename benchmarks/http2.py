@@ -0,0 +1,151 @@
+"""
+Compares sending over HTTP/1.1 and HTTP/2 against local stub Graph API
+servers that answer every request after a fixed delay.
+
+    pip install fbmessenger[http2]
+    python -m benchmarks.http2 --messages 2000 --concurrency 100 --latency 0.02
+
+HTTP/2 is spoken in cleartext with prior knowledge (h2c), as there is no
+TLS between the client and the stub.
+"""
+from __future__ import print_function
+
+import argparse
+import asyncio
+import threading
+import time
+
+import h2.config
+import h2.connection
+import h2.events
+import httpx
+import requests
+
+from fbmessenger import MessengerClient
+from fbmessenger.adapters import GraphAdapter
+from fbmessenger.http2 import HTTP2Session
+from benchmarks.stub import RESPONSE, serve_http1
+
+
+class H2Protocol(asyncio.Protocol):
+
+    def __init__(self, server, latency):
+        self.server = server
+        self.latency = latency
+        self.conn = h2.connection.H2Connection(config=h2.config.H2Configuration(client_side=False))
+
+    def connection_made(self, transport):
+        self.server.connections += 1
+        self.transport = transport
+        self.conn.initiate_connection()
+        self.transport.write(self.conn.data_to_send())
+
+    def data_received(self, data):
+        for event in self.conn.receive_data(data):
+            if isinstance(event, h2.events.DataReceived):
+                self.conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+            elif isinstance(event, h2.events.StreamEnded):
+                asyncio.get_event_loop().call_later(self.latency, self.respond, event.stream_id)
+        self.transport.write(self.conn.data_to_send())
+
+    def respond(self, stream_id):
+        if self.transport.is_closing():
+            return
+        self.conn.send_headers(stream_id, [
+            (':status', '200'),
+            ('content-type', 'application/json'),
+            ('content-length', str(len(RESPONSE))),
+        ])
+        self.conn.send_data(stream_id, RESPONSE, end_stream=True)
+        self.transport.write(self.conn.data_to_send())
+
+
+def serve_http2(latency):
+    class Server(object):
+        connections = 0
+        server_address = None
+
+    server = Server()
+    started = threading.Event()
+
+    def run():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        listener = loop.run_until_complete(
+            loop.create_server(lambda: H2Protocol(server, latency), '127.0.0.1', 0))
+        server.server_address = listener.sockets[0].getsockname()
+        started.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    started.wait()
+    return server
+
+
+def run(name, client, server, messages, concurrency):
+    client.graph_url = 'http://{}:{}/v2.12'.format(*server.server_address[:2])
+    payload = {'text': 'Hello'}
+    started = time.time()
+    results = list(client.broadcast(payload, range(messages), concurrency=concurrency))
+    elapsed = time.time() - started
+    assert all(response.get('message_id') for _, response in results)
+    print('{:<15} {:>8.2f}s {:>10.0f} msg/s {:>8} connections'.format(
+        name, elapsed, messages / elapsed, server.connections))
+
+
+def run_async(name, client, server, messages, concurrency):
+    client.graph_url = 'http://{}:{}/v2.12'.format(*server.server_address[:2])
+    payload = {'text': 'Hello'}
+
+    async def broadcast():
+        async with client:
+            return [item async for item in client.broadcast(payload, range(messages), concurrency=concurrency)]
+
+    started = time.time()
+    results = asyncio.run(broadcast())
+    elapsed = time.time() - started
+    assert all(response.get('message_id') for _, response in results)
+    print('{:<15} {:>8.2f}s {:>10.0f} msg/s {:>8} connections'.format(
+        name, elapsed, messages / elapsed, server.connections))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds the stub takes to answer')
+    parser.add_argument('--connections', type=int, default=2, help='HTTP/2 connections')
+    args = parser.parse_args()
+
+    session = requests.Session()
+    session.mount('http://', GraphAdapter(pool_maxsize=args.concurrency, pool_block=True))
+    run('HTTP/1.1', MessengerClient(12345678, session=session), serve_http1(args.latency),
+        args.messages, args.concurrency)
+
+    h2_session = HTTP2Session(client=httpx.AsyncClient(
+        http1=False,
+        http2=True,
+        limits=httpx.Limits(max_connections=args.connections),
+        timeout=None,
+    ))
+    run('HTTP/2', MessengerClient(12345678, session=h2_session), serve_http2(args.latency),
+        args.messages, args.concurrency)
+
+    try:
+        from fbmessenger.aio import AsyncHTTP2Session, AsyncMessengerClient
+    except ImportError:
+        return
+    run_async('async HTTP/1.1', AsyncMessengerClient(12345678, pool_maxsize=args.concurrency),
+              serve_http1(args.latency), args.messages, args.concurrency)
+    h2_session = AsyncHTTP2Session(client=httpx.AsyncClient(
+        http1=False,
+        http2=True,
+        limits=httpx.Limits(max_connections=args.connections),
+        timeout=None,
+    ))
+    run_async('async HTTP/2', AsyncMessengerClient(12345678, session=h2_session), serve_http2(args.latency),
+              args.messages, args.concurrency)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+Benchmarks the transports, and `BaseMessenger` end to end, without
+touching the network.
+
+    python -m benchmarks.transports --messages 2000 --concurrency 50 --latency 0.02
+
+First webhook events are handled by a `BaseMessenger` whose client talks to
+a `FakeGraphTransport`, then each transport sends the same broadcast to a
+local stub of the Send API.
+"""
+from __future__ import print_function
+
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from fbmessenger import BaseMessenger, MessengerClient
+from fbmessenger.adapters import GraphAdapter
+from fbmessenger.transports import FakeGraphTransport, RequestsTransport, StdlibTransport
+from benchmarks.stub import serve_http1
+
+
+class EchoMessenger(BaseMessenger):
+
+    def message(self, message):
+        self.send_action('typing_on')
+        return self.send({'text': message['message']['text']})
+
+    def account_linking(self, message):
+        pass
+
+    def delivery(self, message):
+        pass
+
+    def optin(self, message):
+        pass
+
+    def postback(self, message):
+        pass
+
+    def read(self, message):
+        pass
+
+
+def event(sender_id):
+    return {
+        'object': 'page',
+        'entry': [{
+            'id': 1,
+            'time': 1457764198246,
+            'messaging': [{
+                'sender': {'id': sender_id},
+                'recipient': {'id': 1},
+                'timestamp': 1457764197627,
+                'message': {'mid': 'mid.{}'.format(sender_id), 'seq': 1, 'text': 'Hello'},
+            }],
+        }],
+    }
+
+
+def report(name, count, elapsed, unit):
+    print('{:<20} {:>8.2f}s {:>10.0f} {}/s'.format(name, elapsed, count / elapsed, unit))
+
+
+def bench_handle(messages, concurrency, latency):
+    transport = FakeGraphTransport(latency=latency)
+    payloads = [event(i) for i in range(messages)]
+
+    def handle(payload):
+        # A messenger per request, as a webhook view would create
+        return EchoMessenger(12345678, transport=transport).handle(payload)
+
+    started = time.time()
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(handle, payloads))
+    report('BaseMessenger.handle', messages, time.time() - started, 'events')
+    assert all(result[0].get('message_id') for result in results)
+
+
+def bench_transport(name, transport, server, messages, concurrency):
+    client = MessengerClient(12345678, transport=transport)
+    if server is not None:
+        client.graph_url = 'http://{}:{}/v2.12'.format(*server.server_address[:2])
+    started = time.time()
+    results = list(client.broadcast({'text': 'Hello'}, range(messages), concurrency=concurrency))
+    report(name, messages, time.time() - started, 'msg')
+    assert all(response.get('message_id') for _, response in results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds each Graph API call takes')
+    args = parser.parse_args()
+
+    bench_handle(args.messages, args.concurrency, args.latency)
+
+    server = serve_http1(args.latency)
+    session = requests.Session()
+    session.mount('http://', GraphAdapter(pool_maxsize=args.concurrency))
+    bench_transport('requests', RequestsTransport(session), server, args.messages, args.concurrency)
+    bench_transport('stdlib', StdlibTransport(), server, args.messages, args.concurrency)
+    bench_transport('fake', FakeGraphTransport(latency=args.latency), None, args.messages, args.concurrency)
+
+
+if __name__ == '__main__':
+    main()
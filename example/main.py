@@ -118,10 +118,7 @@ class Messenger(BaseMessenger):
     def init_bot(self):
         self.add_whitelisted_domains('https://facebook.com/')
         greeting = GreetingText(text='Welcome to the fbmessenger bot demo.')
-        self.set_messenger_profile(greeting.to_dict())
-
         get_started = GetStartedButton(payload='start')
-        self.set_messenger_profile(get_started.to_dict())
 
         menu_item_1 = PersistentMenuItem(
             item_type='postback',
@@ -138,7 +135,12 @@ class Messenger(BaseMessenger):
             menu_item_2
         ])
 
-        res = self.set_messenger_profile(persistent_menu.to_dict())
+        profile = MessengerProfile(
+            greetings=[greeting],
+            get_started=get_started,
+            persistent_menus=[persistent_menu],
+        )
+        res = self.sync_profile(profile)
         app.logger.debug('Response: {}'.format(res))
 
 
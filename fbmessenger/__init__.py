@@ -1,10 +1,33 @@
 from __future__ import absolute_import
 import abc
+import collections
+import functools
 import logging
 import hashlib
 import hmac
+import json
+import sys
+import threading
+import time
 import six
 import requests
+from six.moves.urllib.parse import urlencode
+from urllib3.exceptions import NewConnectionError
+
+from .adapters import GRAPH_API_PREFIX, GraphAdapter
+from .attachments import BaseAttachment
+from .circuit_breaker import CircuitOpenError, get_endpoint
+from .coalescing import DEFER, SEND
+from .concurrency import imap_unordered
+from .dead_letters import attempt_record
+from .indicators import TypingIndicator
+from .json_codecs import JSON_CODEC, encode, get_codec, has_raw
+from .multipart import MultipartEncoder, guess_content_type, open_filedata
+from .thread_settings import MessengerProfile
+from .tracing import end_span, get_trace_id, start_span
+from .rate_limit import monotonic
+from .responses import SendResult, raw_response
+from .retry import IDEMPOTENT_METHODS, PERMANENT, TRANSIENT, classify_error, get_error
 
 __version__ = '6.0.0'
 
@@ -12,6 +35,20 @@ logger = logging.getLogger(__name__)
 
 
 DEFAULT_API_VERSION = 2.12
+DEFAULT_POOLSIZE = 10
+
+
+def _never_connected(exc):
+    """
+        Whether a `requests.ConnectionError` failed before a connection was
+        made, e.g. connection refused or a failed DNS lookup.
+    """
+    if not isinstance(exc, requests.ConnectionError) or not exc.args:
+        return False
+    # requests wraps urllib3's `MaxRetryError`, which keeps the cause in
+    # `reason`
+    reason = getattr(exc.args[0], 'reason', exc.args[0])
+    return isinstance(reason, NewConnectionError)
 
 
 class MessengerClient(object):
@@ -30,21 +67,92 @@ class MessengerClient(object):
         'NO_PUSH'
     }
 
+    # https://developers.facebook.com/docs/graph-api/making-multiple-requests
+    BATCH_LIMIT = 50
+    IDS_LIMIT = 50
+
+    # https://developers.facebook.com/docs/messenger-platform/reference/attachment-upload-api
+    ATTACHMENT_TYPES = {
+        'image',
+        'audio',
+        'video',
+        'file',
+    }
+
     def __init__(self, page_access_token, **kwargs):
         """
             @required:
                 page_access_token
             @optional:
                 session
+                transport: a `fbmessenger.transports.Transport` to send
+                    requests with instead of a `requests.Session`, e.g.
+                    `FakeGraphTransport` to run without the network
                 api_version
                 app_secret
+                pool_connections, pool_maxsize, pool_block, keepalive:
+                    connection pool settings for the default session, see
+                    `fbmessenger.adapters.GraphAdapter`. Ignored if
+                    `session` is given.
+                http2: send requests over HTTP/2, see
+                    `fbmessenger.http2.HTTP2Session`. `pool_maxsize` sets the
+                    maximum number of connections.
+                rate_limiter: a `fbmessenger.rate_limit.RateLimiter` used to
+                    throttle calls to the Send API
+                retry_policy: a `fbmessenger.retry.RetryPolicy`, by default
+                    failed requests are not retried
+                circuit_breakers: a `fbmessenger.circuit_breaker.CircuitBreakers`
+                    used to fail fast while an endpoint is unhealthy
+                profile_cache: a `fbmessenger.cache.ProfileCache` used by
+                    `get_user_data`
+                attachment_cache: a `fbmessenger.cache.AttachmentCache`, when
+                    given media attachments are uploaded once and sent by
+                    `attachment_id` from then on
+                json_codec: codec used to encode request bodies and decode
+                    responses, e.g. `'orjson'`, or `'auto'` for the fastest
+                    one installed. See `fbmessenger.json_codecs`. By default
+                    `requests` does the encoding.
+                typed_responses: return `fbmessenger.responses.SendResult`
+                    objects from `send`, `send_action`, `send_batch`,
+                    `broadcast` and `upload_attachment` instead of the
+                    decoded responses
+                action_coalescer: a `fbmessenger.coalescing.ActionCoalescer`
+                    used to skip redundant sender actions
+                outbox: a `fbmessenger.outbox.Outbox`. When given, `send`
+                    writes each message to disk and returns a
+                    `concurrent.futures.Future` for the response, and the
+                    message is sent in the background.
+                dead_letters: a `fbmessenger.dead_letters.DeadLetterStore`
+                    that failed `send`, `send_action` and
+                    `upload_attachment` calls are added to
+                metrics: a `fbmessenger.metrics.Metrics` that requests are
+                    counted and timed in
+                tracer: a `fbmessenger.tracing.Tracer` that is given a span
+                    for every request, with the time spent in each phase
         """
 
         self.page_access_token = page_access_token
-        self.session = kwargs.get('session', requests.Session())
+        self.session = kwargs.get('transport') or kwargs.get('session')
+        if self.session is None:
+            self.session = self._default_session(**kwargs)
         self.api_version = kwargs.get('api_version', DEFAULT_API_VERSION)
-        self.graph_url = 'https://graph.facebook.com/v{api_version}'.format(api_version=self.api_version)
+        self.graph_url = '{prefix}/v{api_version}'.format(prefix=GRAPH_API_PREFIX, api_version=self.api_version)
         self.app_secret = kwargs.get('app_secret')
+        self.rate_limiter = kwargs.get('rate_limiter')
+        self.retry_policy = kwargs.get('retry_policy')
+        self.circuit_breakers = kwargs.get('circuit_breakers')
+        self.profile_cache = kwargs.get('profile_cache')
+        self.attachment_cache = kwargs.get('attachment_cache')
+        self.json_codec = get_codec(kwargs.get('json_codec'))
+        self.typed_responses = kwargs.get('typed_responses', False)
+        self.action_coalescer = kwargs.get('action_coalescer')
+        self.dead_letters = kwargs.get('dead_letters')
+        self.metrics = kwargs.get('metrics')
+        self.tracer = kwargs.get('tracer')
+        self._attempts = threading.local()
+        self.outbox = kwargs.get('outbox')
+        if self.outbox is not None:
+            self.outbox.open(self)
 
     @property
     def auth_args(self):
@@ -58,7 +166,94 @@ class MessengerClient(object):
             self._auth_args = auth
         return self._auth_args
 
+    def _default_session(self, **kwargs):
+        if kwargs.get('http2'):
+            from .http2 import HTTP2Session
+            return HTTP2Session(max_connections=kwargs.get('pool_maxsize', DEFAULT_POOLSIZE))
+
+        session = requests.Session()
+        session.mount(GRAPH_API_PREFIX, GraphAdapter(
+            pool_connections=kwargs.get('pool_connections', DEFAULT_POOLSIZE),
+            pool_maxsize=kwargs.get('pool_maxsize', DEFAULT_POOLSIZE),
+            pool_block=kwargs.get('pool_block', False),
+            keepalive=kwargs.get('keepalive', True),
+            tracing=kwargs.get('tracer') is not None,
+        ))
+        return session
+
     def get_user_data(self, recipient_id, fields=None, timeout=None):
+        params = self._user_data_params(fields)
+
+        if self.profile_cache is not None:
+            profile = self.profile_cache.get(recipient_id, params['fields'].split(','))
+            if profile is not None:
+                return profile
+
+        params.update(self.auth_args)
+
+        profile = self._request(
+            'get',
+            '{recipient_id}'.format(recipient_id=recipient_id),
+            params=params,
+            timeout=timeout
+        )
+        self._cache_profile(recipient_id, params['fields'], profile)
+        return profile
+
+    def get_users_data(self, recipient_ids, fields=None, concurrency=4, timeout=None):
+        """
+            Fetches the profiles of many users using Graph API multi-id
+            lookups, `IDS_LIMIT` users per request and up to `concurrency`
+            requests at once.
+
+            @outputs:
+                dict mapping each recipient id to its profile. If a lookup
+                fails, the error response (or the exception it raised) is
+                returned for every id in it.
+        """
+        params = self._user_data_params(fields)
+        profiles, chunks = self._users_data_chunks(recipient_ids, params['fields'])
+        params.update(self.auth_args)
+
+        def fetch(chunk):
+            return self._request(
+                'get',
+                '',
+                endpoint='user_profile',
+                params=dict(params, ids=','.join(str(recipient_id) for recipient_id in chunk)),
+                timeout=timeout
+            )
+
+        for chunk, response in imap_unordered(fetch, chunks, concurrency, return_exceptions=True):
+            profiles.update(self._users_data_results(chunk, params['fields'], response))
+        return profiles
+
+    def _users_data_chunks(self, recipient_ids, fields):
+        profiles = {}
+        missing = []
+        for recipient_id in recipient_ids:
+            if self.profile_cache is not None:
+                profile = self.profile_cache.get(recipient_id, fields.split(','))
+                if profile is not None:
+                    profiles[recipient_id] = profile
+                    continue
+            missing.append(recipient_id)
+        return profiles, [missing[i:i + self.IDS_LIMIT] for i in range(0, len(missing), self.IDS_LIMIT)]
+
+    def _users_data_results(self, chunk, fields, response):
+        if not isinstance(response, (dict, Exception)):
+            response = {'error': {'message': 'Unexpected response to a multi-id lookup: {!r}'.format(response)}}
+        results = {}
+        for recipient_id in chunk:
+            if isinstance(response, Exception) or get_error(response) is not None:
+                results[recipient_id] = response
+            else:
+                results[recipient_id] = response.get(str(recipient_id))
+                self._cache_profile(recipient_id, fields, results[recipient_id])
+        return results
+
+    @staticmethod
+    def _user_data_params(fields):
         params = {}
 
         if isinstance(fields, six.string_types):
@@ -68,17 +263,129 @@ class MessengerClient(object):
         else:
             params['fields'] = 'first_name,last_name,profile_pic,locale,timezone,gender'
 
-        params.update(self.auth_args)
+        return params
 
-        r = self.session.get(
-            '{graph_url}/{recipient_id}'.format(graph_url=self.graph_url, recipient_id=recipient_id),
-            params=params,
-            timeout=timeout
-        )
-        return r.json()
+    def _cache_profile(self, recipient_id, fields, profile):
+        if self.profile_cache is not None and isinstance(profile, dict) and get_error(profile) is None:
+            self.profile_cache.set(recipient_id, fields.split(','), profile)
 
     def send(self, payload, recipient_id, messaging_type='RESPONSE', notification_type='REGULAR',
              timeout=None, tag=None):
+        if self.outbox is not None:
+            # Validate before writing anything to disk
+            self._send_body(payload, recipient_id, messaging_type, notification_type, tag)
+            return self.outbox.put(payload, recipient_id, messaging_type, notification_type, timeout, tag)
+        return self._capture(
+            'send',
+            self._send_request(payload, recipient_id, messaging_type, notification_type, timeout, tag),
+            functools.partial(self._send, payload, recipient_id, messaging_type, notification_type, timeout, tag)
+        )
+
+    @staticmethod
+    def _send_request(payload, recipient_id, messaging_type, notification_type, timeout, tag):
+        return {
+            'payload': payload,
+            'recipient_id': recipient_id,
+            'messaging_type': messaging_type,
+            'notification_type': notification_type,
+            'timeout': timeout,
+            'tag': tag,
+        }
+
+    def _send(self, payload, recipient_id, messaging_type='RESPONSE', notification_type='REGULAR',
+              timeout=None, tag=None, retry=True):
+        body = self._send_body(payload, recipient_id, messaging_type, notification_type, tag)
+        body['message'] = self._reuse_attachment(payload, timeout=timeout)
+        self._before_send((recipient_id,))
+
+        return self._request(
+            'post',
+            'me/messages',
+            recipients=(recipient_id,),
+            typed=True,
+            retry=retry,
+            params=self.auth_args,
+            json=body,
+            timeout=timeout
+        )
+
+    def send_batch(self, items, timeout=None):
+        """
+            Sends many messages using as few Graph API batch requests as
+            possible (up to `BATCH_LIMIT` messages per request).
+
+            @required:
+                items: iterable of `(payload, recipient_id[, messaging_type[,
+                    notification_type[, tag]]])` tuples
+            @outputs:
+                list with one decoded Send API response per item, in input
+                order. Operations Facebook did not get round to running are
+                returned as `None`.
+        """
+        results = []
+        for recipient_ids, operations in self._batch_operations(items):
+            self._before_send(recipient_ids)
+            started = monotonic()
+            response = self._request(
+                'post',
+                '',
+                recipients=recipient_ids,
+                params=self.auth_args,
+                data={
+                    'batch': self._encode_json(operations).decode('utf8'),
+                    'include_headers': 'false',
+                },
+                timeout=timeout
+            )
+            results.extend(self._batch_results(response, len(operations), monotonic() - started))
+        return results
+
+    def broadcast(self, payload, recipient_ids, messaging_type='RESPONSE', notification_type='REGULAR',
+                  tag=None, concurrency=10, timeout=None):
+        """
+            Sends the same message to many recipients using up to
+            `concurrency` requests at once.
+
+            The message is serialized once up front and `recipient_ids` is
+            consumed lazily, so any iterable (e.g. a database cursor) may be
+            used regardless of its size. Use a `pool_maxsize` of at least
+            `concurrency` so that every request can reuse a connection.
+
+            @outputs:
+                generator of `(recipient_id, response)` pairs, in the order
+                the responses arrive. A request that raised (e.g. timed out)
+                has the exception as its response, and doesn't stop the
+                others.
+        """
+        # Validate before uploading anything
+        self._send_body(payload, None, messaging_type, notification_type, tag)
+        prefix = self._broadcast_prefix(self._reuse_attachment(payload, timeout=timeout),
+                                        messaging_type, notification_type, tag)
+
+        def send(recipient_id):
+            self._before_send((recipient_id,))
+            return self._request(
+                'post',
+                'me/messages',
+                recipients=(recipient_id,),
+                typed=True,
+                params=self.auth_args,
+                data=prefix + self._encode_json(recipient_id) + b'}}',
+                headers={'Content-Type': 'application/json'},
+                timeout=timeout
+            )
+
+        return imap_unordered(send, recipient_ids, concurrency, return_exceptions=True)
+
+    def _broadcast_prefix(self, payload, messaging_type, notification_type, tag):
+        # Everything in the request body except the recipient id, which is
+        # appended (along with the closing braces) per recipient.
+        body = self._send_body(payload, None, messaging_type, notification_type, tag)
+        del body['recipient']
+        return self._encode_json(body)[:-1] + b',"recipient":{"id":'
+
+    def _send_body(self, payload, recipient_id, messaging_type='RESPONSE', notification_type='REGULAR',
+                   tag=None):
         if messaging_type not in self.MESSAGING_TYPES:
             raise ValueError('`{}` is not a valid `messaging_type`'.format(messaging_type))
 
@@ -97,17 +404,57 @@ class MessengerClient(object):
         if tag:
             body['tag'] = tag
 
-        r = self.session.post(
-            '{graph_url}/me/messages'.format(graph_url=self.graph_url),
-            params=self.auth_args,
-            json=body,
-            timeout=timeout
-        )
-        return r.json()
+        return body
+
+    def _batch_operations(self, items):
+        # Validate everything up front so that a bad item doesn't leave the
+        # batch half sent.
+        recipient_ids = []
+        operations = []
+        for item in items:
+            body = self._send_body(*item)
+            recipient_ids.append(body['recipient']['id'])
+            operations.append({
+                'method': 'POST',
+                'relative_url': 'me/messages',
+                'body': urlencode(dict(
+                    (key, value if isinstance(value, six.string_types) else self._encode_json(value).decode('utf8'))
+                    for key, value in body.items()
+                )),
+            })
+
+        for i in range(0, len(operations), self.BATCH_LIMIT):
+            yield recipient_ids[i:i + self.BATCH_LIMIT], operations[i:i + self.BATCH_LIMIT]
+
+    def _batch_results(self, response, count, latency=None):
+        if not isinstance(response, list):
+            # The whole batch was rejected, e.g. because of a bad token
+            return [self._result(response, latency=latency)] * count
+        return [
+            self._result(self._decode_json(item['body']), item.get('code'), latency) if item else None
+            for item in response
+        ]
 
     def send_action(self, sender_action, recipient_id, timeout=None):
-        r = self.session.post(
-            '{graph_url}/me/messages'.format(graph_url=self.graph_url),
+        if self.action_coalescer is not None:
+            decision = self.action_coalescer.before_action(recipient_id, sender_action)
+            if decision == DEFER:
+                self.action_coalescer.defer(
+                    recipient_id, lambda: self._send_action(sender_action, recipient_id, timeout))
+            if decision != SEND:
+                return self._result({'recipient_id': recipient_id})
+        return self._capture(
+            'send_action',
+            {'sender_action': sender_action, 'recipient_id': recipient_id, 'timeout': timeout},
+            functools.partial(self._send_action, sender_action, recipient_id, timeout)
+        )
+
+    def _send_action(self, sender_action, recipient_id, timeout=None):
+        return self._request(
+            'post',
+            'me/messages',
+            recipients=(recipient_id,),
+            typed=True,
             params=self.auth_args,
             json={
                 'recipient': {
@@ -117,28 +464,108 @@ class MessengerClient(object):
             },
             timeout=timeout
         )
-        return r.json()
 
     def subscribe_app_to_page(self, timeout=None):
-        r = self.session.post(
-            '{graph_url}/me/subscribed_apps'.format(graph_url=self.graph_url),
+        return self._request(
+            'post',
+            'me/subscribed_apps',
             params=self.auth_args,
             timeout=timeout
         )
-        return r.json()
 
     def set_messenger_profile(self, data, timeout=None):
-        r = self.session.post(
-            '{graph_url}/me/messenger_profile'.format(graph_url=self.graph_url),
+        return self._request(
+            'post',
+            'me/messenger_profile',
             params=self.auth_args,
             json=data,
             timeout=timeout
         )
-        return r.json()
+
+    def get_messenger_profile(self, fields, timeout=None):
+        if not isinstance(fields, six.string_types):
+            fields = ','.join(fields)
+        return self._request(
+            'get',
+            'me/messenger_profile',
+            params=dict({
+                'fields': fields,
+            }, **self.auth_args),
+            timeout=timeout
+        )
+
+    def delete_messenger_profile(self, fields, timeout=None):
+        return self._request(
+            'delete',
+            'me/messenger_profile',
+            params=self.auth_args,
+            json={
+                'fields': list(fields),
+            },
+            timeout=timeout
+        )
+
+    def sync_profile(self, profile, delete_missing=False, timeout=None):
+        """
+            Brings the page's messenger profile in line with `profile` using
+            as few requests as possible: one GET for the current profile,
+            then at most one POST for the fields that differ and one DELETE
+            for the fields to remove. Nothing is written if the profile is
+            already up to date.
+
+            @required:
+                profile: a `thread_settings.MessengerProfile` or a dict of
+                    messenger profile fields
+            @optional:
+                delete_missing: delete the `MessengerProfile.FIELDS` that
+                    `profile` doesn't set
+            @outputs:
+                list of the responses to the writes made
+        """
+        desired, fields = self._profile_fields(profile, delete_missing)
+        current = self.get_messenger_profile(fields, timeout=timeout)
+        changed, deleted = self._profile_changes(desired, current, fields)
+
+        responses = []
+        if changed:
+            responses.append(self.set_messenger_profile(changed, timeout=timeout))
+        if deleted:
+            responses.append(self.delete_messenger_profile(deleted, timeout=timeout))
+        return responses
+
+    @staticmethod
+    def _profile_fields(profile, delete_missing):
+        desired = profile.to_dict() if hasattr(profile, 'to_dict') else dict(profile)
+        fields = set(desired)
+        if delete_missing:
+            fields.update(MessengerProfile.FIELDS)
+        return desired, sorted(fields)
+
+    @staticmethod
+    def _profile_changes(desired, current, fields):
+        if get_error(current) is not None:
+            # Can't tell what's there, so write everything
+            logger.warning('Could not fetch the messenger profile: %s', current)
+            return desired, []
+
+        data = current.get('data') or [{}]
+        current = data[0]
+
+        def encode(value):
+            return json.dumps(value, sort_keys=True)
+
+        changed = dict(
+            (field, value) for field, value in desired.items()
+            if field not in current or encode(current[field]) != encode(value)
+        )
+        deleted = [field for field in fields if field not in desired and field in current]
+        logger.debug('Messenger profile changes: set %s, delete %s', sorted(changed), deleted)
+        return changed, deleted
 
     def delete_get_started(self, timeout=None):
-        r = self.session.delete(
-            '{graph_url}/me/messenger_profile'.format(graph_url=self.graph_url),
+        return self._request(
+            'delete',
+            'me/messenger_profile',
             params=self.auth_args,
             json={
                 'fields': [
@@ -147,11 +574,11 @@ class MessengerClient(object):
             },
             timeout=timeout
         )
-        return r.json()
 
     def delete_persistent_menu(self, timeout=None):
-        r = self.session.delete(
-            '{graph_url}/me/messenger_profile'.format(graph_url=self.graph_url),
+        return self._request(
+            'delete',
+            'me/messenger_profile',
             params=self.auth_args,
             json={
                 'fields': [
@@ -160,46 +587,46 @@ class MessengerClient(object):
             },
             timeout=timeout
         )
-        return r.json()
 
     def link_account(self, account_linking_token, timeout=None):
-        r = self.session.post(
-            '{graph_url}/me'.format(graph_url=self.graph_url),
+        return self._request(
+            'post',
+            'me',
             params=dict({
                 'fields': 'recipient',
                 'account_linking_token': account_linking_token
             }, **self.auth_args),
             timeout=timeout
         )
-        return r.json()
 
     def unlink_account(self, psid, timeout=None):
-        r = self.session.post(
-            '{graph_url}/me/unlink_accounts'.format(graph_url=self.graph_url),
+        return self._request(
+            'post',
+            'me/unlink_accounts',
             params=self.auth_args,
             json={
                 'psid': psid
             },
             timeout=timeout
         )
-        return r.json()
 
     def update_whitelisted_domains(self, domains, timeout=None):
         if not isinstance(domains, list):
             domains = [domains]
-        r = self.session.post(
-            '{graph_url}/me/messenger_profile'.format(graph_url=self.graph_url),
+        return self._request(
+            'post',
+            'me/messenger_profile',
             params=self.auth_args,
             json={
                 'whitelisted_domains': domains
             },
             timeout=timeout
         )
-        return r.json()
 
     def remove_whitelisted_domains(self, timeout=None):
-        r = self.session.delete(
-            '{graph_url}/me/messenger_profile'.format(graph_url=self.graph_url),
+        return self._request(
+            'delete',
+            'me/messenger_profile',
             params=self.auth_args,
             json={
                 'fields':[
@@ -208,22 +635,404 @@ class MessengerClient(object):
             },
             timeout=timeout
         )
-        return r.json()
 
-    def upload_attachment(self, attachment, timeout=None):
-        if not attachment.url:
-            raise ValueError('Attachment must have `url` specified')
-        if attachment.quick_replies:
-            raise ValueError('Attachment may not have `quick_replies`')
-        r = self.session.post(
-            '{graph_url}/me/message_attachments'.format(graph_url=self.graph_url),
+    def upload_attachment(self, attachment, timeout=None, filedata=None):
+        """
+            Uploads an attachment so that it can be sent by `attachment_id`.
+
+            @optional:
+                filedata: path or binary file object to upload instead of
+                    `attachment.url`. The file is streamed in chunks
+                    rather than read into memory.
+        """
+        return self._capture(
+            'upload_attachment',
+            self._upload_request(attachment, timeout, filedata),
+            functools.partial(self._upload_attachment, attachment, timeout, filedata)
+        )
+
+    @staticmethod
+    def _upload_request(attachment, timeout, filedata):
+        if filedata is not None and not isinstance(filedata, six.string_types):
+            # Only files that can be opened again are worth keeping
+            filedata = getattr(filedata, 'name', None)
+            if not isinstance(filedata, six.string_types):
+                return None
+        return {
+            'attachment_type': attachment.attachment_type,
+            'url': attachment.url,
+            'is_reusable': attachment.is_reusable,
+            'timeout': timeout,
+            'filedata': filedata,
+        }
+
+    def _upload_attachment(self, attachment, timeout=None, filedata=None):
+        if filedata is not None:
+            return self._upload_file(attachment, filedata, timeout)
+
+        self._validate_upload(attachment)
+        cached = self._cached_upload(attachment, attachment.url)
+        if cached is not None:
+            return cached
+
+        response = self._request(
+            'post',
+            'me/message_attachments',
+            typed=True,
             params=self.auth_args,
             json={
-                'message':  attachment.to_dict()
+                'message': self._upload_message(attachment)
             },
             timeout=timeout
         )
-        return r.json()
+        self._cache_attachment(attachment, attachment.url, response)
+        return response
+
+    def upload_attachments(self, uploads, concurrency=4, timeout=None):
+        """
+            Uploads many attachments, up to `concurrency` at once.
+
+            @required:
+                uploads: iterable of `(attachment, filedata)` pairs, where
+                    `filedata` is `None` to upload from `attachment.url`
+            @outputs:
+                generator of `((attachment, filedata), response)` pairs, in
+                the order the uploads complete. An upload that raised has
+                the exception as its response.
+        """
+        def upload(item):
+            attachment, filedata = item
+            return self.upload_attachment(attachment, timeout=timeout, filedata=filedata)
+
+        return imap_unordered(upload, uploads, concurrency, return_exceptions=True)
+
+    def _upload_file(self, attachment, filedata, timeout):
+        self._validate_upload(attachment, from_file=True)
+        fileobj, filename, should_close = open_filedata(filedata)
+        try:
+            key = self._file_key(fileobj)
+            cached = self._cached_upload(attachment, key)
+            if cached is not None:
+                return cached
+
+            encoder = self._upload_encoder(attachment, fileobj, filename)
+            response = self._request(
+                'post',
+                'me/message_attachments',
+                typed=True,
+                params=self.auth_args,
+                data=encoder,
+                headers={'Content-Type': encoder.content_type},
+                timeout=timeout
+            )
+        finally:
+            if should_close:
+                fileobj.close()
+        self._cache_attachment(attachment, key, response)
+        return response
+
+    @staticmethod
+    def _validate_upload(attachment, from_file=False):
+        if from_file and attachment.url:
+            raise ValueError('Attachment may not have `url` specified when uploading `filedata`')
+        if not from_file and not attachment.url:
+            raise ValueError('Attachment must have `url` specified')
+        if attachment.quick_replies:
+            raise ValueError('Attachment may not have `quick_replies`')
+
+    def _file_key(self, fileobj):
+        if self.attachment_cache is None:
+            return None
+        start = fileobj.tell()
+        key = self.attachment_cache.content_key(fileobj)
+        fileobj.seek(start)
+        return key
+
+    def _cached_upload(self, attachment, key):
+        if self.attachment_cache is not None and key is not None:
+            attachment_id = self.attachment_cache.get(attachment.attachment_type, key)
+            if attachment_id is not None:
+                return self._result({'attachment_id': attachment_id}, latency=0)
+        return None
+
+    def _upload_message(self, attachment):
+        message = attachment.to_dict()
+        if self.attachment_cache is not None:
+            # Uploads are only worth caching if the attachment can be reused
+            message['attachment']['payload']['is_reusable'] = 'true'
+        return message
+
+    def _upload_encoder(self, attachment, fileobj, filename):
+        return MultipartEncoder([
+            ('message', json.dumps(self._upload_message(attachment))),
+            ('filedata', (filename, fileobj, guess_content_type(filename))),
+        ])
+
+    def _cache_attachment(self, attachment, key, response):
+        response = raw_response(response)
+        if (self.attachment_cache is not None and key is not None and
+                isinstance(response, dict) and response.get('attachment_id')):
+            self.attachment_cache.set(attachment.attachment_type, key, response['attachment_id'])
+
+    def _reusable_attachment(self, payload):
+        """
+            Returns the URL attachment in a message payload that could be
+            sent by `attachment_id` instead, or `None`.
+        """
+        if self.attachment_cache is None or not isinstance(payload, dict):
+            return None
+        attachment = payload.get('attachment')
+        if not isinstance(attachment, dict) or attachment.get('type') not in self.ATTACHMENT_TYPES:
+            return None
+        media = attachment.get('payload') or {}
+        if not media.get('url') or media.get('attachment_id'):
+            return None
+        return BaseAttachment(attachment['type'], url=media['url'], is_reusable=True)
+
+    @staticmethod
+    def _with_attachment_id(payload, attachment_id):
+        payload = dict(payload)
+        payload['attachment'] = dict(payload['attachment'])
+        media = dict(payload['attachment']['payload'])
+        del media['url']
+        media.pop('is_reusable', None)
+        media['attachment_id'] = attachment_id
+        payload['attachment']['payload'] = media
+        return payload
+
+    def _reuse_attachment(self, payload, timeout=None):
+        """
+            Swaps the URL of a media attachment for the `attachment_id` it
+            was uploaded as, uploading it first if need be.
+        """
+        attachment = self._reusable_attachment(payload)
+        if attachment is None:
+            return payload
+        response = raw_response(self.upload_attachment(attachment, timeout=timeout))
+        if get_error(response) is not None or not response.get('attachment_id'):
+            logger.warning('Failed to upload %s, sending by URL instead: %s', attachment.url, response)
+            return payload
+        return self._with_attachment_id(payload, response['attachment_id'])
+
+    def _request(self, method, path, recipients=None, typed=False, retry=True, endpoint=None, **kwargs):
+        """
+            Performs a request against the Graph API and returns the
+            decoded JSON body. Every network call made by the client goes
+            through here, which lets subclasses (e.g. the asyncio client)
+            swap out the transport without redefining each endpoint.
+
+            `recipients` lists the recipients of the messages sent by the
+            request, and marks it as subject to the `rate_limiter`.
+            `typed` marks responses that are returned as `SendResult`s when
+            `typed_responses` is set. `retry=False` makes a single attempt
+            whatever the `retry_policy`, for callers that retry themselves.
+            `endpoint` names the endpoint for circuit breakers, metrics and
+            tracing when it can't be told from `path` (see `get_endpoint`).
+        """
+        kwargs = self._json_kwargs(kwargs)
+        url = self._url(path)
+        endpoint = endpoint or get_endpoint(path)
+        breaker = self._circuit_breaker(endpoint)
+        attempts = getattr(self._attempts, 'current', None)
+        started = monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            probe = breaker is not None and breaker.before_call()
+            r = None
+            span = None
+            try:
+                delay = self._throttle_delay(recipients)
+                if delay:
+                    time.sleep(delay)
+
+                if attempt > 1 and hasattr(kwargs.get('data'), 'seek'):
+                    # Rewind streamed uploads before sending them again
+                    kwargs['data'].seek(0)
+
+                sent = monotonic()
+                span = None if self.tracer is None else self._start_span(method, endpoint, attempt)
+                r = getattr(self.session, method)(url, **kwargs)
+                data = r.json() if self.json_codec is None else self.json_codec.loads(r.content)
+            except (requests.RequestException, ValueError) as e:
+                if span is not None:
+                    self._end_span(span, getattr(r, 'status_code', None), getattr(r, 'headers', None), error=e)
+                if self.metrics is not None:
+                    self._record_request(endpoint, method, getattr(r, 'status_code', 'error'), None, sent)
+                error_class = self._classify_exception(method, e, r)
+                self._record_outcome(breaker, error_class, e, getattr(r, 'status_code', None))
+                if attempts is not None:
+                    attempts.append(attempt_record(path, error_class, status_code=getattr(r, 'status_code', None),
+                                                   exc=e))
+                delay = self._retry_delay(attempt, started, error_class) if retry else None
+                if delay is None:
+                    raise
+            except BaseException as e:
+                # e.g. KeyboardInterrupt, or a transport raising something
+                # else: the outcome is unknown, so free the probe for another
+                if probe:
+                    breaker.release_probe()
+                if span is not None:
+                    self._end_span(span, getattr(r, 'status_code', None), getattr(r, 'headers', None), error=e)
+                raise
+            else:
+                if span is not None:
+                    self._end_span(span, r.status_code, getattr(r, 'headers', None), data)
+                if self.metrics is not None:
+                    self._record_request(endpoint, method, r.status_code, data, sent)
+                error_class = classify_error(data, r.status_code)
+                self._record_outcome(breaker, error_class)
+                if attempts is not None:
+                    attempts.append(attempt_record(path, error_class, data, r.status_code))
+                delay = self._retry_delay(attempt, started, error_class) if retry else None
+                if delay is None:
+                    if typed:
+                        return self._result(data, r.status_code, monotonic() - started, error_class)
+                    return data
+
+            logger.debug('Retrying %s %s in %.2fs (attempt %d)', method.upper(), path, delay, attempt)
+            time.sleep(delay)
+
+    def _capture(self, method, request, call, store=None, dead_letter_id=None):
+        """
+            Returns `call()`, adding it to `store` (by default
+            `dead_letters`) if it raises a network error or returns a Graph
+            API error. `request` holds the arguments of the `method` call,
+            or is `None` if they can't be stored.
+        """
+        store = store or self.dead_letters
+        if store is None or request is None:
+            return call()
+
+        # Calls may be nested, e.g. an upload made by `send`
+        outer = getattr(self._attempts, 'current', None)
+        attempts = self._attempts.current = []
+        try:
+            response = call()
+        except (requests.RequestException, CircuitOpenError) as e:
+            if isinstance(e, CircuitOpenError):
+                attempts.append(attempt_record(None, TRANSIENT, exc=e))
+            store.add(method, request, attempts, dead_letter_id)
+            raise
+        finally:
+            self._attempts.current = outer
+
+        if get_error(raw_response(response)) is not None:
+            store.add(method, request, attempts, dead_letter_id)
+        elif dead_letter_id is not None:
+            store.delete(dead_letter_id)
+        return response
+
+    def _redrive(self, store, dead_letter):
+        """
+            Repeats a failed call, see `DeadLetterStore.redrive`.
+        """
+        request = dead_letter.request
+        if dead_letter.method == 'send':
+            call = functools.partial(self._send, **request)
+        elif dead_letter.method == 'send_action':
+            call = functools.partial(self._send_action, **request)
+        elif dead_letter.method == 'upload_attachment':
+            attachment = BaseAttachment(request['attachment_type'], url=request['url'],
+                                        is_reusable=request['is_reusable'])
+            call = functools.partial(self._upload_attachment, attachment, request['timeout'], request['filedata'])
+        else:
+            raise ValueError('Cannot redrive `{}`'.format(dead_letter.method))
+        return self._capture(dead_letter.method, request, call, store, dead_letter.id)
+
+    def _record_request(self, endpoint, method, status, data, sent):
+        error = get_error(data)
+        self.metrics.record_request(endpoint, method, status, error and error.get('code'), monotonic() - sent)
+
+    def _start_span(self, method, endpoint, attempt, activate=True):
+        return start_span(self.tracer, 'graph.request', activate, endpoint=endpoint,
+                          method=method.upper(), attempt=attempt)
+
+    def _end_span(self, span, status_code, headers, data=None, error=None):
+        span.set_attribute('status_code', status_code)
+        span.set_attribute('fbtrace_id', get_trace_id(headers, data))
+        graph_error = get_error(data)
+        if graph_error is not None:
+            span.set_attribute('error_code', graph_error.get('code'))
+        end_span(self.tracer, span, error)
+
+    def _before_send(self, recipient_ids):
+        if self.action_coalescer is not None:
+            for recipient_id in recipient_ids:
+                self.action_coalescer.before_send(recipient_id)
+
+    def _result(self, data, status_code=None, latency=None, error_class=None):
+        if not self.typed_responses:
+            return data
+        return SendResult.from_response(data, status_code, latency, error_class)
+
+    def _encode_json(self, obj):
+        return encode(self.json_codec or JSON_CODEC, obj)
+
+    def _decode_json(self, data):
+        return (self.json_codec or JSON_CODEC).loads(data)
+
+    def _json_kwargs(self, kwargs):
+        """
+            Encodes a `json` request body with `json_codec`. Without a codec
+            it is left to `requests`, unless it contains pre-encoded bytes.
+        """
+        body = kwargs.get('json')
+        if body is None or (self.json_codec is None and not has_raw(body)):
+            return kwargs
+        kwargs = dict(kwargs)
+        del kwargs['json']
+        kwargs['data'] = self._encode_json(body)
+        kwargs['headers'] = dict(kwargs.get('headers') or {}, **{'Content-Type': 'application/json'})
+        return kwargs
+
+    def _circuit_breaker(self, endpoint):
+        if self.circuit_breakers is None:
+            return None
+        return self.circuit_breakers.get(endpoint)
+
+    @staticmethod
+    def _record_outcome(breaker, error_class, exc=None, status_code=None):
+        if breaker is None:
+            return
+        # Errors Facebook answered promptly (bad requests, throttling) say
+        # nothing about the endpoint's health, unlike timeouts and 5xxs.
+        server_error = isinstance(status_code, int) and status_code >= 500
+        if error_class == TRANSIENT or server_error or (exc is not None and not isinstance(exc, ValueError)):
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+
+    def _retry_delay(self, attempt, started, error_class):
+        if self.retry_policy is None:
+            return None
+        return self.retry_policy.next_delay(attempt, started, error_class)
+
+    @staticmethod
+    def _classify_exception(method, exc, response=None):
+        if isinstance(exc, ValueError):
+            # A body that isn't JSON, e.g. an error page from a proxy. A
+            # gateway timeout doesn't say whether Facebook acted on the
+            # request, so only requests that are safe to repeat are retried.
+            if method in IDEMPOTENT_METHODS and response is not None and classify_error(None, response.status_code):
+                return TRANSIENT
+            return PERMANENT
+        if isinstance(exc, requests.ConnectTimeout) or _never_connected(exc):
+            # The request never reached Facebook
+            return TRANSIENT
+        if method in IDEMPOTENT_METHODS and isinstance(exc, (requests.ConnectionError, requests.Timeout)):
+            return TRANSIENT
+        return PERMANENT
+
+    def _throttle_delay(self, recipients):
+        if self.rate_limiter is None or not recipients:
+            return 0
+        return max(self.rate_limiter.reserve(recipient_id) for recipient_id in recipients)
+
+    def _url(self, path):
+        if not path:
+            return self.graph_url
+        return '{graph_url}/{path}'.format(graph_url=self.graph_url, path=path)
 
     def generate_appsecret_proof(self):
         """
@@ -240,12 +1049,25 @@ class MessengerClient(object):
 class BaseMessenger(object):
     __metaclass__ = abc.ABCMeta
 
-    last_message = {}
+    def __init__(self, page_access_token, app_secret=None, typing_delay=None, typing_refresh=15, **kwargs):
+        """
+            @optional:
+                app_secret
+                typing_delay: show the typing indicator if `message` hasn't
+                    sent anything after this many seconds, see
+                    `fbmessenger.indicators.TypingIndicator`
+                typing_refresh: seconds between `typing_on` calls while the
+                    indicator is shown
 
-    def __init__(self, page_access_token, app_secret=None):
+            Any other keyword arguments (e.g. `transport` or `retry_policy`)
+            are passed to the `MessengerClient`.
+        """
         self.page_access_token = page_access_token
         self.app_secret = app_secret
-        self.client = MessengerClient(self.page_access_token, app_secret=self.app_secret)
+        self.typing_delay = typing_delay
+        self.typing_refresh = typing_refresh
+        self.client = MessengerClient(self.page_access_token, app_secret=self.app_secret, **kwargs)
+        self._local = threading.local()
 
     @abc.abstractmethod
     def account_linking(self, message):
@@ -271,31 +1093,136 @@ class BaseMessenger(object):
     def read(self, message):
         """Method to handle `message_reads`"""
 
-    def handle(self, payload):
-        for entry in payload['entry']:
-            for message in entry['messaging']:
-                self.last_message = message
-                if message.get('account_linking'):
-                    return self.account_linking(message)
-                elif message.get('delivery'):
-                    return self.delivery(message)
-                elif message.get('message'):
-                    return self.message(message)
-                elif message.get('optin'):
-                    return self.optin(message)
-                elif message.get('postback'):
-                    return self.postback(message)
-                elif message.get('read'):
-                    return self.read(message)
+    # In the order `handle` checks for them
+    EVENT_TYPES = (
+        'account_linking',
+        'delivery',
+        'message',
+        'optin',
+        'postback',
+        'read',
+    )
+
+    @property
+    def last_message(self):
+        """The event being handled on the calling thread"""
+        return getattr(self._local, 'last_message', {})
+
+    @last_message.setter
+    def last_message(self, message):
+        self._local.last_message = message
+
+    def handle(self, payload, concurrency=None, return_exceptions=False):
+        """
+            Dispatches every event in `payload` to its handler and returns
+            their results in the order of the events, with `None` for
+            events of an unknown type. A handler raising an exception
+            doesn't stop the other events being handled: once they all
+            have been, the first event's exception is raised from `handle`
+            and any others are logged.
+
+            @optional:
+                concurrency: handle up to this many senders' events in
+                    parallel threads. Each sender's events are still handled
+                    one at a time, in order.
+                return_exceptions: return the exceptions raised by handlers
+                    in place of their results, instead of raising them
+        """
+        messages = [message for entry in payload['entry'] for message in entry.get('messaging', ())]
+        results = [None] * len(messages)
+        errors = {}
+
+        def handle_event(index):
+            try:
+                results[index] = self._handle_event(messages[index])
+            except Exception:
+                errors[index] = sys.exc_info()
+                results[index] = errors[index][1]
+
+        if not concurrency or concurrency < 2 or len(messages) < 2:
+            for index in range(len(messages)):
+                handle_event(index)
+        else:
+            by_sender = collections.OrderedDict()
+            for index, message in enumerate(messages):
+                sender_id = str(message.get('sender', {}).get('id'))
+                by_sender.setdefault(sender_id, []).append(index)
+
+            def handle_sender(indexes):
+                for index in indexes:
+                    handle_event(index)
+
+            for _ in imap_unordered(handle_sender, by_sender.values(), concurrency):
+                pass
+
+        if errors and not return_exceptions:
+            first = min(errors)
+            for index in sorted(errors)[1:]:
+                logger.error('Handler for event %d failed', index, exc_info=errors[index])
+            six.reraise(*errors[first])
+        return results
+
+    def _handle_event(self, message):
+        self.last_message = message
+        for event_type in self.EVENT_TYPES:
+            if message.get(event_type):
+                return self._dispatch(event_type, message)
+
+    def _dispatch(self, event_type, message):
+        handler = self._handle_message if event_type == 'message' else getattr(self, event_type)
+        metrics = self.client.metrics
+        tracer = self.client.tracer
+        if metrics is None and tracer is None:
+            return handler(message)
+
+        started = monotonic()
+        span = None
+        if tracer is not None:
+            span = start_span(tracer, 'messenger.handle', event_type=event_type,
+                              sender_id=message.get('sender', {}).get('id'))
+        error = None
+        try:
+            return handler(message)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            if metrics is not None:
+                metrics.record_event(event_type, monotonic() - started, error is not None)
+            if span is not None:
+                end_span(tracer, span, error)
+
+    def _handle_message(self, message):
+        if self.typing_delay is None:
+            return self.message(message)
+
+        indicator = TypingIndicator(self.client, message['sender']['id'], self.typing_delay,
+                                    self.typing_refresh)
+        self._local.typing_indicator = indicator
+        indicator.start()
+        try:
+            return self.message(message)
+        finally:
+            # Nothing was sent to replace the indicator
+            self._stop_typing(hide=True)
+
+    def _stop_typing(self, hide=False):
+        indicator = getattr(self._local, 'typing_indicator', None)
+        if indicator is not None:
+            indicator.stop(hide)
+            self._local.typing_indicator = None
 
     def get_user(self, fields=None, timeout=None):
         return self.client.get_user_data(self.get_user_id(), fields=fields, timeout=timeout)
 
     def send(self, payload, messaging_type='RESPONSE', notification_type='REGULAR', timeout=None, tag=None):
+        self._stop_typing()
         return self.client.send(payload, self.get_user_id(), messaging_type=messaging_type,
                                 notification_type=notification_type, timeout=timeout, tag=tag)
 
     def send_action(self, sender_action, timeout=None):
+        # Other actions, e.g. `mark_seen`, don't replace the indicator
+        self._stop_typing(hide=sender_action not in ('typing_on', 'typing_off'))
         return self.client.send_action(sender_action, self.get_user_id(), timeout=timeout)
 
     def get_user_id(self):
@@ -307,6 +1234,9 @@ class BaseMessenger(object):
     def set_messenger_profile(self, data, timeout=None):
         return self.client.set_messenger_profile(data, timeout=timeout)
 
+    def sync_profile(self, profile, delete_missing=False, timeout=None):
+        return self.client.sync_profile(profile, delete_missing=delete_missing, timeout=timeout)
+
     def delete_get_started(self, timeout=None):
         return self.client.delete_get_started(timeout=timeout)
 
@@ -0,0 +1,176 @@
+from __future__ import absolute_import
+
+import socket
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+from urllib3.util.connection import allowed_gai_family
+
+from .rate_limit import monotonic
+from .tracing import current_span
+
+GRAPH_API_PREFIX = 'https://graph.facebook.com'
+
+
+def keepalive_socket_options(idle=60, interval=10, count=3):
+    """
+        Socket options that enable TCP keep-alive probes, so that idle
+        pooled connections aren't silently dropped by NATs and load
+        balancers between us and Facebook.
+    """
+    options = [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+    if hasattr(socket, 'TCP_KEEPIDLE'):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, idle))
+    elif hasattr(socket, 'TCP_KEEPALIVE'):
+        # macOS
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPALIVE, idle))
+    if hasattr(socket, 'TCP_KEEPINTVL'):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, interval))
+    if hasattr(socket, 'TCP_KEEPCNT'):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPCNT, count))
+    return options
+
+
+class _TracedConnectionMixin(object):
+    """
+        Records the phases of a request in the active span, if there is
+        one (see `fbmessenger.tracing`).
+    """
+
+    def _new_conn(self):
+        span = current_span()
+        if span is None:
+            return super(_TracedConnectionMixin, self)._new_conn()
+
+        started = monotonic()
+        host = getattr(self, '_dns_host', None)
+        if host is None:
+            # Older urllib3 versions resolve the name along with connecting
+            try:
+                return super(_TracedConnectionMixin, self)._new_conn()
+            finally:
+                span.add_phase('connect', monotonic() - started)
+
+        # Resolve the name here, so that it can be timed separately, then
+        # try each address in turn like urllib3 does
+        try:
+            addresses = []
+            for info in socket.getaddrinfo(host, self.port, allowed_gai_family(), socket.SOCK_STREAM):
+                if info[4][0] not in addresses:
+                    addresses.append(info[4][0])
+        except socket.gaierror:
+            # Let urllib3 raise its usual error
+            return super(_TracedConnectionMixin, self)._new_conn()
+        resolved = monotonic()
+        span.add_phase('dns', resolved - started)
+        try:
+            for i, address in enumerate(addresses):
+                self._dns_host = address
+                try:
+                    return super(_TracedConnectionMixin, self)._new_conn()
+                except (ConnectTimeoutError, NewConnectionError):
+                    if i == len(addresses) - 1:
+                        raise
+        finally:
+            self._dns_host = host
+            span.add_phase('connect', monotonic() - resolved)
+
+    def request(self, *args, **kwargs):
+        span = current_span()
+        if span is None:
+            return super(_TracedConnectionMixin, self).request(*args, **kwargs)
+        started = monotonic()
+        connecting = span.connection_time()
+        try:
+            return super(_TracedConnectionMixin, self).request(*args, **kwargs)
+        finally:
+            # Plain HTTP connections are opened when the request is written
+            span.add_phase('send', monotonic() - started - (span.connection_time() - connecting))
+
+    def getresponse(self, *args, **kwargs):
+        span = current_span()
+        if span is None:
+            return super(_TracedConnectionMixin, self).getresponse(*args, **kwargs)
+        started = monotonic()
+        try:
+            return super(_TracedConnectionMixin, self).getresponse(*args, **kwargs)
+        finally:
+            span.add_phase('ttfb', monotonic() - started)
+
+
+class TracedHTTPConnection(_TracedConnectionMixin, HTTPConnection):
+    pass
+
+
+class TracedHTTPSConnection(_TracedConnectionMixin, HTTPSConnection):
+
+    def connect(self):
+        span = current_span()
+        if span is None:
+            return super(TracedHTTPSConnection, self).connect()
+        started = monotonic()
+        connecting = span.connection_time()
+        try:
+            return super(TracedHTTPSConnection, self).connect()
+        finally:
+            span.add_phase('tls', monotonic() - started - (span.connection_time() - connecting))
+
+
+class _TracedPoolMixin(object):
+
+    def _get_conn(self, *args, **kwargs):
+        span = current_span()
+        if span is None:
+            return super(_TracedPoolMixin, self)._get_conn(*args, **kwargs)
+        started = monotonic()
+        try:
+            return super(_TracedPoolMixin, self)._get_conn(*args, **kwargs)
+        finally:
+            span.add_phase('pool_wait', monotonic() - started)
+
+
+class TracedHTTPConnectionPool(_TracedPoolMixin, HTTPConnectionPool):
+    ConnectionCls = TracedHTTPConnection
+
+
+class TracedHTTPSConnectionPool(_TracedPoolMixin, HTTPSConnectionPool):
+    ConnectionCls = TracedHTTPSConnection
+
+
+class GraphAdapter(HTTPAdapter):
+    """
+        `requests` transport adapter tuned for talking to the Graph API
+        from many threads at once.
+
+        @optional:
+            pool_connections: number of per-host pools to cache
+            pool_maxsize: connections kept open per host; set this to at
+                least the number of threads sharing the session, otherwise
+                connections are thrown away and re-established (including
+                a new TLS handshake) under load
+            pool_block: wait for a free connection rather than opening a
+                throwaway one when the pool is exhausted, which caps the
+                total number of open sockets at `pool_maxsize`
+            keepalive: enable TCP keep-alive probes on pooled connections
+            tracing: record the phases of each request (DNS, connect, TLS,
+                ...) in the active span, see `fbmessenger.tracing`
+            max_retries
+    """
+
+    def __init__(self, keepalive=True, tracing=False, **kwargs):
+        self.socket_options = list(HTTPConnection.default_socket_options)
+        if keepalive:
+            self.socket_options.extend(keepalive_socket_options())
+        self.tracing = tracing
+        super(GraphAdapter, self).__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['socket_options'] = self.socket_options
+        super(GraphAdapter, self).init_poolmanager(*args, **kwargs)
+        if self.tracing:
+            self.poolmanager.pool_classes_by_scheme = {
+                'http': TracedHTTPConnectionPool,
+                'https': TracedHTTPSConnectionPool,
+            }
@@ -0,0 +1,600 @@
+"""
+asyncio support for the Messenger Platform.
+
+Requires Python 3.8+ and `aiohttp` (`pip install fbmessenger[async]`).
+"""
+import asyncio
+import json
+
+import aiohttp
+
+from . import MessengerClient, logger
+from .adapters import keepalive_socket_options
+from .circuit_breaker import get_endpoint
+from .coalescing import DEFER, SEND
+from .multipart import guess_content_type, open_filedata
+from .rate_limit import monotonic
+from .tracing import Span
+from .responses import raw_response
+from .retry import IDEMPOTENT_METHODS, PERMANENT, TRANSIENT, classify_error, get_error
+
+
+async def imap_unordered(func, iterable, concurrency, return_exceptions=False):
+    """
+        asyncio counterpart of `fbmessenger.concurrency.imap_unordered`:
+        awaits `func(item)` for each item of `iterable`, at most
+        `concurrency` at once, and yields `(item, result)` pairs as they
+        complete. With `return_exceptions`, exceptions are yielded as
+        results rather than raised.
+    """
+    if concurrency < 1:
+        raise ValueError('`concurrency` must be at least 1')
+
+    pending = {}
+    try:
+        for item in iterable:
+            while len(pending) >= concurrency:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield pending.pop(task), _result(task, return_exceptions)
+            pending[asyncio.ensure_future(func(item))] = item
+
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield pending.pop(task), _result(task, return_exceptions)
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def _result(task, return_exceptions):
+    if return_exceptions and not task.cancelled():
+        error = task.exception()
+        if isinstance(error, Exception):
+            return error
+    return task.result()
+
+
+class HTTP2ConnectError(aiohttp.ClientConnectionError):
+    """
+        Raised by `AsyncHTTP2Session` when no connection could be made.
+    """
+
+
+class _HTTP2Response(object):
+    # The parts of `aiohttp.ClientResponse` used by the client
+
+    def __init__(self, response):
+        self.status = response.status_code
+        self.headers = response.headers
+        self._response = response
+
+    async def json(self, content_type=None):
+        return self._response.json()
+
+    async def read(self):
+        return self._response.content
+
+
+class _HTTP2Request(object):
+
+    def __init__(self, session, method, url, kwargs):
+        self._session = session
+        self._method = method
+        self._url = url
+        self._kwargs = kwargs
+
+    async def __aenter__(self):
+        return _HTTP2Response(await self._session._send(self._method, self._url, **self._kwargs))
+
+    async def __aexit__(self, exc_type, exc, tb):
+        pass
+
+
+async def _write_chunks(payload):
+    """
+        Yields the body of an aiohttp payload (e.g. a multipart form) in
+        chunks as it is written.
+    """
+    chunks = asyncio.Queue(1)
+
+    class Writer(object):
+        async def write(self, chunk):
+            await chunks.put(bytes(chunk))
+
+    async def write():
+        try:
+            await payload.write(Writer())
+        finally:
+            await chunks.put(None)
+
+    task = asyncio.ensure_future(write())
+    try:
+        while True:
+            chunk = await chunks.get()
+            if chunk is None:
+                break
+            yield chunk
+        await task
+    finally:
+        task.cancel()
+
+
+class AsyncHTTP2Session(object):
+    """
+        Stands in for the `aiohttp.ClientSession` used by
+        `AsyncMessengerClient`, sending requests over HTTP/2 with an
+        `httpx.AsyncClient`. Requires `httpx` with HTTP/2 support
+        (`pip install fbmessenger[http2]`).
+
+        Network errors are raised as their `aiohttp` equivalents, so
+        retries and circuit breakers treat them the same way.
+
+        @optional:
+            max_connections: maximum number of open connections. Each one
+                carries many concurrent requests, so a few are enough.
+            keepalive_expiry: seconds an idle connection is kept open
+            client: an `httpx.AsyncClient` to use instead of creating one
+    """
+
+    def __init__(self, max_connections=10, keepalive_expiry=15, client=None):
+        import httpx
+        self._httpx = httpx
+        if client is None:
+            client = httpx.AsyncClient(
+                http2=True,
+                limits=httpx.Limits(max_connections=max_connections,
+                                    max_keepalive_connections=max_connections,
+                                    keepalive_expiry=keepalive_expiry),
+                timeout=None,
+            )
+        self.client = client
+
+    @property
+    def closed(self):
+        return self.client.is_closed
+
+    def request(self, method, url, **kwargs):
+        return _HTTP2Request(self, method, url, kwargs)
+
+    async def _send(self, method, url, params=None, data=None, json=None, headers=None, timeout=None):
+        httpx = self._httpx
+        content = {}
+        if isinstance(data, aiohttp.FormData):
+            payload = data()
+            headers = dict(headers or {}, **{'Content-Type': payload.content_type})
+            content['content'] = _write_chunks(payload)
+        elif isinstance(data, dict):
+            content['data'] = data
+        elif data is not None:
+            content['content'] = data
+        if timeout is not None:
+            timeout = httpx.Timeout(None, connect=timeout.sock_connect, read=timeout.sock_read)
+
+        try:
+            return await self.client.request(method, url, params=params, json=json, headers=headers,
+                                             timeout=timeout, **content)
+        except httpx.TimeoutException:
+            raise asyncio.TimeoutError()
+        except httpx.ConnectError as e:
+            raise HTTP2ConnectError(str(e))
+        except httpx.TransportError as e:
+            raise aiohttp.ClientConnectionError(str(e))
+
+    async def close(self):
+        await self.client.aclose()
+
+
+# aiohttp tracing signals bounding each phase of a request
+_TRACE_PHASES = (
+    ('on_connection_queued_start', 'on_connection_queued_end', 'pool_wait'),
+    ('on_dns_resolvehost_start', 'on_dns_resolvehost_end', 'dns'),
+    ('on_connection_create_start', 'on_connection_create_end', 'connect'),
+    ('on_request_headers_sent', 'on_request_end', 'ttfb'),
+)
+
+
+def trace_config():
+    """
+        Returns an `aiohttp.TraceConfig` recording the phases of requests
+        made with a `Span` as their `trace_request_ctx`.
+    """
+    config = aiohttp.TraceConfig()
+
+    def phase_started(phase):
+        async def on_start(session, context, params):
+            if isinstance(context.trace_request_ctx, Span):
+                setattr(context, phase, monotonic())
+        return on_start
+
+    def phase_ended(phase):
+        async def on_end(session, context, params):
+            started = getattr(context, phase, None)
+            if started is not None:
+                context.trace_request_ctx.add_phase(phase, monotonic() - started)
+        return on_end
+
+    for start, end, phase in _TRACE_PHASES:
+        getattr(config, start).append(phase_started(phase))
+        getattr(config, end).append(phase_ended(phase))
+    return config
+
+
+class KeepaliveConnector(aiohttp.TCPConnector):
+    """
+        An `aiohttp.TCPConnector` that enables TCP keep-alive probes on the
+        connections it opens, like `fbmessenger.adapters.GraphAdapter`.
+    """
+
+    async def _wrap_create_connection(self, *args, **kwargs):
+        transport, protocol = await super(KeepaliveConnector, self)._wrap_create_connection(*args, **kwargs)
+        sock = transport.get_extra_info('socket')
+        if sock is not None:
+            for option in keepalive_socket_options():
+                sock.setsockopt(*option)
+        return transport, protocol
+
+
+class AsyncMessengerClient(MessengerClient):
+    """
+        asyncio twin of `MessengerClient`.
+
+        Every public method has the same signature as its blocking
+        counterpart but returns an awaitable, e.g.
+
+            async with AsyncMessengerClient(token) as client:
+                await client.send({'text': 'hi'}, recipient_id)
+
+        All requests share a single `aiohttp.ClientSession` (and so a
+        single connection pool), which is created lazily on first use so
+        that the client can be constructed outside of a running loop.
+    """
+
+    def __init__(self, page_access_token, **kwargs):
+        """
+            @required:
+                page_access_token
+            @optional:
+                session: an `aiohttp.ClientSession` to use for all requests
+                api_version
+                app_secret
+                pool_maxsize: maximum number of open connections (default 100)
+                keepalive: enable TCP keep-alive probes on pooled connections
+                    (default True), like `MessengerClient`
+                keepalive_timeout: seconds an idle connection is kept open
+                    for reuse
+                http2: send requests over HTTP/2 with an `AsyncHTTP2Session`
+                tracer: a `fbmessenger.tracing.Tracer`. The time spent in
+                    each phase of a request is only recorded by the default
+                    session.
+        """
+        self.http2 = kwargs.get('http2', False)
+        self.pool_maxsize = kwargs.get('pool_maxsize', 100)
+        self.keepalive = kwargs.get('keepalive', True)
+        self.keepalive_timeout = kwargs.get('keepalive_timeout', 15)
+        for option in ('outbox', 'dead_letters'):
+            if kwargs.get(option) is not None:
+                raise ValueError('`{}` is not supported by `AsyncMessengerClient`'.format(option))
+        super(AsyncMessengerClient, self).__init__(page_access_token, **kwargs)
+
+    def _default_session(self, **kwargs):
+        # `aiohttp.ClientSession` must be created inside a running loop
+        return None
+
+    def _get_session(self):
+        if self.session is None or self.session.closed:
+            if self.http2:
+                self.session = AsyncHTTP2Session(max_connections=self.pool_maxsize,
+                                                 keepalive_expiry=self.keepalive_timeout)
+                return self.session
+            connector_class = KeepaliveConnector if self.keepalive else aiohttp.TCPConnector
+            connector = connector_class(limit=self.pool_maxsize, keepalive_timeout=self.keepalive_timeout)
+            trace_configs = None if self.tracer is None else [trace_config()]
+            self.session = aiohttp.ClientSession(connector=connector, trace_configs=trace_configs)
+        return self.session
+
+    async def get_user_data(self, recipient_id, fields=None, timeout=None):
+        params = self._user_data_params(fields)
+
+        if self.profile_cache is not None:
+            profile = self.profile_cache.get(recipient_id, params['fields'].split(','))
+            if profile is not None:
+                return profile
+
+        params.update(self.auth_args)
+
+        profile = await self._request(
+            'get',
+            '{recipient_id}'.format(recipient_id=recipient_id),
+            params=params,
+            timeout=timeout
+        )
+        self._cache_profile(recipient_id, params['fields'], profile)
+        return profile
+
+    async def get_users_data(self, recipient_ids, fields=None, concurrency=4, timeout=None):
+        params = self._user_data_params(fields)
+        profiles, chunks = self._users_data_chunks(recipient_ids, params['fields'])
+        params.update(self.auth_args)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch(chunk):
+            async with semaphore:
+                try:
+                    response = await self._request(
+                        'get',
+                        '',
+                        endpoint='user_profile',
+                        params=dict(params, ids=','.join(str(recipient_id) for recipient_id in chunk)),
+                        timeout=timeout
+                    )
+                except Exception as e:
+                    response = e
+            return self._users_data_results(chunk, params['fields'], response)
+
+        for results in await asyncio.gather(*[fetch(chunk) for chunk in chunks]):
+            profiles.update(results)
+        return profiles
+
+    async def send(self, payload, recipient_id, messaging_type='RESPONSE', notification_type='REGULAR',
+                   timeout=None, tag=None):
+        body = self._send_body(payload, recipient_id, messaging_type, notification_type, tag)
+        body['message'] = await self._reuse_attachment(payload, timeout=timeout)
+        self._before_send((recipient_id,))
+
+        return await self._request(
+            'post',
+            'me/messages',
+            recipients=(recipient_id,),
+            typed=True,
+            params=self.auth_args,
+            json=body,
+            timeout=timeout
+        )
+
+    async def send_action(self, sender_action, recipient_id, timeout=None):
+        if self.action_coalescer is not None:
+            decision = self.action_coalescer.before_action(recipient_id, sender_action)
+            if decision == DEFER:
+                loop = asyncio.get_event_loop()
+                self.action_coalescer.defer(
+                    recipient_id,
+                    lambda: asyncio.ensure_future(self._send_action(sender_action, recipient_id, timeout)),
+                    call_later=loop.call_later
+                )
+            if decision != SEND:
+                return self._result({'recipient_id': recipient_id})
+        return await self._send_action(sender_action, recipient_id, timeout)
+
+    async def upload_attachment(self, attachment, timeout=None, filedata=None):
+        if filedata is not None:
+            return await self._upload_file(attachment, filedata, timeout)
+
+        self._validate_upload(attachment)
+        cached = self._cached_upload(attachment, attachment.url)
+        if cached is not None:
+            return cached
+
+        response = await self._request(
+            'post',
+            'me/message_attachments',
+            typed=True,
+            params=self.auth_args,
+            json={
+                'message': self._upload_message(attachment)
+            },
+            timeout=timeout
+        )
+        self._cache_attachment(attachment, attachment.url, response)
+        return response
+
+    def upload_attachments(self, uploads, concurrency=4, timeout=None):
+        """
+            Async generator version of `MessengerClient.upload_attachments`.
+        """
+        def upload(item):
+            attachment, filedata = item
+            return self.upload_attachment(attachment, timeout=timeout, filedata=filedata)
+
+        return imap_unordered(upload, uploads, concurrency, return_exceptions=True)
+
+    async def _upload_file(self, attachment, filedata, timeout):
+        self._validate_upload(attachment, from_file=True)
+        loop = asyncio.get_event_loop()
+        fileobj, filename, should_close = await loop.run_in_executor(None, open_filedata, filedata)
+        try:
+            key = await loop.run_in_executor(None, self._file_key, fileobj)
+            cached = self._cached_upload(attachment, key)
+            if cached is not None:
+                return cached
+
+            start = fileobj.tell()
+            message = json.dumps(self._upload_message(attachment))
+
+            def form():
+                # A form can only be sent once, so build a new one (from the
+                # start of the file) for every attempt
+                fileobj.seek(start)
+                data = aiohttp.FormData()
+                data.add_field('message', message)
+                data.add_field('filedata', fileobj, filename=filename,
+                               content_type=guess_content_type(filename))
+                return data
+
+            response = await self._request(
+                'post',
+                'me/message_attachments',
+                typed=True,
+                params=self.auth_args,
+                data=form,
+                timeout=timeout
+            )
+        finally:
+            if should_close:
+                fileobj.close()
+        self._cache_attachment(attachment, key, response)
+        return response
+
+    async def _reuse_attachment(self, payload, timeout=None):
+        attachment = self._reusable_attachment(payload)
+        if attachment is None:
+            return payload
+        response = raw_response(await self.upload_attachment(attachment, timeout=timeout))
+        if get_error(response) is not None or not response.get('attachment_id'):
+            logger.warning('Failed to upload %s, sending by URL instead: %s', attachment.url, response)
+            return payload
+        return self._with_attachment_id(payload, response['attachment_id'])
+
+    async def sync_profile(self, profile, delete_missing=False, timeout=None):
+        desired, fields = self._profile_fields(profile, delete_missing)
+        current = await self.get_messenger_profile(fields, timeout=timeout)
+        changed, deleted = self._profile_changes(desired, current, fields)
+
+        responses = []
+        if changed:
+            responses.append(await self.set_messenger_profile(changed, timeout=timeout))
+        if deleted:
+            responses.append(await self.delete_messenger_profile(deleted, timeout=timeout))
+        return responses
+
+    async def send_batch(self, items, timeout=None):
+        results = []
+        for recipient_ids, operations in self._batch_operations(items):
+            self._before_send(recipient_ids)
+            started = monotonic()
+            response = await self._request(
+                'post',
+                '',
+                recipients=recipient_ids,
+                params=self.auth_args,
+                data={
+                    'batch': self._encode_json(operations).decode('utf8'),
+                    'include_headers': 'false',
+                },
+                timeout=timeout
+            )
+            results.extend(self._batch_results(response, len(operations), monotonic() - started))
+        return results
+
+    async def broadcast(self, payload, recipient_ids, messaging_type='RESPONSE', notification_type='REGULAR',
+                        tag=None, concurrency=10, timeout=None):
+        """
+            Async generator version of `MessengerClient.broadcast`.
+        """
+        self._send_body(payload, None, messaging_type, notification_type, tag)
+        prefix = self._broadcast_prefix(await self._reuse_attachment(payload, timeout=timeout),
+                                        messaging_type, notification_type, tag)
+
+        def send(recipient_id):
+            self._before_send((recipient_id,))
+            return self._request(
+                'post',
+                'me/messages',
+                recipients=(recipient_id,),
+                typed=True,
+                params=self.auth_args,
+                data=prefix + self._encode_json(recipient_id) + b'}}',
+                headers={'Content-Type': 'application/json'},
+                timeout=timeout
+            )
+
+        async for item in imap_unordered(send, recipient_ids, concurrency, return_exceptions=True):
+            yield item
+
+    async def _request(self, method, path, recipients=None, typed=False, timeout=None, endpoint=None, **kwargs):
+        if timeout is not None:
+            # Mirror `requests`, where `timeout` bounds connecting and
+            # waiting on the socket rather than the whole response.
+            kwargs['timeout'] = aiohttp.ClientTimeout(sock_connect=timeout, sock_read=timeout)
+        kwargs = self._json_kwargs(kwargs)
+
+        url = self._url(path)
+        endpoint = endpoint or get_endpoint(path)
+        breaker = self._circuit_breaker(endpoint)
+        started = monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            probe = breaker is not None and breaker.before_call()
+            r = None
+            span = None
+            try:
+                delay = self._throttle_delay(recipients)
+                if delay:
+                    await asyncio.sleep(delay)
+
+                request_kwargs = kwargs
+                if callable(kwargs.get('data')):
+                    # Bodies that can only be sent once are passed as factories
+                    request_kwargs = dict(kwargs, data=kwargs['data']())
+
+                session = self._get_session()
+                if self.tracer is not None:
+                    # Coroutines share the thread, so the span isn't made active
+                    span = self._start_span(method, endpoint, attempt, activate=False)
+                    if isinstance(session, aiohttp.ClientSession):
+                        request_kwargs = dict(request_kwargs, trace_request_ctx=span)
+
+                sent = monotonic()
+                async with session.request(method.upper(), url, **request_kwargs) as r:
+                    if self.json_codec is None:
+                        data = await r.json(content_type=None)
+                    else:
+                        data = self.json_codec.loads(await r.read())
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                if span is not None:
+                    self._end_span(span, getattr(r, 'status', None), getattr(r, 'headers', None), error=e)
+                if self.metrics is not None:
+                    self._record_request(endpoint, method, getattr(r, 'status', 'error'), None, sent)
+                error_class = self._classify_exception(method, e, r)
+                self._record_outcome(breaker, error_class, e, getattr(r, 'status', None))
+                delay = self._retry_delay(attempt, started, error_class)
+                if delay is None:
+                    raise
+            except BaseException as e:
+                # e.g. cancelled by `asyncio.wait_for`: the outcome is
+                # unknown, so free the probe for another
+                if probe:
+                    breaker.release_probe()
+                if span is not None:
+                    self._end_span(span, getattr(r, 'status', None), getattr(r, 'headers', None), error=e)
+                raise
+            else:
+                if span is not None:
+                    self._end_span(span, r.status, r.headers, data)
+                if self.metrics is not None:
+                    self._record_request(endpoint, method, r.status, data, sent)
+                error_class = classify_error(data, r.status)
+                self._record_outcome(breaker, error_class)
+                delay = self._retry_delay(attempt, started, error_class)
+                if delay is None:
+                    if typed:
+                        return self._result(data, r.status, monotonic() - started, error_class)
+                    return data
+
+            logger.debug('Retrying %s %s in %.2fs (attempt %d)', method.upper(), path, delay, attempt)
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    def _classify_exception(method, exc, response=None):
+        if isinstance(exc, ValueError):
+            if method in IDEMPOTENT_METHODS and response is not None and classify_error(None, response.status):
+                return TRANSIENT
+            return PERMANENT
+        if isinstance(exc, (aiohttp.ClientConnectorError, HTTP2ConnectError)):
+            # The request never reached Facebook
+            return TRANSIENT
+        if method in IDEMPOTENT_METHODS:
+            return TRANSIENT
+        return PERMANENT
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
@@ -0,0 +1,195 @@
+from __future__ import absolute_import
+
+import collections
+import hashlib
+import sqlite3
+import threading
+import time
+
+_MISSING = '__missing__'
+
+
+class MemoryBackend(object):
+    """
+        Thread-safe in-process LRU store holding at most `maxsize` entries.
+
+        Any object with the same `get`, `set` and `delete` methods (e.g. a
+        thin wrapper around Redis or memcached) can be used as a
+        `ProfileCache` backend instead.
+    """
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.pop(key, None)
+            if value is not None:
+                self._data[key] = value
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            if len(self._data) >= self.maxsize:
+                self._data.popitem(last=False)
+            self._data[key] = value
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class ProfileCache(object):
+    """
+        Caches user profiles fetched by `MessengerClient.get_user_data`.
+
+        Entries are stored per user, with each field expiring `ttl` seconds
+        after it was fetched. A lookup is a hit when every requested field
+        is cached and fresh, so fetching `first_name,locale` and later
+        `first_name` only calls the Graph API once. Fields fetched by
+        different calls are merged into the same entry.
+
+        @optional:
+            ttl: seconds a field stays fresh
+            maxsize: number of users kept by the default `MemoryBackend`
+            backend: store to use instead of a `MemoryBackend`
+    """
+
+    def __init__(self, ttl=300, maxsize=10000, backend=None):
+        self.ttl = ttl
+        self.backend = backend if backend is not None else MemoryBackend(maxsize)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, psid, fields):
+        """
+            Returns the cached `fields` for `psid`, or `None` on a miss.
+        """
+        entry = self.backend.get(psid)
+        if entry is not None:
+            now = time.time()
+            profile = {}
+            for field in fields:
+                cached = entry.get(field)
+                if cached is None or cached[1] <= now:
+                    break
+                if cached[0] != _MISSING:
+                    profile[field] = cached[0]
+            else:
+                if 'id' in entry:
+                    profile['id'] = entry['id'][0]
+                self._count(True)
+                return profile
+        self._count(False)
+        return None
+
+    def set(self, psid, fields, profile):
+        """
+            Stores the `fields` of `profile`, as returned by the Graph API,
+            merging them into anything already cached for `psid`.
+        """
+        expires = time.time() + self.ttl
+        entry = dict(self.backend.get(psid) or {})
+        for field in set(fields) | set(profile):
+            # Remember fields Facebook didn't return, so that asking for
+            # them again is still a hit
+            entry[field] = (profile.get(field, _MISSING), expires)
+        self.backend.set(psid, entry)
+
+    def delete(self, psid):
+        self.backend.delete(psid)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+class AttachmentCache(object):
+    """
+        Remembers the `attachment_id` of media uploaded with `is_reusable`,
+        so that each asset only has to be uploaded once.
+
+        Assets are keyed by URL, or by `content_key()` for local files.
+        Entries are kept in a SQLite database at `path`, so they survive
+        restarts and may be shared between processes on the same host, and
+        in memory for fast lookups.
+    """
+
+    def __init__(self, path=':memory:'):
+        self.path = path
+        self._lock = threading.Lock()
+        self._memory = {}
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            if path != ':memory:':
+                self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS attachments ('
+                'attachment_type TEXT NOT NULL, '
+                'key TEXT NOT NULL, '
+                'attachment_id TEXT NOT NULL, '
+                'created REAL NOT NULL, '
+                'PRIMARY KEY (attachment_type, key))'
+            )
+
+    @staticmethod
+    def content_key(fileobj, chunk_size=1024 * 1024):
+        """
+            Returns a key for the contents of a binary file object, read in
+            chunks from its current position.
+        """
+        digest = hashlib.sha256()
+        for chunk in iter(lambda: fileobj.read(chunk_size), b''):
+            digest.update(chunk)
+        return 'sha256:' + digest.hexdigest()
+
+    def get(self, attachment_type, key):
+        attachment_id = self._memory.get((attachment_type, key))
+        if attachment_id is None:
+            with self._lock:
+                row = self._conn.execute(
+                    'SELECT attachment_id FROM attachments WHERE attachment_type = ? AND key = ?',
+                    (attachment_type, key)
+                ).fetchone()
+            if row is not None:
+                attachment_id = self._memory[(attachment_type, key)] = row[0]
+        return attachment_id
+
+    def set(self, attachment_type, key, attachment_id):
+        attachment_id = str(attachment_id)
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO attachments (attachment_type, key, attachment_id, created) '
+                'VALUES (?, ?, ?, ?)',
+                (attachment_type, key, attachment_id, time.time())
+            )
+        self._memory[(attachment_type, key)] = attachment_id
+
+    def delete(self, attachment_type, key):
+        with self._lock, self._conn:
+            self._conn.execute(
+                'DELETE FROM attachments WHERE attachment_type = ? AND key = ?',
+                (attachment_type, key)
+            )
+        self._memory.pop((attachment_type, key), None)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,139 @@
+from __future__ import absolute_import
+
+import logging
+import threading
+
+from .rate_limit import monotonic
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """
+        Raised instead of making a request while the circuit for its
+        endpoint is open.
+    """
+
+    def __init__(self, endpoint, retry_after):
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+        super(CircuitOpenError, self).__init__(
+            'Circuit for `{}` is open, retry in {:.1f}s'.format(endpoint, retry_after))
+
+
+class CircuitBreaker(object):
+    """
+        Stops calling an endpoint after `failure_threshold` consecutive
+        failures (network errors, timeouts and 5xx responses).
+
+        Once `recovery_timeout` seconds have passed, up to
+        `half_open_max_calls` probe requests are let through: if one
+        succeeds the circuit closes again, if one fails it re-opens.
+    """
+
+    def __init__(self, name='', failure_threshold=5, recovery_timeout=30, half_open_max_calls=1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.failures = 0
+        self._state = CLOSED
+        self._opened_at = None
+        self._probes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        if self._state == OPEN and monotonic() - self._opened_at >= self.recovery_timeout:
+            self._state = HALF_OPEN
+            self._probes = 0
+        return self._state
+
+    def before_call(self):
+        """
+            Raises `CircuitOpenError` if a request may not be made now.
+            Returns `True` if the request is a half-open probe, which must
+            end with `record_success`, `record_failure` or `release_probe`.
+        """
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return False
+            if state == HALF_OPEN and self._probes < self.half_open_max_calls:
+                self._probes += 1
+                return True
+            if state == OPEN:
+                retry_after = self.recovery_timeout - (monotonic() - self._opened_at)
+            else:
+                retry_after = 0
+        raise CircuitOpenError(self.name, max(retry_after, 0))
+
+    def release_probe(self):
+        """
+            Gives back the slot of a probe that ended without an outcome,
+            e.g. because it was cancelled.
+        """
+        with self._lock:
+            if self._state == HALF_OPEN and self._probes > 0:
+                self._probes -= 1
+
+    def record_success(self):
+        with self._lock:
+            if self._state != CLOSED:
+                logger.info('Circuit for `%s` closed', self.name)
+            self._state = CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            state = self._current_state()
+            if state == HALF_OPEN or (state == CLOSED and self.failures >= self.failure_threshold):
+                logger.warning('Circuit for `%s` opened after %d failures', self.name, self.failures)
+                self._state = OPEN
+                self._opened_at = monotonic()
+
+
+class CircuitBreakers(object):
+    """
+        One `CircuitBreaker` per Graph API endpoint, created on demand with
+        the given settings.
+    """
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, endpoint):
+        breaker = self._breakers.get(endpoint)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.get(endpoint)
+                if breaker is None:
+                    breaker = self._breakers[endpoint] = CircuitBreaker(endpoint, **self.kwargs)
+        return breaker
+
+
+def get_endpoint(path):
+    """
+        Maps a Graph API path to the endpoint name breakers are keyed by,
+        e.g. `me/messages` to `messages`.
+    """
+    if not path:
+        return 'batch'
+    if path == 'me':
+        return 'account_linking'
+    if path.startswith('me/'):
+        return {
+            'message_attachments': 'attachments',
+        }.get(path[3:], path[3:])
+    return 'user_profile'
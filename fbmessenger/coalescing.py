@@ -0,0 +1,183 @@
+from __future__ import absolute_import
+
+import collections
+import heapq
+import itertools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .rate_limit import monotonic
+
+logger = logging.getLogger(__name__)
+
+# Decisions returned by `ActionCoalescer.before_action`
+SEND = 'send'
+SKIP = 'skip'
+DEFER = 'defer'
+
+
+class _Timer(object):
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class Scheduler(object):
+    """
+        Runs callbacks after a delay, using one timer thread (started on
+        first use) and a few worker threads rather than a thread per
+        callback.
+    """
+
+    def __init__(self, workers=4):
+        self.workers = workers
+        self._queue = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._executor = None
+
+    def call_later(self, delay, callback):
+        """
+            Returns a handle whose `cancel()` stops `callback` from running.
+        """
+        timer = _Timer(callback)
+        with self._cond:
+            if self._thread is None:
+                self._executor = ThreadPoolExecutor(self.workers)
+                self._thread = threading.Thread(target=self._run, name='fbmessenger-scheduler')
+                self._thread.daemon = True
+                self._thread.start()
+            heapq.heappush(self._queue, (monotonic() + delay, next(self._counter), timer))
+            self._cond.notify()
+        return timer
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if not self._queue:
+                        self._cond.wait()
+                        continue
+                    delay = self._queue[0][0] - monotonic()
+                    if delay <= 0:
+                        timer = heapq.heappop(self._queue)[2]
+                        break
+                    self._cond.wait(delay)
+            if not timer.cancelled:
+                self._executor.submit(self._call, timer.callback)
+
+    @staticmethod
+    def _call(callback):
+        try:
+            callback()
+        except Exception:
+            logger.exception('Scheduled callback failed')
+
+
+class ActionCoalescer(object):
+    """
+        Cuts redundant sender actions, per recipient:
+
+        - `typing_on` is skipped if it was already sent in the last
+          `window` seconds (and no message has been sent since)
+        - `typing_off` is held back for `window` seconds, and dropped if a
+          message is sent in the meantime, as that hides the indicator anyway
+        - `mark_seen` is skipped if it was already sent in the last
+          `window` seconds
+
+            client = MessengerClient(page_access_token, action_coalescer=ActionCoalescer(window=2))
+
+        Skipped and deferred actions return `{'recipient_id': recipient_id}`
+        straight away. State is kept for at most `maxsize` recipients.
+    """
+
+    def __init__(self, window=1.0, maxsize=10000, scheduler=None):
+        self.window = window
+        self.maxsize = maxsize
+        self.scheduler = scheduler or Scheduler()
+        self.skipped = 0
+        self._state = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _entry(self, recipient_id):
+        # [typing_on sent at, mark_seen sent at, pending typing_off]
+        key = str(recipient_id)
+        entry = self._state.pop(key, None)
+        if entry is None:
+            entry = [None, None, None]
+            if len(self._state) >= self.maxsize:
+                self._state.popitem(last=False)
+        self._state[key] = entry
+        return entry
+
+    def _recent(self, sent_at, now):
+        return sent_at is not None and now - sent_at < self.window
+
+    def before_action(self, recipient_id, sender_action):
+        """
+            Returns whether to `SEND`, `SKIP` or `DEFER` a sender action.
+        """
+        now = monotonic()
+        with self._lock:
+            entry = self._entry(recipient_id)
+            if sender_action == 'typing_on':
+                if entry[2] is not None:
+                    # Typing was never turned off
+                    entry[2].cancel()
+                    entry[2] = None
+                if self._recent(entry[0], now):
+                    self.skipped += 1
+                    return SKIP
+                entry[0] = now
+            elif sender_action == 'typing_off':
+                if entry[2] is not None:
+                    self.skipped += 1
+                    return SKIP
+                return DEFER
+            elif sender_action == 'mark_seen':
+                if self._recent(entry[1], now):
+                    self.skipped += 1
+                    return SKIP
+                entry[1] = now
+        return SEND
+
+    def defer(self, recipient_id, callback, call_later=None):
+        """
+            Runs `callback` (which sends `typing_off`) after `window`
+            seconds unless a message is sent to `recipient_id` first.
+            `call_later(delay, callback)` defaults to the scheduler's.
+        """
+        call_later = call_later or self.scheduler.call_later
+
+        def fire():
+            with self._lock:
+                entry = self._state.get(str(recipient_id))
+                if entry is None or entry[2] is not handle:
+                    return
+                entry[0] = entry[2] = None
+            callback()
+
+        with self._lock:
+            entry = self._entry(recipient_id)
+            handle = entry[2] = call_later(self.window, fire)
+
+    def before_send(self, recipient_id):
+        """
+            Called before a message is sent to `recipient_id`, which turns
+            the typing indicator off.
+        """
+        with self._lock:
+            entry = self._state.get(str(recipient_id))
+            if entry is None:
+                return
+            if entry[2] is not None:
+                entry[2].cancel()
+                entry[2] = None
+                self.skipped += 1
+            entry[0] = None
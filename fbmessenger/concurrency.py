@@ -0,0 +1,39 @@
+from __future__ import absolute_import
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+
+
+def imap_unordered(func, iterable, concurrency, return_exceptions=False):
+    """
+        Calls `func` on each item of `iterable` using up to `concurrency`
+        threads and yields `(item, result)` pairs as they complete.
+
+        `iterable` is consumed lazily and at most `concurrency` items are in
+        flight at once, so memory use doesn't grow with the input size.
+
+        An exception raised by `func` is re-raised, ending the iteration,
+        unless `return_exceptions` is set: then it is yielded as the item's
+        result and the other items carry on.
+    """
+    if concurrency < 1:
+        raise ValueError('`concurrency` must be at least 1')
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = {}
+        for item in iterable:
+            if len(pending) >= concurrency:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), _result(future, return_exceptions)
+            pending[executor.submit(func, item)] = item
+
+        for future in as_completed(pending):
+            yield pending[future], _result(future, return_exceptions)
+
+
+def _result(future, return_exceptions):
+    if return_exceptions:
+        error = future.exception()
+        if isinstance(error, Exception):
+            return error
+    return future.result()
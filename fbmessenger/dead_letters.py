@@ -0,0 +1,231 @@
+"""
+Keeps failed sends so that they can be sent again later.
+
+    dead_letters = DeadLetterStore('dead_letters.db')
+    client = MessengerClient(page_access_token, dead_letters=dead_letters)
+
+    # Once the incident is over
+    dead_letters.redrive(client, rate=5, error_class=TRANSIENT, since=incident_start)
+"""
+from __future__ import absolute_import
+
+import json
+import sqlite3
+import threading
+import time
+
+import requests
+import six
+
+from .circuit_breaker import CircuitOpenError
+from .json_codecs import decode_raw
+from .rate_limit import TokenBucket
+from .retry import THROTTLED, get_error
+
+
+def attempt_record(path, error_class=None, data=None, status_code=None, exc=None):
+    """
+        Describes one attempt at a Graph API request.
+    """
+    error = get_error(data) or {}
+    return {
+        'at': time.time(),
+        'path': path,
+        'status_code': status_code,
+        'error_class': error_class,
+        'error_code': error.get('code'),
+        'error': repr(exc) if exc is not None else error.get('message'),
+    }
+
+
+class DeadLetter(object):
+    """
+        A failed `send`, `send_action` or `upload_attachment` call.
+
+        `request` holds the arguments it was called with, `attempts` one
+        `attempt_record` per request made (including retries and earlier
+        redrives), and the error fields describe the latest attempt.
+        `created` is when the call first failed.
+    """
+
+    __slots__ = ('id', 'method', 'request', 'recipient_id', 'error_class', 'error_code', 'status_code',
+                 'error', 'attempts', 'created', 'updated')
+
+    def __init__(self, id, method, request, recipient_id, error_class, error_code, status_code, error,
+                 attempts, created, updated):
+        self.id = id
+        self.method = method
+        self.request = request
+        self.recipient_id = recipient_id
+        self.error_class = error_class
+        self.error_code = error_code
+        self.status_code = status_code
+        self.error = error
+        self.attempts = attempts
+        self.created = created
+        self.updated = updated
+
+    def __repr__(self):
+        return 'DeadLetter(id={!r}, method={!r}, error_class={!r}, error_code={!r})'.format(
+            self.id, self.method, self.error_class, self.error_code)
+
+
+_COLUMNS = ('id, method, request, recipient_id, error_class, error_code, status_code, error, attempts, '
+            'created, updated')
+
+
+class DeadLetterStore(object):
+    """
+        Stores failed calls in a SQLite database at `path`, so that they
+        survive restarts.
+
+        Calls that raise a network error, or return a Graph API error once
+        any retries are exhausted, are added by the `MessengerClient` they
+        were made with, and removed once `redrive` sends them successfully.
+    """
+
+    def __init__(self, path=':memory:'):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            if path != ':memory:':
+                self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS dead_letters ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                'method TEXT NOT NULL, '
+                'request TEXT NOT NULL, '
+                'recipient_id TEXT, '
+                'error_class TEXT, '
+                'error_code INTEGER, '
+                'status_code INTEGER, '
+                'error TEXT, '
+                'attempts TEXT NOT NULL, '
+                'created REAL NOT NULL, '
+                'updated REAL NOT NULL)'
+            )
+            self._conn.execute('CREATE INDEX IF NOT EXISTS dead_letters_created ON dead_letters (created)')
+
+    def add(self, method, request, attempts, id=None):
+        """
+            Stores a failed call and returns its id. With `id`, the attempts
+            are added to that dead letter instead, e.g. after a redrive.
+        """
+        last = attempts[-1] if attempts else {}
+        now = time.time()
+        fields = (last.get('error_class'), last.get('error_code'), last.get('status_code'), last.get('error'))
+        with self._lock, self._conn:
+            if id is not None:
+                row = self._conn.execute('SELECT attempts FROM dead_letters WHERE id = ?', (id,)).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        'UPDATE dead_letters SET error_class = ?, error_code = ?, status_code = ?, error = ?, '
+                        'attempts = ?, updated = ? WHERE id = ?',
+                        fields + (json.dumps(json.loads(row[0]) + attempts), now, id)
+                    )
+                    return id
+            recipient_id = request.get('recipient_id')
+            return self._conn.execute(
+                'INSERT INTO dead_letters (method, request, recipient_id, error_class, error_code, '
+                'status_code, error, attempts, created, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (method, json.dumps(request, default=decode_raw),
+                 None if recipient_id is None else str(recipient_id)) + fields + (json.dumps(attempts), now, now)
+            ).lastrowid
+
+    @staticmethod
+    def _dead_letter(row):
+        row = list(row)
+        row[2] = json.loads(row[2])
+        row[8] = json.loads(row[8])
+        return DeadLetter(*row)
+
+    def get(self, id):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT {} FROM dead_letters WHERE id = ?'.format(_COLUMNS), (id,)
+            ).fetchone()
+        return None if row is None else self._dead_letter(row)
+
+    def list(self, error_class=None, method=None, since=None, until=None, limit=None):
+        """
+            Returns the dead letters matching every filter given, oldest
+            first.
+
+            @optional:
+                error_class: `TRANSIENT`, `THROTTLED` or `PERMANENT`, or a
+                    list of them
+                method: `'send'`, `'send_action'` or `'upload_attachment'`
+                since, until: only calls that first failed in this time
+                    range, in seconds since the epoch
+                limit: maximum number to return
+        """
+        clauses = []
+        args = []
+        if error_class is not None:
+            error_classes = [error_class] if isinstance(error_class, six.string_types) else list(error_class)
+            clauses.append('error_class IN ({})'.format(', '.join('?' * len(error_classes))))
+            args.extend(error_classes)
+        if method is not None:
+            clauses.append('method = ?')
+            args.append(method)
+        if since is not None:
+            clauses.append('created >= ?')
+            args.append(since)
+        if until is not None:
+            clauses.append('created < ?')
+            args.append(until)
+        query = 'SELECT {} FROM dead_letters'.format(_COLUMNS)
+        if clauses:
+            query += ' WHERE ' + ' AND '.join(clauses)
+        query += ' ORDER BY id'
+        if limit is not None:
+            query += ' LIMIT ?'
+            args.append(limit)
+        with self._lock:
+            rows = self._conn.execute(query, args).fetchall()
+        return [self._dead_letter(row) for row in rows]
+
+    def delete(self, id):
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM dead_letters WHERE id = ?', (id,))
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM dead_letters').fetchone()[0]
+
+    def redrive(self, client, rate=1, burst=None, stop_on_throttle=True, **filters):
+        """
+            Sends the dead letters matching `filters` (see `list`) again
+            with `client`, at most `rate` per second after an initial burst
+            of `burst` (defaults to `rate`).
+
+            Dead letters that succeed are removed. Those that fail again
+            stay, with the new attempts added to their history. If
+            `stop_on_throttle` is set, the redrive stops as soon as Facebook
+            starts throttling, rather than piling on.
+
+            @outputs:
+                list of `(dead_letter, response)` pairs for the calls made,
+                where `response` is the exception raised if there was one
+        """
+        bucket = TokenBucket(rate, burst)
+        results = []
+        for dead_letter in self.list(**filters):
+            delay = bucket.reserve()
+            if delay:
+                time.sleep(delay)
+            try:
+                response = client._redrive(self, dead_letter)
+            except (requests.RequestException, CircuitOpenError) as e:
+                response = e
+            results.append((dead_letter, response))
+            if stop_on_throttle:
+                current = self.get(dead_letter.id)
+                if current is not None and current.error_class == THROTTLED:
+                    break
+        return results
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
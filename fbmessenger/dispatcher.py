@@ -0,0 +1,108 @@
+from __future__ import absolute_import
+
+import threading
+import zlib
+from concurrent.futures import Future
+
+from six.moves import queue
+
+_STOP = object()
+
+
+class OrderedDispatcher(object):
+    """
+        Sends messages on a pool of worker threads while keeping the
+        messages to any one recipient in order.
+
+        Each recipient is assigned to one of `workers` queues by its id, so
+        messages to the same recipient are always sent one after the other,
+        first in first out, while messages to different recipients are
+        sent in parallel.
+
+            with OrderedDispatcher(client, workers=16) as dispatcher:
+                dispatcher.send(Text('Hello').to_dict(), recipient_id)
+                dispatcher.send(template.to_dict(), recipient_id)
+
+        @required:
+            client: the `MessengerClient` to send with
+        @optional:
+            workers: number of queues and worker threads
+            maxsize: maximum number of messages waiting in each queue,
+                `send` blocks when it is full. `0` means unbounded.
+    """
+
+    def __init__(self, client, workers=8, maxsize=0):
+        if workers < 1:
+            raise ValueError('`workers` must be at least 1')
+        self.client = client
+        self._queues = [queue.Queue(maxsize) for _ in range(workers)]
+        self._threads = []
+        self._closed = False
+        for i, q in enumerate(self._queues):
+            thread = threading.Thread(target=self._worker, args=(q,),
+                                      name='fbmessenger-dispatcher-{}'.format(i))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _queue_for(self, recipient_id):
+        # crc32 rather than hash() so that `123` and `'123'` share a queue
+        key = str(recipient_id).encode('utf8')
+        return self._queues[zlib.crc32(key) % len(self._queues)]
+
+    def submit(self, recipient_id, fn, *args, **kwargs):
+        """
+            Queues `fn(*args, **kwargs)` behind any other work for
+            `recipient_id` and returns a `concurrent.futures.Future` for its
+            result.
+        """
+        if self._closed:
+            raise RuntimeError('Cannot submit to a closed dispatcher')
+        future = Future()
+        self._queue_for(recipient_id).put((future, fn, args, kwargs))
+        return future
+
+    def send(self, payload, recipient_id, **kwargs):
+        """
+            Queues `client.send(payload, recipient_id, **kwargs)`.
+        """
+        return self.submit(recipient_id, self.client.send, payload, recipient_id, **kwargs)
+
+    def send_action(self, sender_action, recipient_id, **kwargs):
+        """
+            Queues `client.send_action(sender_action, recipient_id, **kwargs)`.
+        """
+        return self.submit(recipient_id, self.client.send_action, sender_action, recipient_id, **kwargs)
+
+    @staticmethod
+    def _worker(q):
+        while True:
+            item = q.get()
+            if item is _STOP:
+                return
+            future, fn, args, kwargs = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+
+    def close(self, wait=True):
+        """
+            Stops accepting messages and shuts the workers down once
+            everything already queued has been sent.
+        """
+        if not self._closed:
+            self._closed = True
+            for q in self._queues:
+                q.put(_STOP)
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,105 @@
+"""
+HTTP/2 support for `MessengerClient`.
+
+Over HTTP/1.1 a connection carries one request at a time, so sending
+concurrently needs as many connections as there are requests in flight.
+HTTP/2 multiplexes many requests over each connection instead.
+
+Requires Python 3.8+ and `httpx` with HTTP/2 support
+(`pip install fbmessenger[http2]`).
+"""
+from __future__ import absolute_import
+
+import asyncio
+import threading
+
+import httpx
+import requests
+from urllib3.exceptions import NewConnectionError
+
+from .multipart import CHUNK_SIZE
+from .transports import Transport
+
+
+async def read_chunks(fileobj):
+    for chunk in iter(lambda: fileobj.read(CHUNK_SIZE), b''):
+        yield chunk
+
+
+def request_content(data, headers):
+    """
+        Translates a `requests` style `data` argument for `httpx`, returning
+        the keyword arguments to pass and the headers to send.
+    """
+    if data is None:
+        return {}, headers
+    if isinstance(data, dict):
+        return {'data': data}, headers
+    if hasattr(data, 'read'):
+        # Streamed bodies (e.g. a `MultipartEncoder`) know their length
+        headers = dict(headers or {})
+        if hasattr(data, '__len__'):
+            headers['Content-Length'] = str(len(data))
+        return {'content': read_chunks(data)}, headers
+    return {'content': data}, headers
+
+
+class HTTP2Session(Transport):
+    """
+        Stands in for the `requests.Session` used by `MessengerClient`,
+        sending requests over HTTP/2.
+
+            client = MessengerClient(page_access_token, http2=True)
+
+        Requests from every thread are multiplexed by an
+        `httpx.AsyncClient` running on a private event loop thread, as
+        HTTP/2 streams must be opened in order on each connection.
+
+        Network errors are raised as their `requests` equivalents, so
+        retries and circuit breakers treat them the same way.
+
+        @optional:
+            max_connections: maximum number of open connections. Each one
+                carries many concurrent requests, so a few are enough.
+            keepalive_expiry: seconds an idle connection is kept open
+            client: an `httpx.AsyncClient` to use instead of creating one
+    """
+
+    def __init__(self, max_connections=10, keepalive_expiry=15, client=None):
+        if client is None:
+            client = httpx.AsyncClient(
+                http2=True,
+                limits=httpx.Limits(max_connections=max_connections,
+                                    max_keepalive_connections=max_connections,
+                                    keepalive_expiry=keepalive_expiry),
+                timeout=None,
+            )
+        self.client = client
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='fbmessenger-http2')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def request(self, method, url, params=None, data=None, json=None, headers=None, timeout=None):
+        content, headers = request_content(data, headers)
+        try:
+            return self._run(self.client.request(method.upper(), url, params=params, json=json,
+                                                 headers=headers, timeout=timeout, **content))
+        except httpx.ConnectTimeout as e:
+            raise requests.ConnectTimeout(e)
+        except httpx.TimeoutException as e:
+            raise requests.ReadTimeout(e)
+        except httpx.ConnectError as e:
+            # Raised like requests does, so that it's retried the same way
+            raise requests.ConnectionError(NewConnectionError(None, str(e)))
+        except httpx.TransportError as e:
+            raise requests.ConnectionError(e)
+
+    def close(self):
+        if self._loop.is_running():
+            self._run(self.client.aclose())
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
@@ -0,0 +1,88 @@
+from __future__ import absolute_import
+
+import logging
+import threading
+
+from .coalescing import Scheduler
+
+logger = logging.getLogger(__name__)
+
+# Shared by every indicator, with enough workers that indicators for
+# concurrent slow handlers don't queue behind each other's requests
+_scheduler = Scheduler(workers=32)
+
+
+class TypingIndicator(object):
+    """
+        Shows the typing indicator to a recipient while a reply is being
+        prepared, but only if it takes longer than `delay` seconds.
+
+        Once started, `typing_on` is sent after `delay` seconds and then
+        every `refresh` seconds (Messenger hides the indicator after 20
+        seconds) until `stop` is called. The requests are made on a
+        background thread with a `timeout`, so the caller is never blocked
+        on them. A `typing_on` still in flight when `stop` is called is
+        followed by a `typing_off`, in case it lands after the reply, as is
+        a shown indicator that no reply is coming to replace.
+    """
+
+    def __init__(self, client, recipient_id, delay, refresh=15, scheduler=None, timeout=5):
+        self.client = client
+        self.recipient_id = recipient_id
+        self.delay = delay
+        self.refresh = refresh
+        self.scheduler = scheduler or _scheduler
+        self.timeout = timeout
+        self._handle = None
+        self._stopped = False
+        self._shown = False
+        self._sending = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        self._handle = self.scheduler.call_later(self.delay, self._show)
+
+    def _show(self):
+        with self._lock:
+            if self._stopped:
+                return
+            self._sending = True
+        sent = self._send('typing_on')
+        with self._lock:
+            self._sending = False
+            self._shown = self._shown or sent
+            if not sent:
+                return
+            if not self._stopped:
+                self._handle = self.scheduler.call_later(self.refresh, self._show)
+                return
+        # Stopped while `typing_on` was in flight, which may have shown the
+        # indicator after the reply
+        self._hide()
+
+    def _hide(self):
+        self._send('typing_off')
+
+    def _send(self, sender_action):
+        try:
+            self.client.send_action(sender_action, self.recipient_id, timeout=self.timeout)
+        except Exception:
+            logger.exception('Failed to send `%s` to %s', sender_action, self.recipient_id)
+            return False
+        return True
+
+    def stop(self, hide=False):
+        """
+            Stops showing the indicator. With `hide`, e.g. when no reply is
+            coming to replace it, a `typing_off` is sent if the indicator
+            was shown.
+        """
+        # Never waits on a request in flight
+        with self._lock:
+            self._stopped = True
+            if self._handle is not None:
+                self._handle.cancel()
+            # A `typing_on` in flight is followed by a `typing_off` anyway
+            hide = hide and self._shown and not self._sending
+        if hide:
+            self.scheduler.call_later(0, self._hide)
@@ -0,0 +1,144 @@
+from __future__ import absolute_import
+
+import json
+
+import six
+
+AUTO_CODECS = ('orjson', 'msgspec', 'ujson')
+
+
+class StdlibCodec(object):
+    """
+        JSON codec built on the standard library `json` module.
+
+        A codec is any object with a `dumps(obj)` method returning UTF-8
+        encoded `bytes` and a `loads(data)` method accepting `bytes`, which
+        raises `ValueError` for invalid JSON.
+    """
+
+    name = 'json'
+
+    def dumps(self, obj):
+        return json.dumps(obj, separators=(',', ':')).encode('utf8')
+
+    def loads(self, data):
+        if isinstance(data, six.binary_type):
+            data = data.decode('utf8')
+        return json.loads(data)
+
+
+class OrjsonCodec(object):
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+        self._orjson = orjson
+
+    def dumps(self, obj):
+        return self._orjson.dumps(obj, option=self._orjson.OPT_NON_STR_KEYS)
+
+    def loads(self, data):
+        return self._orjson.loads(data)
+
+
+class MsgspecCodec(object):
+    name = 'msgspec'
+
+    def __init__(self):
+        import msgspec
+        self._msgspec = msgspec
+        self._encoder = msgspec.json.Encoder()
+        self._decoder = msgspec.json.Decoder()
+
+    def dumps(self, obj):
+        return self._encoder.encode(obj)
+
+    def loads(self, data):
+        try:
+            return self._decoder.decode(data)
+        except self._msgspec.DecodeError as e:
+            raise ValueError(str(e))
+
+
+class UjsonCodec(object):
+    name = 'ujson'
+
+    def __init__(self):
+        import ujson
+        self._ujson = ujson
+
+    def dumps(self, obj):
+        return self._ujson.dumps(obj, ensure_ascii=False).encode('utf8')
+
+    def loads(self, data):
+        return self._ujson.loads(data)
+
+
+CODECS = {
+    'json': StdlibCodec,
+    'orjson': OrjsonCodec,
+    'msgspec': MsgspecCodec,
+    'ujson': UjsonCodec,
+}
+
+JSON_CODEC = StdlibCodec()
+
+
+def get_codec(codec):
+    """
+        Returns the codec for a `json_codec` option: `None`, a codec
+        instance, the name of a codec in `CODECS`, or `'auto'` for the
+        fastest of `AUTO_CODECS` that is installed (falling back to the
+        standard library).
+    """
+    if codec is None or not isinstance(codec, six.string_types):
+        return codec
+    if codec == 'auto':
+        for name in AUTO_CODECS:
+            try:
+                return CODECS[name]()
+            except ImportError:
+                pass
+        return JSON_CODEC
+    try:
+        return CODECS[codec]()
+    except KeyError:
+        raise ValueError('`{}` is not a valid `json_codec`'.format(codec))
+
+
+def is_raw(value):
+    """
+        Whether `value` is already encoded JSON. Only `bytes` are, so on
+        Python 2 (where `bytes` is `str`) nothing is.
+    """
+    return isinstance(value, six.binary_type) and not isinstance(value, six.string_types)
+
+
+def has_raw(body):
+    return is_raw(body) or (isinstance(body, dict) and any(is_raw(value) for value in body.values()))
+
+
+def decode_raw(value):
+    """
+        `default` hook for `json.dumps` that stores pre-encoded values
+        decoded, e.g. when persisting a message.
+    """
+    if is_raw(value):
+        return json.loads(value.decode('utf8'))
+    raise TypeError('{!r} is not JSON serializable'.format(value))
+
+
+def encode(codec, body):
+    """
+        Encodes a request body with `codec`. `body` may itself be
+        pre-encoded `bytes`, or a dict with pre-encoded values (e.g. a
+        serialized message), which are spliced in as they are.
+    """
+    if is_raw(body):
+        return body
+    if has_raw(body):
+        return b'{' + b','.join(
+            codec.dumps(key) + b':' + (value if is_raw(value) else codec.dumps(value))
+            for key, value in body.items()
+        ) + b'}'
+    return codec.dumps(body)
@@ -0,0 +1,224 @@
+"""
+Counters and latency histograms for Graph API requests and webhook events.
+
+    metrics = Metrics()
+    client = MessengerClient(page_access_token, metrics=metrics)
+
+    metrics.snapshot()        # for pulling into your own monitoring
+    prometheus_text(metrics)  # for a Prometheus scrape endpoint
+
+Threads record into a fixed number of shards, each with its own lock, so
+they rarely wait on each other however many threads come and go. The
+shards are added up when the metrics are read.
+"""
+from __future__ import absolute_import
+
+import bisect
+import itertools
+import threading
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+SHARDS = 16
+
+_local = threading.local()
+_next_shard = itertools.count()
+
+
+def _shard_index():
+    # Threads are given shards in turn, as their idents are too evenly
+    # spaced to be hashed into them
+    try:
+        return _local.shard
+    except AttributeError:
+        index = _local.shard = next(_next_shard) % SHARDS
+        return index
+
+
+class _Family(object):
+    """
+        A metric with one value per combination of label values, kept in
+        `SHARDS` shards shared out between threads.
+    """
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._shards = [{} for _ in range(SHARDS)]
+        self._locks = [threading.Lock() for _ in range(SHARDS)]
+
+    def _shard(self):
+        index = _shard_index()
+        return self._locks[index], self._shards[index]
+
+    def _items(self):
+        for lock, shard in zip(self._locks, self._shards):
+            with lock:
+                items = [(labels, self._copy(value)) for labels, value in shard.items()]
+            for item in items:
+                yield item
+
+    @staticmethod
+    def _copy(value):
+        return value
+
+
+class Counter(_Family):
+
+    type = 'counter'
+
+    def inc(self, labels, amount=1):
+        lock, shard = self._shard()
+        with lock:
+            shard[labels] = shard.get(labels, 0) + amount
+
+    def collect(self):
+        """
+            Returns `{label values: total}`.
+        """
+        totals = {}
+        for labels, value in self._items():
+            totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+
+class Histogram(_Family):
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames, buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, labels, value):
+        bucket = bisect.bisect_left(self.buckets, value)
+        lock, shard = self._shard()
+        with lock:
+            counts = shard.get(labels)
+            if counts is None:
+                # One count per bucket, one for +Inf, then the sum
+                counts = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[bucket] += 1
+            counts[-1] += value
+
+    @staticmethod
+    def _copy(value):
+        return list(value)
+
+    def collect(self):
+        """
+            Returns `{label values: {'buckets': [(upper bound, cumulative
+            count), ...], 'count': count, 'sum': sum}}`.
+        """
+        merged = {}
+        for labels, counts in self._items():
+            total = merged.get(labels)
+            if total is None:
+                merged[labels] = counts
+            else:
+                merged[labels] = [a + b for a, b in zip(total, counts)]
+
+        histograms = {}
+        for labels, counts in merged.items():
+            cumulative = []
+            running = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                running += count
+                cumulative.append((bound, running))
+            histograms[labels] = {'buckets': cumulative, 'count': running, 'sum': counts[-1]}
+        return histograms
+
+
+class Metrics(object):
+    """
+        Collects metrics from `MessengerClient` (when passed as its
+        `metrics` option) and `BaseMessenger.handle`:
+
+        - `fbmessenger_requests_total`: Graph API requests, including each
+          retry, by endpoint, HTTP method, status code (`error` for network
+          errors) and Graph API error code
+        - `fbmessenger_request_duration_seconds`: request latency by endpoint
+        - `fbmessenger_events_total`: webhook events handled, by type
+        - `fbmessenger_handler_errors_total`: handlers that raised, by event
+          type
+        - `fbmessenger_handler_duration_seconds`: handler latency by event
+          type
+
+        @optional:
+            buckets: upper bounds of the latency histogram buckets, in
+                seconds
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.requests = Counter('fbmessenger_requests_total', 'Graph API requests made.',
+                                ('endpoint', 'method', 'status', 'error_code'))
+        self.request_duration = Histogram('fbmessenger_request_duration_seconds',
+                                          'Graph API request latency in seconds.', ('endpoint',), buckets)
+        self.events = Counter('fbmessenger_events_total', 'Webhook events handled.', ('event_type',))
+        self.handler_errors = Counter('fbmessenger_handler_errors_total', 'Webhook event handlers that raised.',
+                                      ('event_type',))
+        self.handler_duration = Histogram('fbmessenger_handler_duration_seconds',
+                                          'Webhook event handler latency in seconds.', ('event_type',), buckets)
+        self.families = (self.requests, self.request_duration, self.events, self.handler_errors,
+                         self.handler_duration)
+
+    def record_request(self, endpoint, method, status, error_code, duration):
+        self.requests.inc((endpoint, method, str(status), '' if error_code is None else str(error_code)))
+        self.request_duration.observe((endpoint,), duration)
+
+    def record_event(self, event_type, duration, failed=False):
+        self.events.inc((event_type,))
+        if failed:
+            self.handler_errors.inc((event_type,))
+        self.handler_duration.observe((event_type,), duration)
+
+    def snapshot(self):
+        """
+            Returns `{metric name: {label values: value}}`, where counter
+            values are totals and histogram values are dicts, see
+            `Histogram.collect`.
+        """
+        return dict((family.name, family.collect()) for family in self.families)
+
+
+def _escape(value):
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, _escape(str(value))) for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def prometheus_text(metrics):
+    """
+        Renders `metrics` in the Prometheus text exposition format (version
+        0.0.4), to be served with the content type
+        `text/plain; version=0.0.4`.
+    """
+    lines = []
+    for family in metrics.families:
+        lines.append('# HELP {} {}'.format(family.name, family.documentation))
+        lines.append('# TYPE {} {}'.format(family.name, family.type))
+        for labels, value in sorted(family.collect().items()):
+            if family.type == 'counter':
+                lines.append('{}{} {}'.format(family.name, _labels(family.labelnames, labels), _number(value)))
+                continue
+            for bound, count in value['buckets']:
+                lines.append('{}_bucket{} {}'.format(
+                    family.name, _labels(family.labelnames, labels, [('le', _number(bound))]), count))
+            lines.append('{}_sum{} {}'.format(family.name, _labels(family.labelnames, labels),
+                                              _number(value['sum'])))
+            lines.append('{}_count{} {}'.format(family.name, _labels(family.labelnames, labels), value['count']))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,123 @@
+from __future__ import absolute_import
+
+import mimetypes
+import os
+import uuid
+
+import six
+
+CHUNK_SIZE = 64 * 1024
+
+
+def open_filedata(filedata):
+    """
+        Returns `(fileobj, filename, should_close)` for `filedata`, which may
+        be a path or a binary file object.
+    """
+    if isinstance(filedata, six.string_types):
+        return open(filedata, 'rb'), os.path.basename(filedata), True
+    filename = os.path.basename(getattr(filedata, 'name', None) or 'file')
+    return filedata, filename, False
+
+
+def guess_content_type(filename):
+    return mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+
+def _file_size(fileobj):
+    try:
+        return os.fstat(fileobj.fileno()).st_size - fileobj.tell()
+    except (AttributeError, OSError, IOError, ValueError):
+        start = fileobj.tell()
+        fileobj.seek(0, os.SEEK_END)
+        size = fileobj.tell() - start
+        fileobj.seek(start)
+        return size
+
+
+class MultipartEncoder(object):
+    """
+        A `multipart/form-data` request body that is read in chunks, so
+        that uploading a large file doesn't load it into memory.
+
+        @required:
+            fields: list of `(name, value)` pairs, where `value` is either a
+                string or a `(filename, fileobj, content_type)` tuple.
+                File objects must be seekable.
+
+        Pass the encoder as `data` and `content_type` as the `Content-Type`
+        header. It reports its length up front, so the body is sent with a
+        `Content-Length` rather than chunked encoding, and it can be rewound
+        with `seek(0)` to send it again.
+    """
+
+    def __init__(self, fields, boundary=None):
+        self.boundary = boundary or uuid.uuid4().hex
+        self.content_type = 'multipart/form-data; boundary={}'.format(self.boundary)
+        self._parts = []
+        for name, value in fields:
+            if isinstance(value, tuple):
+                filename, fileobj, content_type = value
+                header = (
+                    '--{boundary}\r\n'
+                    'Content-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                    'Content-Type: {content_type}\r\n\r\n'
+                ).format(boundary=self.boundary, name=name, filename=filename, content_type=content_type)
+                self._parts.append(header.encode('utf8'))
+                self._parts.append((fileobj, fileobj.tell(), _file_size(fileobj)))
+                self._parts.append(b'\r\n')
+            else:
+                if isinstance(value, six.text_type):
+                    value = value.encode('utf8')
+                header = (
+                    '--{boundary}\r\n'
+                    'Content-Disposition: form-data; name="{name}"\r\n\r\n'
+                ).format(boundary=self.boundary, name=name)
+                self._parts.append(header.encode('utf8') + value + b'\r\n')
+        self._parts.append('--{}--\r\n'.format(self.boundary).encode('utf8'))
+        self._length = sum(
+            part[2] if isinstance(part, tuple) else len(part) for part in self._parts
+        )
+        self.seek(0)
+
+    def __len__(self):
+        return self._length
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if offset != 0 or whence != os.SEEK_SET:
+            raise IOError('MultipartEncoder can only be rewound to the start')
+        self._index = 0
+        self._offset = 0
+        self._position = 0
+        for part in self._parts:
+            if isinstance(part, tuple):
+                part[0].seek(part[1])
+        return 0
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self._length - self._position
+        chunks = []
+        remaining = size
+        while remaining > 0 and self._index < len(self._parts):
+            part = self._parts[self._index]
+            if isinstance(part, tuple):
+                fileobj, start, length = part
+                chunk = fileobj.read(min(remaining, length - self._offset, CHUNK_SIZE))
+                if not chunk and self._offset < length:
+                    raise IOError('File was truncated while it was being uploaded')
+            else:
+                length = len(part)
+                chunk = part[self._offset:self._offset + remaining]
+            chunks.append(chunk)
+            self._offset += len(chunk)
+            remaining -= len(chunk)
+            if self._offset >= length:
+                self._index += 1
+                self._offset = 0
+        data = b''.join(chunks)
+        self._position += len(data)
+        return data
@@ -0,0 +1,339 @@
+"""
+A durable queue for outbound messages.
+
+A message passed to `MessengerClient.send` is normally lost if the process
+dies before the request completes. With an `Outbox`, `send` first appends
+the message to a SQLite write-ahead log and returns once it is on disk,
+and background flushers then send it. Messages that were never
+acknowledged are sent again the next time the outbox is opened.
+
+    client = MessengerClient(page_access_token, outbox=Outbox('outbox.db'))
+    future = client.send(Text('Hello').to_dict(), recipient_id)
+
+Delivery is at least once: a message that was sent just before a crash,
+but not yet acknowledged, is sent again on restart.
+"""
+from __future__ import absolute_import
+
+import functools
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+import requests
+from six.moves import queue
+
+from .circuit_breaker import CircuitOpenError
+from .dispatcher import OrderedDispatcher
+from .json_codecs import decode_raw
+from .responses import SendResult, raw_response
+from .retry import TRANSIENT, RetryPolicy, classify_error
+from .rate_limit import monotonic
+
+logger = logging.getLogger(__name__)
+
+_APPEND = 'append'
+_ACK = 'ack'
+_FLUSH = 'flush'
+_STOP = 'stop'
+
+# Times a failed acknowledgement is written again before it is given up on
+ACK_RETRIES = 3
+
+
+class _Entry(object):
+
+    __slots__ = ('id', 'recipient_id', 'message', 'committed', 'error')
+
+    def __init__(self, message, recipient_id, id=None):
+        self.id = id
+        self.recipient_id = recipient_id
+        self.message = message
+        self.committed = threading.Event()
+        self.error = None
+
+
+class Outbox(object):
+    """
+        Persists messages before they are sent, so that none are lost if
+        the process dies.
+
+        Appends from every thread are handed to a single writer thread,
+        which inserts everything that queued up while it was busy in one
+        transaction. A burst of sends therefore shares each disk sync
+        rather than paying for one per message. Acknowledgements are
+        written the same way.
+
+        Messages are sent by `flushers` threads, keeping the messages to
+        any one recipient in order (see `OrderedDispatcher`). Network
+        errors and transient Graph API errors are retried according to
+        `retry_policy`, which takes the place of the client's own for these
+        sends. Messages that still fail are dropped, and added to the
+        client's `dead_letters` if it has any.
+
+        @optional:
+            path: SQLite database file
+            flushers: number of threads sending messages
+            retry_policy: a `fbmessenger.retry.RetryPolicy` for failed sends
+            synchronous: SQLite `synchronous` setting. `FULL` syncs every
+                commit, `NORMAL` is faster but may lose the last messages
+                on power loss (not on a process crash).
+            batch_size: maximum number of writes per transaction
+    """
+
+    def __init__(self, path='outbox.db', flushers=8, retry_policy=None, synchronous='FULL', batch_size=1000):
+        if synchronous not in ('OFF', 'NORMAL', 'FULL', 'EXTRA'):
+            raise ValueError('`{}` is not a valid `synchronous` setting'.format(synchronous))
+        self.path = path
+        self.flushers = flushers
+        self.retry_policy = retry_policy or RetryPolicy(max_attempts=8, backoff=1, max_backoff=60)
+        self.batch_size = batch_size
+        self.client = None
+        self._writes = queue.Queue()
+        self._unacked = 0
+        self._ack_failures = {}
+        self._cond = threading.Condition()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._dispatcher = None
+        self._writer = None
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            if path != ':memory:':
+                self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous={}'.format(synchronous))
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS outbox ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                'message TEXT NOT NULL, '
+                'created REAL NOT NULL)'
+            )
+
+    def open(self, client):
+        """
+            Starts sending with `client`, beginning with any messages left
+            over from a previous run. Called by `MessengerClient` when it is
+            given the outbox.
+        """
+        if self.client is not None:
+            raise RuntimeError('The outbox is already open')
+        self.client = client
+        rows = self._conn.execute('SELECT id, message FROM outbox ORDER BY id').fetchall()
+        self._dispatcher = OrderedDispatcher(client, workers=self.flushers)
+        self._writer = threading.Thread(target=self._write_loop, name='fbmessenger-outbox')
+        self._writer.daemon = True
+        self._writer.start()
+        if rows:
+            logger.info('Replaying %d unacknowledged messages', len(rows))
+        with self._cond:
+            self._unacked += len(rows)
+        for id, message in rows:
+            self._dispatch(_Entry(message, json.loads(message)['recipient_id'], id))
+
+    def put(self, payload, recipient_id, messaging_type='RESPONSE', notification_type='REGULAR',
+            timeout=None, tag=None):
+        """
+            Appends a message to the outbox and waits until it is on disk.
+
+            @outputs:
+                `concurrent.futures.Future` for the Send API response
+        """
+        if self.client is None:
+            raise RuntimeError('The outbox must be opened before messages are added')
+        entry = _Entry(json.dumps({
+            'payload': payload,
+            'recipient_id': recipient_id,
+            'messaging_type': messaging_type,
+            'notification_type': notification_type,
+            'timeout': timeout,
+            'tag': tag,
+        }, separators=(',', ':'), default=decode_raw), recipient_id)
+        # Under the lock so that `close` can't slip in between the check
+        # and the append, leaving it unwritten
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('Cannot add messages to a closed outbox')
+            self._writes.put((_APPEND, entry))
+        entry.committed.wait()
+        if entry.error is not None:
+            raise entry.error
+        return self._dispatch(entry)
+
+    def _dispatch(self, entry):
+        return self._dispatcher.submit(entry.recipient_id, self._deliver, entry)
+
+    def _deliver(self, entry):
+        message = json.loads(entry.message)
+        try:
+            # Messages that are dropped end up in the client's `dead_letters`
+            return self.client._capture('send', message, functools.partial(self._send, entry, message))
+        finally:
+            self._writes.put((_ACK, entry.id))
+
+    def _send(self, entry, message):
+        started = monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                # Each attempt is a single request: this loop does the retrying
+                response = self.client._send(retry=False, **message)
+            except Exception as e:
+                error_class = self._classify_exception(e)
+                delay = self.retry_policy.next_delay(attempt, started, error_class)
+                if delay is None:
+                    logger.error('Dropping message %d to %s after %d attempts: %r',
+                                 entry.id, entry.recipient_id, attempt, e)
+                    raise
+            else:
+                status_code = response.status_code if isinstance(response, SendResult) else None
+                error_class = classify_error(raw_response(response), status_code)
+                if error_class is None:
+                    return response
+                delay = self.retry_policy.next_delay(attempt, started, error_class)
+                if delay is None:
+                    logger.error('Dropping message %d to %s after %d attempts: %s',
+                                 entry.id, entry.recipient_id, attempt, raw_response(response))
+                    return response
+            logger.debug('Resending message %d in %.2fs (attempt %d)', entry.id, delay, attempt)
+            time.sleep(delay)
+
+    @staticmethod
+    def _classify_exception(exc):
+        # Unlike a plain `send`, resending after a network error is fine as
+        # delivery is at least once anyway
+        if isinstance(exc, (requests.RequestException, CircuitOpenError)):
+            return TRANSIENT
+        return None
+
+    def _write_loop(self):
+        try:
+            while True:
+                writes = [self._writes.get()]
+                while len(writes) < self.batch_size:
+                    try:
+                        writes.append(self._writes.get_nowait())
+                    except queue.Empty:
+                        break
+                self._write(writes)
+                if any(kind == _STOP for kind, _ in writes):
+                    return
+        finally:
+            self._fail_pending()
+
+    def _fail_pending(self):
+        # Nothing is written once the writer has stopped, so don't leave
+        # anyone waiting on it
+        while True:
+            try:
+                kind, value = self._writes.get_nowait()
+            except queue.Empty:
+                return
+            if kind == _APPEND:
+                value.error = RuntimeError('The outbox is closed')
+                value.committed.set()
+            elif kind == _FLUSH:
+                value.set()
+
+    def _write(self, writes):
+        entries = [value for kind, value in writes if kind == _APPEND]
+        acks = [(value,) for kind, value in writes if kind == _ACK]
+        now = time.time()
+        try:
+            with self._conn:
+                for entry in entries:
+                    entry.id = self._conn.execute(
+                        'INSERT INTO outbox (message, created) VALUES (?, ?)', (entry.message, now)
+                    ).lastrowid
+                if acks:
+                    self._conn.executemany('DELETE FROM outbox WHERE id = ?', acks)
+        except sqlite3.Error as e:
+            logger.exception('Failed to write to the outbox')
+            for entry in entries:
+                entry.error = e
+            appended = 0
+            acked = self._retry_acks([id for id, in acks])
+        else:
+            appended, acked = len(entries), len(acks)
+            for id, in acks:
+                self._ack_failures.pop(id, None)
+
+        for entry in entries:
+            entry.committed.set()
+        with self._cond:
+            self._unacked += appended - acked
+            self._cond.notify_all()
+        for kind, value in writes:
+            if kind == _FLUSH:
+                value.set()
+
+    def _retry_acks(self, ids):
+        """
+            Queues failed acknowledgements to be written again, and returns
+            the number given up on. Their messages are sent again the next
+            time the outbox is opened.
+        """
+        given_up = 0
+        for id in ids:
+            failures = self._ack_failures.get(id, 0) + 1
+            if failures > ACK_RETRIES:
+                logger.error('Failed to acknowledge message %d, it will be sent again on restart', id)
+                self._ack_failures.pop(id, None)
+                given_up += 1
+            else:
+                self._ack_failures[id] = failures
+                self._writes.put((_ACK, id))
+        return given_up
+
+    def join(self, timeout=None):
+        """
+            Waits until every message in the outbox has been sent and
+            acknowledged, or `timeout` seconds. Returns whether it is empty.
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        with self._cond:
+            while self._unacked:
+                remaining = None if deadline is None else deadline - monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def __len__(self):
+        """
+            Number of messages written but not yet acknowledged.
+        """
+        return self._unacked
+
+    def close(self, wait=True):
+        """
+            Stops accepting messages. With `wait`, returns once everything
+            already in the outbox has been sent. Otherwise sending carries
+            on in the background, and whatever is unsent when the process
+            exits is sent the next time the outbox is opened.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        if self.client is not None:
+            # Wait for appends that are already in flight
+            flushed = threading.Event()
+            self._writes.put((_FLUSH, flushed))
+            flushed.wait()
+            if wait:
+                self._dispatcher.close(wait=True)
+                self._writes.put((_STOP, None))
+                self._writer.join()
+            else:
+                self._dispatcher.close(wait=False)
+                return
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
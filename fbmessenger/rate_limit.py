@@ -0,0 +1,96 @@
+from __future__ import absolute_import
+
+import collections
+import threading
+import time
+
+monotonic = getattr(time, 'monotonic', time.time)
+
+
+class TokenBucket(object):
+    """
+        Thread-safe token bucket refilled at `rate` tokens per second and
+        holding at most `capacity` tokens (defaults to `rate`, i.e. a burst
+        of one second's worth of requests).
+    """
+
+    def __init__(self, rate, capacity=None):
+        if rate <= 0:
+            raise ValueError('`rate` must be positive')
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._tokens = self.capacity
+        self._updated = monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens=1):
+        """
+            Takes `tokens` from the bucket and returns how many seconds the
+            caller must wait before using them. The bucket may go into debt,
+            so concurrent callers queue up behind each other rather than
+            racing for the next token.
+        """
+        with self._lock:
+            now = monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+
+class RateLimiter(object):
+    """
+        Client side throttling for the Send API.
+
+        @required:
+            rate: messages per second allowed for the page
+        @optional:
+            burst: size of the page level bucket (defaults to `rate`)
+            recipient_rate: messages per second allowed to any one recipient
+            recipient_burst: size of each recipient bucket (defaults to
+                `recipient_rate`)
+            max_recipients: number of recipient buckets to keep, the least
+                recently used are discarded first
+
+        A single instance may be shared between threads and between clients
+        sending on behalf of the same page.
+    """
+
+    def __init__(self, rate, burst=None, recipient_rate=None, recipient_burst=None,
+                 max_recipients=10000):
+        self.bucket = TokenBucket(rate, burst)
+        self.recipient_rate = recipient_rate
+        self.recipient_burst = recipient_burst
+        self.max_recipients = max_recipients
+        self._recipients = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _recipient_bucket(self, recipient_id):
+        with self._lock:
+            bucket = self._recipients.pop(recipient_id, None)
+            if bucket is None:
+                bucket = TokenBucket(self.recipient_rate, self.recipient_burst)
+                if len(self._recipients) >= self.max_recipients:
+                    self._recipients.popitem(last=False)
+            self._recipients[recipient_id] = bucket
+            return bucket
+
+    def reserve(self, recipient_id=None):
+        """
+            Reserves capacity for one message and returns the number of
+            seconds to wait before sending it.
+        """
+        delay = self.bucket.reserve()
+        if self.recipient_rate and recipient_id is not None:
+            delay = max(delay, self._recipient_bucket(recipient_id).reserve())
+        return delay
+
+    def acquire(self, recipient_id=None):
+        """
+            Blocks until one message may be sent.
+        """
+        delay = self.reserve(recipient_id)
+        if delay > 0:
+            time.sleep(delay)
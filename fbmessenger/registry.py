@@ -0,0 +1,111 @@
+from __future__ import absolute_import
+
+import threading
+
+import requests
+
+from . import MessengerClient
+from .adapters import GRAPH_API_PREFIX, GraphAdapter
+
+
+class ClientRegistry(object):
+    """
+        Hands out a `MessengerClient` per page, all sharing one session and
+        so one connection pool.
+
+            registry = ClientRegistry(app_secret=app_secret, max_connections=64)
+            registry.register(page_id, page_access_token)
+            registry.get(page_id).send(payload, recipient_id)
+
+        Clients are created on first use and kept, so each page's
+        `auth_args` (including its `appsecret_proof`) are only computed
+        once. However many pages are registered, at most `max_connections`
+        connections are opened to the Graph API: further requests wait for
+        a free connection.
+
+        @optional:
+            app_secret: app secret shared by every page
+            session: session to share instead of the default one, e.g. an
+                `aiohttp.ClientSession` when `client_class` is
+                `AsyncMessengerClient`
+            max_connections: size of the default session's connection pool
+            keepalive: enable TCP keep-alive on the default session
+            client_class: class of the clients handed out
+            **client_kwargs: passed to every client, e.g. `api_version` or
+                `retry_policy`. The same objects are shared by every page,
+                so a `rate_limiter`, `circuit_breakers`, `profile_cache`,
+                `action_coalescer`, `metrics` or `tracer` covers all pages
+                together. `outbox`, `dead_letters` and `attachment_cache`
+                belong to a single page, so they aren't accepted.
+    """
+
+    # An outbox is bound to the client that opens it, dead letters are
+    # redriven with a single page's client, and attachment ids are only
+    # valid for the page that uploaded them
+    PER_PAGE_KWARGS = ('outbox', 'dead_letters', 'attachment_cache')
+
+    def __init__(self, app_secret=None, session=None, max_connections=100, keepalive=True,
+                 client_class=MessengerClient, **client_kwargs):
+        for option in self.PER_PAGE_KWARGS:
+            if client_kwargs.get(option) is not None:
+                raise ValueError('`{}` belongs to a single page and cannot be shared'.format(option))
+        self.app_secret = app_secret
+        self.client_class = client_class
+        self.client_kwargs = client_kwargs
+        if session is None:
+            session = requests.Session()
+            session.mount(GRAPH_API_PREFIX, GraphAdapter(
+                pool_connections=1,
+                pool_maxsize=max_connections,
+                pool_block=True,
+                keepalive=keepalive,
+                tracing=client_kwargs.get('tracer') is not None,
+            ))
+        self.session = session
+        self._tokens = {}
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def register(self, page_id, page_access_token):
+        """
+            Registers (or updates) the access token for a page.
+        """
+        with self._lock:
+            if self._tokens.get(page_id) != page_access_token:
+                self._tokens[page_id] = page_access_token
+                self._clients.pop(page_id, None)
+
+    def unregister(self, page_id):
+        with self._lock:
+            self._tokens.pop(page_id, None)
+            self._clients.pop(page_id, None)
+
+    def get(self, page_id):
+        """
+            Returns the client for a registered page.
+        """
+        client = self._clients.get(page_id)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(page_id)
+                if client is None:
+                    try:
+                        page_access_token = self._tokens[page_id]
+                    except KeyError:
+                        raise KeyError('Page `{}` is not registered'.format(page_id))
+                    client = self._clients[page_id] = self.client_class(
+                        page_access_token,
+                        session=self.session,
+                        app_secret=self.app_secret,
+                        **self.client_kwargs
+                    )
+        return client
+
+    def __getitem__(self, page_id):
+        return self.get(page_id)
+
+    def __contains__(self, page_id):
+        return page_id in self._tokens
+
+    def __len__(self):
+        return len(self._tokens)
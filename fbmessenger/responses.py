@@ -0,0 +1,101 @@
+from __future__ import absolute_import
+
+from .retry import classify_error, get_error
+
+
+class GraphError(object):
+    """
+        The `error` object of a Graph API response.
+
+        `error_class` is `TRANSIENT`, `THROTTLED` or `PERMANENT`, see
+        `fbmessenger.retry.classify_error`.
+    """
+
+    __slots__ = ('message', 'type', 'code', 'error_subcode', 'fbtrace_id', 'error_class')
+
+    def __init__(self, message=None, type=None, code=None, error_subcode=None, fbtrace_id=None,
+                 error_class=None):
+        self.message = message
+        self.type = type
+        self.code = code
+        self.error_subcode = error_subcode
+        self.fbtrace_id = fbtrace_id
+        self.error_class = error_class
+
+    @classmethod
+    def from_dict(cls, error, error_class=None):
+        return cls(
+            message=error.get('message'),
+            type=error.get('type'),
+            code=error.get('code'),
+            error_subcode=error.get('error_subcode'),
+            fbtrace_id=error.get('fbtrace_id'),
+            error_class=error_class,
+        )
+
+    def __repr__(self):
+        return 'GraphError(code={!r}, error_subcode={!r}, message={!r})'.format(
+            self.code, self.error_subcode, self.message)
+
+
+class SendResult(object):
+    """
+        The outcome of a Send API or attachment upload call, returned
+        instead of the decoded response when the client is created with
+        `typed_responses=True`.
+
+        `latency` is the number of seconds the call took, including any
+        retries, and `raw` is the decoded response as it would otherwise
+        have been returned.
+    """
+
+    __slots__ = ('recipient_id', 'message_id', 'attachment_id', 'error', 'status_code', 'latency', 'raw')
+
+    def __init__(self, recipient_id=None, message_id=None, attachment_id=None, error=None,
+                 status_code=None, latency=None, raw=None):
+        self.recipient_id = recipient_id
+        self.message_id = message_id
+        self.attachment_id = attachment_id
+        self.error = error
+        self.status_code = status_code
+        self.latency = latency
+        self.raw = raw
+
+    @classmethod
+    def from_response(cls, data, status_code=None, latency=None, error_class=None):
+        error = get_error(data)
+        if error is not None:
+            if error_class is None:
+                error_class = classify_error(data, status_code)
+            return cls(error=GraphError.from_dict(error, error_class), status_code=status_code,
+                       latency=latency, raw=data)
+        if not isinstance(data, dict):
+            return cls(status_code=status_code, latency=latency, raw=data)
+        return cls(
+            recipient_id=data.get('recipient_id'),
+            message_id=data.get('message_id'),
+            attachment_id=data.get('attachment_id'),
+            status_code=status_code,
+            latency=latency,
+            raw=data,
+        )
+
+    @property
+    def ok(self):
+        return self.error is None and isinstance(self.raw, dict)
+
+    def __repr__(self):
+        if self.error is not None:
+            return 'SendResult(error={!r})'.format(self.error)
+        return 'SendResult(recipient_id={!r}, message_id={!r}, attachment_id={!r})'.format(
+            self.recipient_id, self.message_id, self.attachment_id)
+
+
+def raw_response(response):
+    """
+        Returns the decoded response behind a `SendResult`, or `response`
+        itself if it isn't one.
+    """
+    if isinstance(response, SendResult):
+        return response.raw
+    return response
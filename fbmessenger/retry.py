@@ -0,0 +1,106 @@
+from __future__ import absolute_import
+
+import random
+
+from .rate_limit import monotonic
+
+# Error classes returned by `classify_error`
+TRANSIENT = 'transient'
+THROTTLED = 'throttled'
+PERMANENT = 'permanent'
+
+# https://developers.facebook.com/docs/graph-api/using-graph-api/error-handling
+TRANSIENT_ERROR_CODES = frozenset([
+    1,     # API unknown
+    2,     # API service
+    1200,  # Temporary send message failure
+])
+
+THROTTLED_ERROR_CODES = frozenset([
+    4,     # API too many calls
+    17,    # API user too many calls
+    613,   # Calls to this API have exceeded the rate limit
+])
+
+IDEMPOTENT_METHODS = frozenset(['get', 'delete'])
+
+
+def get_error(data):
+    """
+        Returns the `error` object of a Graph API response, or `None`.
+    """
+    if isinstance(data, dict) and isinstance(data.get('error'), dict):
+        return data['error']
+    return None
+
+
+def classify_error(data, status_code=None):
+    """
+        Classifies a decoded Graph API response as `TRANSIENT`, `THROTTLED`
+        or `PERMANENT`, or returns `None` if it isn't an error.
+    """
+    server_error = isinstance(status_code, int) and status_code >= 500
+    error = get_error(data)
+    if error is None:
+        return TRANSIENT if server_error else None
+
+    code = error.get('code')
+    if code in THROTTLED_ERROR_CODES:
+        return THROTTLED
+    if code in TRANSIENT_ERROR_CODES or error.get('is_transient') or server_error:
+        return TRANSIENT
+    return PERMANENT
+
+
+class RetryPolicy(object):
+    """
+        Retries failed Graph API requests with capped exponential backoff.
+
+        @optional:
+            max_attempts: total number of attempts, including the first
+            backoff: delay before the first retry, doubled on each attempt
+            max_backoff: upper bound on any single delay
+            deadline: give up rather than retry once this many seconds
+                have passed since the first attempt
+            jitter: randomise delays ("full jitter") so that clients that
+                failed together don't retry together
+            retry_on: error classes that may be retried
+
+        Only failures that are safe to repeat are retried: error responses
+        in `retry_on`, requests that never reached Facebook, and, for `GET`
+        and `DELETE` requests, network errors and timeouts.
+    """
+
+    def __init__(self, max_attempts=3, backoff=0.5, max_backoff=30, deadline=None, jitter=True,
+                 retry_on=(TRANSIENT, THROTTLED)):
+        if max_attempts < 1:
+            raise ValueError('`max_attempts` must be at least 1')
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.deadline = deadline
+        self.jitter = jitter
+        self.retry_on = frozenset(retry_on)
+
+    def get_backoff(self, attempt):
+        delay = min(self.max_backoff, self.backoff * (2 ** (attempt - 1)))
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        return delay
+
+    def next_delay(self, attempt, started, error_class):
+        """
+            Returns how long to wait before the next attempt, or `None` if
+            the request should not be retried.
+
+            @required:
+                attempt: number of attempts made so far
+                started: `monotonic()` time of the first attempt
+                error_class: classification of the latest failure
+        """
+        if error_class not in self.retry_on or attempt >= self.max_attempts:
+            return None
+        delay = self.get_backoff(attempt)
+        if self.deadline is not None and monotonic() - started + delay > self.deadline:
+            return None
+        return delay
@@ -131,6 +131,12 @@ class PersistentMenu(object):
 
 
 class MessengerProfile(object):
+    FIELDS = (
+        'greeting',
+        'get_started',
+        'persistent_menu',
+    )
+
     def __init__(self, greetings=None, get_started=None, persistent_menus=None):
         self.greetings = greetings
         self.get_started = get_started
@@ -0,0 +1,190 @@
+"""
+Tracing hooks for Graph API requests and webhook events.
+
+    client = MessengerClient(page_access_token, tracer=CallbackTracer(log_span))
+
+A `graph.request` span is made for every attempt at a Graph API request,
+and a `messenger.handle` span for every webhook event `BaseMessenger`
+dispatches. Requests made by a handler on its own thread are children of
+its span. Nothing is recorded unless a tracer is given.
+
+Request spans break their duration down into phases, in seconds:
+
+- `pool_wait`: waiting for a free pooled connection
+- `dns`: resolving the host name
+- `connect`: opening the TCP connection (including TLS with aiohttp)
+- `tls`: the TLS handshake
+- `send`: writing the request
+- `ttfb`: waiting for the response headers once the request was sent
+
+Phases are recorded by `GraphAdapter` when created with `tracing=True` (the
+default session of a client with a `tracer` is) and by the sessions
+`AsyncMessengerClient` creates. Connections reused from the pool have no
+`dns`, `connect` or `tls` phases.
+"""
+from __future__ import absolute_import
+
+import logging
+import threading
+import time
+
+from .rate_limit import monotonic
+from .retry import get_error
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+# Phases spent setting up a connection
+CONNECTION_PHASES = ('dns', 'connect', 'tls')
+
+
+class Span(object):
+    """
+        A timed operation. `start_time` is in seconds since the epoch and
+        `duration` is set once the span has ended. `context` is free for
+        the tracer's own use, e.g. to hold its native span.
+    """
+
+    __slots__ = ('name', 'attributes', 'phases', 'parent', 'start_time', 'started', 'duration', 'error',
+                 'context')
+
+    def __init__(self, name, attributes=None, parent=None):
+        self.name = name
+        self.attributes = attributes or {}
+        self.phases = {}
+        self.parent = parent
+        self.start_time = time.time()
+        self.started = monotonic()
+        self.duration = None
+        self.error = None
+        self.context = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def add_phase(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0) + seconds
+
+    def connection_time(self):
+        return sum(self.phases.get(phase, 0) for phase in CONNECTION_PHASES)
+
+    @property
+    def fbtrace_id(self):
+        return self.attributes.get('fbtrace_id')
+
+    def __repr__(self):
+        return 'Span(name={!r}, duration={!r}, phases={!r})'.format(self.name, self.duration, self.phases)
+
+
+class Tracer(object):
+    """
+        Base class for tracers, which are told when spans start and end.
+    """
+
+    def on_start(self, span):
+        pass
+
+    def on_end(self, span):
+        pass
+
+
+class CallbackTracer(Tracer):
+    """
+        Calls `on_end(span)` (and `on_start(span)`, if given) for every
+        span, e.g. to log slow requests.
+    """
+
+    def __init__(self, on_end, on_start=None):
+        self._on_end = on_end
+        self._on_start = on_start
+
+    def on_start(self, span):
+        if self._on_start is not None:
+            self._on_start(span)
+
+    def on_end(self, span):
+        self._on_end(span)
+
+
+class OpenTelemetryTracer(Tracer):
+    """
+        Records spans with an OpenTelemetry tracer, with phases as
+        `phase.<name>` attributes (in seconds).
+
+            tracer = OpenTelemetryTracer(opentelemetry.trace.get_tracer('fbmessenger'))
+
+        Requires `opentelemetry-api` (`pip install fbmessenger[opentelemetry]`).
+    """
+
+    def __init__(self, tracer):
+        from opentelemetry import trace
+        self._trace = trace
+        self.tracer = tracer
+
+    def on_start(self, span):
+        context = None
+        if span.parent is not None and span.parent.context is not None:
+            context = self._trace.set_span_in_context(span.parent.context)
+        span.context = self.tracer.start_span(span.name, context=context, start_time=int(span.start_time * 1e9))
+
+    def on_end(self, span):
+        native = span.context
+        for key, value in span.attributes.items():
+            if value is not None:
+                native.set_attribute(key, value)
+        for phase, seconds in span.phases.items():
+            native.set_attribute('phase.' + phase, seconds)
+        if span.error is not None:
+            native.record_exception(span.error)
+            native.set_status(self._trace.Status(self._trace.StatusCode.ERROR, str(span.error)))
+        native.end(end_time=int((span.start_time + span.duration) * 1e9))
+
+
+def current_span():
+    """
+        Returns the active span of the calling thread, or `None`.
+    """
+    return getattr(_local, 'span', None)
+
+
+def start_span(tracer, name, activate=True, **attributes):
+    """
+        Starts a span, by default making it the calling thread's active
+        span until it ends. Spans that can't be tied to a thread (e.g. in
+        coroutines) should not be activated.
+    """
+    span = Span(name, attributes, current_span())
+    if activate:
+        _local.span = span
+    _notify(tracer.on_start, span)
+    return span
+
+
+def end_span(tracer, span, error=None):
+    span.duration = monotonic() - span.started
+    span.error = error
+    if current_span() is span:
+        _local.span = span.parent
+    _notify(tracer.on_end, span)
+
+
+def _notify(hook, span):
+    # A broken tracer mustn't break sending
+    try:
+        hook(span)
+    except Exception:
+        logger.exception('Tracer failed on %r', span)
+
+
+def get_trace_id(headers, data=None):
+    """
+        Returns the `fbtrace_id` of a Graph API response, from its
+        `x-fb-trace-id` header or its error.
+    """
+    trace_id = None
+    if headers is not None:
+        trace_id = headers.get('x-fb-trace-id') or headers.get('X-FB-Trace-ID')
+    if trace_id is None:
+        trace_id = (get_error(data) or {}).get('fbtrace_id')
+    return trace_id
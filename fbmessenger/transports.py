@@ -0,0 +1,340 @@
+"""
+Transports send the HTTP requests made by `MessengerClient`.
+
+A transport is any object with `get`, `post` and `delete` methods taking
+the URL and `requests` style keyword arguments (`params`, `data`, `json`,
+`headers` and `timeout`), which return a response with `status_code`,
+`content` and `json()`, and raise `requests` exceptions for network errors.
+A `requests.Session` is one, and is used by default.
+
+    client = MessengerClient(page_access_token, transport=StdlibTransport())
+"""
+from __future__ import absolute_import
+
+import abc
+import collections
+import json
+import random
+import select
+import socket
+import threading
+import time
+
+import requests
+import six
+from six.moves import http_client
+from six.moves.urllib.parse import parse_qs, urlencode, urlsplit
+
+from .adapters import GRAPH_API_PREFIX, GraphAdapter
+
+
+@six.add_metaclass(abc.ABCMeta)
+class Transport(object):
+    """
+        Base class for transports, which only need to implement `request`.
+    """
+
+    @abc.abstractmethod
+    def request(self, method, url, params=None, data=None, json=None, headers=None, timeout=None):
+        """Makes a request and returns a response like `requests.Response`"""
+
+    def get(self, url, **kwargs):
+        return self.request('get', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('post', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('delete', url, **kwargs)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class Response(object):
+    """
+        A response returned by `StdlibTransport` and `FakeGraphTransport`.
+    """
+
+    def __init__(self, status_code, content, headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+    @property
+    def text(self):
+        return self.content.decode('utf8')
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class RequestsTransport(Transport):
+    """
+        Sends requests with a `requests.Session`, by default one with a
+        `GraphAdapter` mounted.
+
+        @optional:
+            session: the session to use
+            **kwargs: `GraphAdapter` settings for the default session
+    """
+
+    def __init__(self, session=None, **kwargs):
+        if session is None:
+            session = requests.Session()
+            session.mount(GRAPH_API_PREFIX, GraphAdapter(**kwargs))
+        self.session = session
+
+    def request(self, method, url, **kwargs):
+        return getattr(self.session, method)(url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+def _connection_dropped(sock):
+    # A pooled connection that is readable before we've sent anything has
+    # been closed by the server
+    try:
+        return bool(select.select([sock], [], [], 0)[0])
+    except (OSError, ValueError):
+        return True
+
+
+class StdlibTransport(Transport):
+    """
+        Sends requests using only the standard library (`http.client`),
+        keeping a connection to each host open per thread.
+
+        @optional:
+            reuse_connections: keep connections open between requests
+            context: `ssl.SSLContext` for HTTPS connections
+    """
+
+    def __init__(self, reuse_connections=True, context=None):
+        self.reuse_connections = reuse_connections
+        self.context = context
+        self._local = threading.local()
+
+    def _connections(self):
+        if not hasattr(self._local, 'connections'):
+            self._local.connections = {}
+        return self._local.connections
+
+    def _connection(self, scheme, netloc, connect_timeout):
+        connections = self._connections()
+        conn = connections.get((scheme, netloc))
+        if conn is not None and conn.sock is not None and _connection_dropped(conn.sock):
+            conn.close()
+        if conn is None:
+            if scheme == 'https':
+                conn = http_client.HTTPSConnection(netloc, timeout=connect_timeout, context=self.context)
+            else:
+                conn = http_client.HTTPConnection(netloc, timeout=connect_timeout)
+            connections[(scheme, netloc)] = conn
+        if conn.sock is None:
+            conn.timeout = connect_timeout
+            try:
+                conn.connect()
+            except socket.timeout as e:
+                self._discard(scheme, netloc)
+                raise requests.ConnectTimeout(e)
+            except (OSError, IOError) as e:
+                self._discard(scheme, netloc)
+                raise requests.ConnectionError(e)
+        return conn
+
+    def _discard(self, scheme, netloc):
+        conn = self._connections().pop((scheme, netloc), None)
+        if conn is not None:
+            conn.close()
+
+    @staticmethod
+    def _body(data, json_body, headers):
+        if json_body is not None:
+            headers.setdefault('Content-Type', 'application/json')
+            return json.dumps(json_body).encode('utf8')
+        if isinstance(data, dict):
+            headers.setdefault('Content-Type', 'application/x-www-form-urlencoded')
+            return urlencode(data).encode('utf8')
+        if isinstance(data, six.text_type):
+            return data.encode('utf8')
+        if hasattr(data, 'read') and hasattr(data, '__len__'):
+            headers.setdefault('Content-Length', str(len(data)))
+        return data
+
+    def request(self, method, url, params=None, data=None, json=None, headers=None, timeout=None):
+        parts = urlsplit(url)
+        path = parts.path or '/'
+        query = [parts.query] if parts.query else []
+        if params:
+            query.append(urlencode(params))
+        if query:
+            path += '?' + '&'.join(query)
+        headers = dict(headers or {})
+        body = self._body(data, json, headers)
+        connect_timeout, read_timeout = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+
+        conn = self._connection(parts.scheme, parts.netloc, connect_timeout)
+        try:
+            conn.sock.settimeout(read_timeout)
+            conn.request(method.upper(), path, body=body, headers=headers)
+            r = conn.getresponse()
+            content = r.read()
+        except socket.timeout as e:
+            self._discard(parts.scheme, parts.netloc)
+            raise requests.ReadTimeout(e)
+        except (OSError, IOError, http_client.HTTPException) as e:
+            self._discard(parts.scheme, parts.netloc)
+            raise requests.ConnectionError(e)
+
+        if not self.reuse_connections or r.will_close:
+            self._discard(parts.scheme, parts.netloc)
+        return Response(r.status, content, dict(r.getheaders()))
+
+    def close(self):
+        """
+            Closes the calling thread's connections.
+        """
+        for conn in self._connections().values():
+            conn.close()
+        self._connections().clear()
+
+
+class FakeGraphTransport(Transport):
+    """
+        An in-memory Graph API, for tests, load tests and benchmarks that
+        shouldn't touch the network.
+
+        Every endpoint used by `MessengerClient` answers with a plausible
+        response, and `calls` counts the requests made to each one (e.g.
+        `calls['post', 'me/messages']`). Override `respond` to change the
+        responses.
+
+        @optional:
+            latency: seconds each request takes, or a function returning
+                them (e.g. `lambda: random.expovariate(20)`)
+            error_rate: fraction of requests failing with a transient
+                server error
+            throttle_rate: fraction of requests that are throttled
+            throttle_code: Graph API error code of throttled responses
+            seed: seed for the choice of failed and throttled requests
+    """
+
+    def __init__(self, latency=0, error_rate=0, throttle_rate=0, throttle_code=613, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.throttle_code = throttle_code
+        self.calls = collections.Counter()
+        self._random = random.Random(seed)
+        self._ids = 0
+        self._lock = threading.Lock()
+
+    def _next_id(self):
+        with self._lock:
+            self._ids += 1
+            return self._ids
+
+    @staticmethod
+    def _path(url):
+        # '/v2.12/me/messages' -> 'me/messages'
+        path = urlsplit(url).path.lstrip('/')
+        if path.startswith('v'):
+            path = path.partition('/')[2]
+        return path
+
+    @staticmethod
+    def _decode(data, json_body):
+        if json_body is not None:
+            return json_body
+        if hasattr(data, 'read'):
+            data.read()
+            return {}
+        if isinstance(data, dict):
+            return data
+        if isinstance(data, six.binary_type):
+            data = data.decode('utf8')
+        return json.loads(data) if data else {}
+
+    def request(self, method, url, params=None, data=None, json=None, headers=None, timeout=None):
+        latency = self.latency() if callable(self.latency) else self.latency
+        if latency:
+            time.sleep(latency)
+
+        path = self._path(url)
+        body = self._decode(data, json)
+        with self._lock:
+            self.calls[method, path] += 1
+            roll = self._random.random()
+
+        if roll < self.error_rate:
+            status_code, response = 500, {
+                'error': {
+                    'message': 'An unexpected error has occurred. Please retry your request later.',
+                    'type': 'OAuthException',
+                    'code': 2,
+                    'is_transient': True,
+                    'fbtrace_id': 'fake',
+                }
+            }
+        elif roll < self.error_rate + self.throttle_rate:
+            status_code, response = 400, {
+                'error': {
+                    'message': 'Calls to this api have exceeded the rate limit.',
+                    'type': 'OAuthException',
+                    'code': self.throttle_code,
+                    'fbtrace_id': 'fake',
+                }
+            }
+        else:
+            status_code, response = 200, self.respond(method, path, params or {}, body)
+        return self._response(status_code, response)
+
+    @staticmethod
+    def _response(status_code, response):
+        return Response(status_code, json.dumps(response).encode('utf8'), {'Content-Type': 'application/json'})
+
+    def respond(self, method, path, params, body):
+        """
+            Returns the decoded response to a successful request.
+        """
+        if path == 'me/messages':
+            recipient_id = body['recipient']
+            if isinstance(recipient_id, six.string_types):
+                recipient_id = json.loads(recipient_id)
+            recipient_id = str(recipient_id['id'])
+            if 'sender_action' in body:
+                return {'recipient_id': recipient_id}
+            return {'recipient_id': recipient_id, 'message_id': 'm_{}'.format(self._next_id())}
+        if path == 'me/message_attachments':
+            return {'attachment_id': str(self._next_id())}
+        if path == '' and method == 'post':
+            return [self._batch_response(operation) for operation in json.loads(body['batch'])]
+        if path == '' and method == 'get':
+            return dict(
+                (psid, self._profile(psid, params.get('fields', '')))
+                for psid in str(params['ids']).split(',')
+            )
+        if path == 'me/messenger_profile' and method == 'get':
+            return {'data': []}
+        if method == 'get' and not path.startswith('me'):
+            return self._profile(path, params.get('fields', ''))
+        return {'result': 'success'}
+
+    def _batch_response(self, operation):
+        body = dict((key, values[0]) for key, values in parse_qs(operation.get('body', '')).items())
+        response = self.respond(operation['method'].lower(), operation['relative_url'], {}, body)
+        return {'code': 200, 'body': json.dumps(response)}
+
+    @staticmethod
+    def _profile(psid, fields):
+        profile = dict((field, '{}_{}'.format(field, psid)) for field in fields.split(',') if field)
+        profile['id'] = psid
+        return profile
@@ -77,8 +77,17 @@ setup(
         'Programming Language :: Python :: 3.3',
         'Programming Language :: Python :: 3.4',
         'Programming Language :: Python :: 3.5',
+        'Programming Language :: Python :: 3.8',
     ],
-    install_requires=['requests>=2.0'],
+    install_requires=[
+        'requests>=2.0',
+        'futures; python_version < "3"',
+    ],
+    extras_require={
+        'async': ['aiohttp>=3.3; python_version >= "3.8"'],
+        'http2': ['httpx[http2]>=0.18; python_version >= "3.8"'],
+        'opentelemetry': ['opentelemetry-api>=1.0'],
+    },
     packages=['fbmessenger'],
     cmdclass={'test': PyTest},
     tests_require=test_requirements,
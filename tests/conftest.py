@@ -0,0 +1,133 @@
+import json
+import sys
+import threading
+import time
+
+import pytest
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from six.moves.socketserver import ThreadingMixIn
+
+from fbmessenger import BaseMessenger
+
+collect_ignore = []
+if sys.version_info < (3, 8):
+    # `fbmessenger.aio` and `fbmessenger.http2` support Python 3.8+, and
+    # their tests use `asyncio.run` and `mock.AsyncMock`
+    collect_ignore += ['test_aio.py', 'test_http2.py']
+if sys.version_info < (3, 5):
+    collect_ignore.append('test_tracing.py')
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, *args, **kwargs):
+        HTTPServer.__init__(self, *args, **kwargs)
+        self.requests = []
+        self.connections = 0
+
+    def process_request(self, request, client_address):
+        self.connections += 1
+        ThreadingMixIn.process_request(self, request, client_address)
+
+    def handle_error(self, request, client_address):
+        # e.g. the client hanging up on a slow response
+        pass
+
+    def url(self, path='', host=None):
+        return 'http://{}:{}{}'.format(host or self.server_address[0], self.server_address[1], path)
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+        Answers every POST like the Send API, after 0.3 seconds for paths
+        starting with `/slow`.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.requests.append((self.path, dict(self.headers), body))
+        if self.path.startswith('/slow'):
+            time.sleep(0.3)
+        response = json.dumps({'recipient_id': '1', 'message_id': 'mid.1'}).encode('utf8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.send_header('x-fb-trace-id', 'AbCdEf')
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    """
+        A local HTTP server, which records `requests` and counts
+        `connections`.
+    """
+    server = Server(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def clock(request, monkeypatch):
+    """
+        A fake clock standing in for the test module's `CLOCK` (by default
+        `time.time`). Move it on with `clock[0] += seconds`.
+    """
+    now = [1000.0]
+    monkeypatch.setattr(getattr(request.module, 'CLOCK', 'time.time'), lambda: now[0])
+    return now
+
+
+class EchoMessenger(BaseMessenger):
+    """
+        Echoes messages back, and fails on postbacks.
+    """
+
+    def message(self, message):
+        return self.send({'text': 'Echo: ' + message['message']['text']})
+
+    def postback(self, message):
+        raise RuntimeError('Broken handler')
+
+    def account_linking(self, message):
+        pass
+
+    def delivery(self, message):
+        pass
+
+    def optin(self, message):
+        pass
+
+    def read(self, message):
+        pass
+
+
+@pytest.fixture
+def echo_messenger():
+    return EchoMessenger
+
+
+def webhook_event(sender_id=1, **kwargs):
+    """
+        A webhook payload with a single event, e.g.
+        `webhook_event(message={'text': 'hi'})`.
+    """
+    message = {'sender': {'id': sender_id}, 'recipient': {'id': 2}}
+    message.update(kwargs)
+    return {'entry': [{'messaging': [message]}]}
+
+
+@pytest.fixture
+def event():
+    return webhook_event
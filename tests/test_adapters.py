@@ -0,0 +1,39 @@
+import socket
+
+import requests
+
+from fbmessenger import MessengerClient
+from fbmessenger.adapters import GraphAdapter, keepalive_socket_options
+
+
+def test_keepalive_socket_options():
+    options = keepalive_socket_options(idle=30)
+    assert (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1) in options
+    if hasattr(socket, 'TCP_KEEPIDLE'):
+        assert (socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 30) in options
+
+
+def test_graph_adapter_pool_settings():
+    adapter = GraphAdapter(pool_connections=2, pool_maxsize=64, pool_block=True)
+    assert adapter.poolmanager.connection_pool_kw['maxsize'] == 64
+    assert adapter.poolmanager.connection_pool_kw['block'] is True
+    assert (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1) in adapter.poolmanager.connection_pool_kw['socket_options']
+
+
+def test_graph_adapter_without_keepalive():
+    adapter = GraphAdapter(keepalive=False)
+    assert (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1) not in adapter.poolmanager.connection_pool_kw['socket_options']
+
+
+def test_default_session_uses_graph_adapter():
+    client = MessengerClient(12345678, pool_maxsize=64, pool_block=True)
+    adapter = client.session.get_adapter(client.graph_url)
+    assert isinstance(adapter, GraphAdapter)
+    assert adapter._pool_maxsize == 64
+    assert adapter._pool_block is True
+
+
+def test_explicit_session_is_untouched():
+    session = requests.Session()
+    client = MessengerClient(12345678, session=session, pool_maxsize=64)
+    assert not isinstance(client.session.get_adapter(client.graph_url), GraphAdapter)
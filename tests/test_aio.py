@@ -0,0 +1,363 @@
+import asyncio
+import io
+import json
+import socket
+
+import mock
+import pytest
+
+aiohttp = pytest.importorskip('aiohttp')
+
+from fbmessenger import attachments
+from fbmessenger.aio import AsyncMessengerClient
+from fbmessenger.cache import AttachmentCache, ProfileCache
+from fbmessenger.circuit_breaker import CircuitBreakers
+from fbmessenger.metrics import Metrics
+from fbmessenger.retry import RetryPolicy
+
+
+@pytest.fixture
+def session():
+    session = mock.MagicMock()
+    session.closed = False
+    session.close = mock.AsyncMock()
+    return session
+
+
+@pytest.fixture
+def client(session):
+    return AsyncMessengerClient(page_access_token=12345678, api_version=2.12, app_secret=12345678,
+                                session=session)
+
+
+@pytest.fixture
+def recipient_id():
+    return 987654321
+
+
+@pytest.fixture
+def default_params():
+    return {
+        'access_token': 12345678,
+        'appsecret_proof': 'e220691b3e23647fc17c4b282bb469ac77fbadb8f5c77898294e42de95add560',
+    }
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def set_response(session, data):
+    response = session.request.return_value.__aenter__.return_value
+    response.json = mock.AsyncMock(return_value=data)
+    return response
+
+
+def test_get_user_data(client, session, recipient_id, default_params):
+    set_response(session, {'first_name': 'Test'})
+    resp = run(client.get_user_data(recipient_id, fields=['first_name']))
+
+    assert resp == {'first_name': 'Test'}
+    session.request.assert_called_with(
+        'GET',
+        'https://graph.facebook.com/v2.12/{}'.format(recipient_id),
+        params=dict({'fields': 'first_name'}, **default_params),
+    )
+
+
+def test_send(client, session, recipient_id, default_params):
+    set_response(session, {'recipient_id': recipient_id, 'message_id': 'mid.1'})
+    resp = run(client.send({'text': 'Test message'}, recipient_id, timeout=5))
+
+    assert resp == {'recipient_id': recipient_id, 'message_id': 'mid.1'}
+    args, kwargs = session.request.call_args
+    assert args == ('POST', 'https://graph.facebook.com/v2.12/me/messages')
+    assert kwargs['params'] == default_params
+    assert kwargs['json'] == {
+        'messaging_type': 'RESPONSE',
+        'notification_type': 'REGULAR',
+        'recipient': {
+            'id': recipient_id,
+        },
+        'message': {'text': 'Test message'},
+    }
+    assert kwargs['timeout'].sock_connect == 5
+    assert kwargs['timeout'].sock_read == 5
+
+
+def test_send_invalid_messaging_type(client, recipient_id):
+    with pytest.raises(ValueError):
+        run(client.send({'text': 'Test message'}, recipient_id, messaging_type='INVALID'))
+
+
+def test_delete_get_started(client, session, default_params):
+    set_response(session, {'result': 'success'})
+    resp = run(client.delete_get_started())
+
+    assert resp == {'result': 'success'}
+    session.request.assert_called_with(
+        'DELETE',
+        'https://graph.facebook.com/v2.12/me/messenger_profile',
+        params=default_params,
+        json={'fields': ['get_started']},
+    )
+
+
+def test_upload_attachment(client, session, default_params):
+    set_response(session, {'attachment_id': '12345'})
+    attachment = attachments.Image(url='https://some-image.com/image.jpg')
+    resp = run(client.upload_attachment(attachment))
+
+    assert resp == {'attachment_id': '12345'}
+    args, kwargs = session.request.call_args
+    assert args == ('POST', 'https://graph.facebook.com/v2.12/me/message_attachments')
+
+
+def test_default_session_created_lazily():
+    client = AsyncMessengerClient(12345678, pool_maxsize=5)
+    assert client.session is None
+
+    async def go():
+        session = client._get_session()
+        assert isinstance(session, aiohttp.ClientSession)
+        assert session.connector.limit == 5
+        assert client._get_session() is session
+        await client.close()
+        assert session.closed
+
+    run(go())
+
+
+def test_context_manager_closes_session(client, session):
+    async def go():
+        async with client as c:
+            assert c is client
+
+    run(go())
+    assert session.close.await_count == 1
+
+
+def test_send_batch(client, session, default_params):
+    set_response(session, [
+        {'code': 200, 'body': '{"message_id": "mid.1"}'},
+        {'code': 200, 'body': '{"message_id": "mid.2"}'},
+    ])
+    resp = run(client.send_batch([({'text': 'a'}, 1), ({'text': 'b'}, 2)]))
+
+    assert resp == [{'message_id': 'mid.1'}, {'message_id': 'mid.2'}]
+    args, kwargs = session.request.call_args
+    assert args == ('POST', 'https://graph.facebook.com/v2.12')
+    assert len(json.loads(kwargs['data']['batch'])) == 2
+
+
+def test_broadcast(client, session):
+    set_response(session, {'message_id': 'mid.1'})
+
+    async def go():
+        return [item async for item in client.broadcast({'text': 'a'}, range(5), concurrency=2)]
+
+    resp = run(go())
+    assert sorted(recipient_id for recipient_id, _ in resp) == list(range(5))
+    assert all(r == {'message_id': 'mid.1'} for _, r in resp)
+    assert session.request.call_count == 5
+    args, kwargs = session.request.call_args
+    assert json.loads(kwargs['data'])['message'] == {'text': 'a'}
+
+
+def test_broadcast_carries_on_after_network_errors(client, session):
+    response = set_response(session, {'message_id': 'mid.1'})
+    context = session.request.return_value
+    context.__aenter__ = mock.AsyncMock(side_effect=[response, aiohttp.ServerTimeoutError(), response])
+
+    async def go():
+        return dict([item async for item in client.broadcast({'text': 'a'}, range(3), concurrency=1)])
+
+    resp = run(go())
+    assert resp[0] == resp[2] == {'message_id': 'mid.1'}
+    assert isinstance(resp[1], aiohttp.ServerTimeoutError)
+
+
+def test_default_session_enables_tcp_keepalive(server, monkeypatch):
+    options = mock.Mock(return_value=[(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)])
+    monkeypatch.setattr('fbmessenger.aio.keepalive_socket_options', options)
+    client = AsyncMessengerClient(12345678)
+    client.graph_url = server.url('/v2.12')
+
+    async def go():
+        await client.send({'text': 'a'}, 1)
+        await client.send({'text': 'b'}, 1)
+        await client.close()
+
+    run(go())
+    assert options.call_count == 1
+    assert server.connections == 1
+
+
+def test_default_session_without_keepalive(server, monkeypatch):
+    options = mock.Mock(return_value=[])
+    monkeypatch.setattr('fbmessenger.aio.keepalive_socket_options', options)
+    client = AsyncMessengerClient(12345678, keepalive=False)
+    client.graph_url = server.url('/v2.12')
+
+    async def go():
+        await client.send({'text': 'a'}, 1)
+        await client.send({'text': 'b'}, 1)
+        await client.close()
+
+    run(go())
+    assert not options.called
+    # Connections are still reused
+    assert server.connections == 1
+
+
+def test_send_retries_transient_errors(session, recipient_id, monkeypatch):
+    monkeypatch.setattr('asyncio.sleep', mock.AsyncMock())
+    client = AsyncMessengerClient(12345678, session=session, retry_policy=RetryPolicy())
+    response = session.request.return_value.__aenter__.return_value
+    response.status = 200
+    response.json = mock.AsyncMock(side_effect=[
+        {'error': {'message': 'Service unavailable', 'code': 2}},
+        {'message_id': 'mid.1'},
+    ])
+
+    assert run(client.send({'text': 'a'}, recipient_id)) == {'message_id': 'mid.1'}
+    assert session.request.call_count == 2
+
+
+def test_cancelled_half_open_probe_is_released(session, recipient_id):
+    breakers = CircuitBreakers(failure_threshold=1, recovery_timeout=0)
+    breakers.get('messages').record_failure()
+    client = AsyncMessengerClient(12345678, session=session, circuit_breakers=breakers)
+    response = set_response(session, {'message_id': 'mid.1'})
+    response.status = 200
+    context = session.request.return_value
+
+    async def stall(*args):
+        await asyncio.sleep(10)
+
+    context.__aenter__ = mock.AsyncMock(side_effect=stall)
+
+    async def go():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(client.send({'text': 'a'}, recipient_id), 0.01)
+        context.__aenter__ = mock.AsyncMock(return_value=response)
+        return await client.send({'text': 'a'}, recipient_id)
+
+    assert run(go()) == {'message_id': 'mid.1'}
+
+
+def test_get_user_data_cached(session, recipient_id):
+    client = AsyncMessengerClient(12345678, session=session, profile_cache=ProfileCache())
+    set_response(session, {'first_name': 'Test'})
+
+    assert run(client.get_user_data(recipient_id, fields='first_name')) == {'first_name': 'Test'}
+    assert run(client.get_user_data(recipient_id, fields='first_name')) == {'first_name': 'Test'}
+    assert session.request.call_count == 1
+
+
+def test_get_users_data(client, session):
+    set_response(session, {'1': {'first_name': 'One'}, '2': {'first_name': 'Two'}})
+
+    assert run(client.get_users_data([1, 2], fields='first_name')) == {
+        1: {'first_name': 'One'},
+        2: {'first_name': 'Two'},
+    }
+    args, kwargs = session.request.call_args
+    assert kwargs['params']['ids'] == '1,2'
+
+
+def test_get_users_data_unexpected_response(client, session):
+    set_response(session, None)
+
+    resp = run(client.get_users_data([1, 2]))
+    assert sorted(resp) == [1, 2]
+    assert all('Unexpected response' in resp[recipient_id]['error']['message'] for recipient_id in (1, 2))
+
+
+def test_send_reuses_uploaded_attachment(session, recipient_id):
+    client = AsyncMessengerClient(12345678, session=session, attachment_cache=AttachmentCache())
+    set_response(session, {'attachment_id': '12345', 'message_id': 'mid.1'})
+    payload = attachments.Image(url='https://some-image.com/image.jpg').to_dict()
+
+    run(client.send(payload, recipient_id))
+    run(client.send(payload, recipient_id))
+    assert session.request.call_count == 3
+    args, kwargs = session.request.call_args
+    assert kwargs['json']['message']['attachment']['payload'] == {'attachment_id': '12345'}
+
+
+def test_upload_attachment_filedata(client, session):
+    set_response(session, {'attachment_id': '12345'})
+    resp = run(client.upload_attachment(attachments.File(), filedata=io.BytesIO(b'data')))
+
+    assert resp == {'attachment_id': '12345'}
+    args, kwargs = session.request.call_args
+    assert isinstance(kwargs['data'], aiohttp.FormData)
+
+
+def test_upload_attachments(client, session):
+    set_response(session, {'attachment_id': '12345'})
+
+    async def go():
+        uploads = [(attachments.File(), io.BytesIO(b'a')), (attachments.File(), io.BytesIO(b'b'))]
+        return [item async for item in client.upload_attachments(uploads)]
+
+    assert len(run(go())) == 2
+    assert session.request.call_count == 2
+
+
+def test_sync_profile(client, session):
+    set_response(session, {'data': [{'get_started': {'payload': 'start'}}]})
+    profile = {'get_started': {'payload': 'start'}}
+
+    assert run(client.sync_profile(profile)) == []
+    assert session.request.call_count == 1
+
+
+def test_send_json_codec(session, recipient_id):
+    client = AsyncMessengerClient(12345678, session=session, json_codec='json')
+    response = session.request.return_value.__aenter__.return_value
+    response.read = mock.AsyncMock(return_value=b'{"message_id": "mid.1"}')
+    resp = run(client.send({'text': 'Test message'}, recipient_id))
+
+    assert resp == {'message_id': 'mid.1'}
+    args, kwargs = session.request.call_args
+    assert 'json' not in kwargs
+    assert kwargs['headers'] == {'Content-Type': 'application/json'}
+    assert json.loads(kwargs['data'])['message'] == {'text': 'Test message'}
+
+
+def test_send_action_coalesced(session, recipient_id):
+    from fbmessenger.coalescing import ActionCoalescer
+
+    client = AsyncMessengerClient(12345678, session=session, action_coalescer=ActionCoalescer(window=0.01))
+    set_response(session, {'recipient_id': recipient_id})
+
+    async def actions():
+        await client.send_action('typing_on', recipient_id)
+        await client.send_action('typing_on', recipient_id)
+        await client.send_action('typing_off', recipient_id)
+        await client.send({'text': 'Test message'}, recipient_id)
+        await asyncio.sleep(0.05)
+        await client.send_action('typing_off', recipient_id)
+        await asyncio.sleep(0.05)
+
+    run(actions())
+    sent = [kwargs['json'].get('sender_action') for args, kwargs in session.request.call_args_list]
+    assert sent == ['typing_on', None, 'typing_off']
+
+
+def test_outbox_is_not_supported():
+    with pytest.raises(ValueError):
+        AsyncMessengerClient('page_access_token', outbox=mock.Mock())
+
+
+def test_metrics(session, recipient_id):
+    metrics = Metrics()
+    client = AsyncMessengerClient(page_access_token=12345678, session=session, metrics=metrics)
+    response = set_response(session, {'recipient_id': recipient_id})
+    response.status = 200
+
+    run(client.send({'text': 'hello'}, recipient_id))
+
+    assert metrics.snapshot()['fbmessenger_requests_total'] == {('messages', 'post', '200', ''): 1}
@@ -0,0 +1,89 @@
+import io
+
+from fbmessenger.cache import AttachmentCache, MemoryBackend, ProfileCache
+
+
+def test_memory_backend_lru():
+    backend = MemoryBackend(maxsize=2)
+    backend.set('a', 1)
+    backend.set('b', 2)
+    assert backend.get('a') == 1
+    backend.set('c', 3)
+    assert backend.get('b') is None
+    assert backend.get('a') == 1
+    assert backend.get('c') == 3
+    backend.delete('a')
+    assert backend.get('a') is None
+    assert len(backend) == 1
+
+
+def test_profile_cache_hit_and_miss(clock):
+    cache = ProfileCache(ttl=60)
+    assert cache.get(1, ['first_name']) is None
+
+    cache.set(1, ['first_name', 'locale'], {'first_name': 'Test', 'locale': 'en_GB', 'id': '1'})
+    assert cache.get(1, ['first_name']) == {'first_name': 'Test', 'id': '1'}
+    assert cache.get(1, ['first_name', 'locale']) == {'first_name': 'Test', 'locale': 'en_GB', 'id': '1'}
+    assert cache.get(1, ['first_name', 'gender']) is None
+    assert cache.stats() == {'hits': 2, 'misses': 2}
+
+
+def test_profile_cache_merges_fields(clock):
+    cache = ProfileCache(ttl=60)
+    cache.set(1, ['first_name'], {'first_name': 'Test'})
+    cache.set(1, ['locale'], {'locale': 'en_GB'})
+    assert cache.get(1, ['first_name', 'locale']) == {'first_name': 'Test', 'locale': 'en_GB'}
+
+
+def test_profile_cache_remembers_missing_fields(clock):
+    cache = ProfileCache(ttl=60)
+    cache.set(1, ['first_name', 'gender'], {'first_name': 'Test'})
+    assert cache.get(1, ['first_name', 'gender']) == {'first_name': 'Test'}
+
+
+def test_profile_cache_expiry(clock):
+    cache = ProfileCache(ttl=60)
+    cache.set(1, ['first_name'], {'first_name': 'Test'})
+    clock[0] += 30
+    cache.set(1, ['locale'], {'locale': 'en_GB'})
+    clock[0] += 31
+    assert cache.get(1, ['first_name']) is None
+    assert cache.get(1, ['locale']) == {'locale': 'en_GB'}
+
+
+def test_profile_cache_delete(clock):
+    cache = ProfileCache()
+    cache.set(1, ['first_name'], {'first_name': 'Test'})
+    cache.delete(1)
+    assert cache.get(1, ['first_name']) is None
+
+
+def test_profile_cache_custom_backend(clock):
+    backend = MemoryBackend()
+    cache = ProfileCache(backend=backend)
+    cache.set(1, ['first_name'], {'first_name': 'Test'})
+    assert backend.get(1)['first_name'] == ('Test', 1300.0)
+
+
+def test_attachment_cache():
+    cache = AttachmentCache()
+    assert cache.get('image', 'https://example.com/a.png') is None
+    cache.set('image', 'https://example.com/a.png', 1234)
+    assert cache.get('image', 'https://example.com/a.png') == '1234'
+    assert cache.get('file', 'https://example.com/a.png') is None
+    cache.delete('image', 'https://example.com/a.png')
+    assert cache.get('image', 'https://example.com/a.png') is None
+
+
+def test_attachment_cache_persists(tmpdir):
+    path = str(tmpdir.join('attachments.db'))
+    cache = AttachmentCache(path)
+    cache.set('video', 'https://example.com/a.mp4', '5678')
+    cache.close()
+
+    assert AttachmentCache(path).get('video', 'https://example.com/a.mp4') == '5678'
+
+
+def test_attachment_cache_content_key():
+    key = AttachmentCache.content_key(io.BytesIO(b'hello'))
+    assert key == 'sha256:2cf24dba5fb0a30e26e83b2ac5b9e29e1b161e5c1fa7425e73043362938b9824'
@@ -0,0 +1,87 @@
+import pytest
+
+from fbmessenger.circuit_breaker import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    CircuitBreakers,
+    CircuitOpenError,
+    get_endpoint,
+)
+
+CLOCK = 'fbmessenger.circuit_breaker.monotonic'
+
+
+def test_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker('messages', failure_threshold=3, recovery_timeout=10)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+    breaker.before_call()
+
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError) as excinfo:
+        breaker.before_call()
+    assert excinfo.value.endpoint == 'messages'
+    assert excinfo.value.retry_after == 10
+
+
+def test_half_open_probe_success_closes(clock):
+    breaker = CircuitBreaker('messages', failure_threshold=1, recovery_timeout=10)
+    breaker.record_failure()
+    clock[0] += 10
+    assert breaker.state == HALF_OPEN
+
+    breaker.before_call()
+    # Only one probe at a time
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    breaker.before_call()
+
+
+def test_half_open_probe_failure_reopens(clock):
+    breaker = CircuitBreaker('messages', failure_threshold=1, recovery_timeout=10)
+    breaker.record_failure()
+    clock[0] += 10
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_released_probe_can_be_retaken(clock):
+    breaker = CircuitBreaker('messages', failure_threshold=1, recovery_timeout=10)
+    assert breaker.before_call() is False
+    breaker.record_failure()
+    clock[0] += 10
+    assert breaker.before_call() is True
+    breaker.release_probe()
+    assert breaker.state == HALF_OPEN
+    assert breaker.before_call() is True
+
+
+def test_circuit_breakers_per_endpoint():
+    breakers = CircuitBreakers(failure_threshold=1)
+    assert breakers.get('messages') is breakers.get('messages')
+    assert breakers.get('messages') is not breakers.get('attachments')
+    assert breakers.get('messages').failure_threshold == 1
+
+
+@pytest.mark.parametrize('path, endpoint', [
+    ('me/messages', 'messages'),
+    ('me/messenger_profile', 'messenger_profile'),
+    ('me/message_attachments', 'attachments'),
+    ('1234567', 'user_profile'),
+    ('', 'batch'),
+])
+def test_get_endpoint(path, endpoint):
+    assert get_endpoint(path) == endpoint
@@ -1,6 +1,12 @@
+import io
+import json
+import socket
+
 import requests
 import mock
 import pytest
+from six.moves.urllib.parse import parse_qs
+from urllib3.exceptions import MaxRetryError, NewConnectionError
 
 from fbmessenger import (
     MessengerClient,
@@ -8,6 +14,12 @@ from fbmessenger import (
     quick_replies,
     thread_settings,
 )
+from fbmessenger.cache import AttachmentCache, ProfileCache
+from fbmessenger.circuit_breaker import CircuitBreakers, CircuitOpenError
+from fbmessenger.json_codecs import JSON_CODEC
+from fbmessenger.multipart import MultipartEncoder
+from fbmessenger.responses import SendResult
+from fbmessenger.retry import RetryPolicy
 
 
 @pytest.fixture
@@ -502,3 +514,799 @@ def test_auth_args_with_app_secret():
         'access_token': '1595920652850039|OxHxLwLVJkTZhEjwlHqPgxKgzRVU',
         'appsecret_proof': '577b294b975cde92b75ef73c1469c7355bd7fb5e568d522f534dc539dec65b38',
     }
+
+
+def test_send_batch(client, monkeypatch, default_params):
+    mock_post = mock.Mock()
+    mock_post.return_value.status_code = 200
+    mock_post.return_value.json.return_value = [
+        {'code': 200, 'body': '{"recipient_id": "1", "message_id": "mid.1"}'},
+        {'code': 200, 'body': '{"recipient_id": "2", "message_id": "mid.2"}'},
+    ]
+    monkeypatch.setattr('requests.Session.post', mock_post)
+    resp = client.send_batch([
+        ({'text': 'Test message'}, 1),
+        ({'text': 'Test message'}, 2, 'MESSAGE_TAG', 'NO_PUSH', 'ACCOUNT_UPDATE'),
+    ])
+
+    assert resp == [
+        {'recipient_id': '1', 'message_id': 'mid.1'},
+        {'recipient_id': '2', 'message_id': 'mid.2'},
+    ]
+    assert mock_post.call_count == 1
+    args, kwargs = mock_post.call_args
+    assert args == ('https://graph.facebook.com/v{api_version}'.format(api_version=client.api_version),)
+    assert kwargs['params'] == default_params
+    assert kwargs['data']['include_headers'] == 'false'
+
+    batch = json.loads(kwargs['data']['batch'])
+    assert [op['method'] for op in batch] == ['POST', 'POST']
+    assert [op['relative_url'] for op in batch] == ['me/messages', 'me/messages']
+    body = parse_qs(batch[1]['body'])
+    assert body['messaging_type'] == ['MESSAGE_TAG']
+    assert body['notification_type'] == ['NO_PUSH']
+    assert body['tag'] == ['ACCOUNT_UPDATE']
+    assert json.loads(body['recipient'][0]) == {'id': 2}
+    assert json.loads(body['message'][0]) == {'text': 'Test message'}
+
+
+def test_send_batch_splits_requests(client, monkeypatch):
+    def batch_response(url, params, data, timeout):
+        response = mock.Mock()
+        response.json.return_value = [
+            {'code': 200, 'body': json.dumps({'recipient_id': op['body']})}
+            for op in json.loads(data['batch'])
+        ]
+        return response
+
+    mock_post = mock.Mock(side_effect=batch_response)
+    monkeypatch.setattr('requests.Session.post', mock_post)
+    items = [({'text': 'Test message'}, i) for i in range(client.BATCH_LIMIT * 2 + 1)]
+    resp = client.send_batch(items)
+
+    assert mock_post.call_count == 3
+    assert len(resp) == len(items)
+    assert [json.loads(parse_qs(r['recipient_id'])['recipient'][0])['id'] for r in resp] == list(range(len(items)))
+
+
+def test_send_batch_incomplete_and_failed(client, monkeypatch):
+    mock_post = mock.Mock()
+    mock_post.return_value.json.return_value = [
+        {'code': 200, 'body': '{"message_id": "mid.1"}'},
+        None,
+    ]
+    monkeypatch.setattr('requests.Session.post', mock_post)
+    assert client.send_batch([({'text': 'a'}, 1), ({'text': 'b'}, 2)]) == [{'message_id': 'mid.1'}, None]
+
+    error = {'error': {'message': 'Invalid OAuth access token.', 'code': 190}}
+    mock_post.return_value.json.return_value = error
+    assert client.send_batch([({'text': 'a'}, 1), ({'text': 'b'}, 2)]) == [error, error]
+
+
+def test_send_batch_invalid_item(client, monkeypatch):
+    mock_post = mock.Mock()
+    monkeypatch.setattr('requests.Session.post', mock_post)
+    with pytest.raises(ValueError):
+        client.send_batch([({'text': 'a'}, 1), ({'text': 'b'}, 2, 'INVALID')])
+    assert mock_post.call_count == 0
+
+
+def test_broadcast(client, monkeypatch, default_params):
+    def send_response(url, params, data, headers, timeout):
+        response = mock.Mock()
+        response.json.return_value = {
+            'recipient_id': json.loads(data)['recipient']['id'],
+            'message_id': 'mid.1',
+        }
+        return response
+
+    mock_post = mock.Mock(side_effect=send_response)
+    monkeypatch.setattr('requests.Session.post', mock_post)
+    payload = {'text': 'Test message'}
+    resp = dict(client.broadcast(payload, iter(range(25)), 'MESSAGE_TAG', tag='ACCOUNT_UPDATE',
+                                 concurrency=4))
+
+    assert resp == dict((i, {'recipient_id': i, 'message_id': 'mid.1'}) for i in range(25))
+    assert mock_post.call_count == 25
+    args, kwargs = mock_post.call_args
+    assert args == ('https://graph.facebook.com/v{api_version}/me/messages'.format(api_version=client.api_version),)
+    assert kwargs['params'] == default_params
+    assert kwargs['headers'] == {'Content-Type': 'application/json'}
+    body = json.loads(kwargs['data'])
+    assert body == {
+        'messaging_type': 'MESSAGE_TAG',
+        'notification_type': 'REGULAR',
+        'tag': 'ACCOUNT_UPDATE',
+        'recipient': {
+            'id': body['recipient']['id'],
+        },
+        'message': payload,
+    }
+
+
+def test_broadcast_carries_on_after_network_errors(client, monkeypatch):
+    def send_response(url, params, data, headers, timeout):
+        recipient_id = json.loads(data)['recipient']['id']
+        if recipient_id == 3:
+            raise requests.ReadTimeout('timed out')
+        return response({'recipient_id': recipient_id, 'message_id': 'mid.1'})
+
+    monkeypatch.setattr('requests.Session.post', mock.Mock(side_effect=send_response))
+
+    resp = dict(client.broadcast({'text': 'Test message'}, range(100), concurrency=4))
+
+    assert len(resp) == 100
+    assert isinstance(resp.pop(3), requests.ReadTimeout)
+    assert all(r['message_id'] == 'mid.1' for r in resp.values())
+
+
+def test_broadcast_invalid_messaging_type(client):
+    with pytest.raises(ValueError):
+        client.broadcast({'text': 'Test message'}, [1, 2], 'INVALID')
+
+
+def test_send_rate_limited(monkeypatch, recipient_id):
+    limiter = mock.Mock()
+    limiter.reserve.return_value = 0.25
+    mock_sleep = mock.Mock()
+    mock_post = mock.Mock()
+    mock_post.return_value.json.return_value = {'message_id': 'mid.1'}
+    monkeypatch.setattr('time.sleep', mock_sleep)
+    monkeypatch.setattr('requests.Session.post', mock_post)
+    client = MessengerClient(12345678, rate_limiter=limiter)
+
+    client.send({'text': 'Test message'}, recipient_id)
+    limiter.reserve.assert_called_with(recipient_id)
+    mock_sleep.assert_called_with(0.25)
+
+    client.send_action('typing_on', recipient_id)
+    assert limiter.reserve.call_count == 2
+
+    client.subscribe_app_to_page()
+    assert limiter.reserve.call_count == 2
+
+
+def test_send_batch_rate_limited(monkeypatch):
+    limiter = mock.Mock()
+    limiter.reserve.return_value = 0
+    mock_post = mock.Mock()
+    mock_post.return_value.json.return_value = [None, None, None]
+    monkeypatch.setattr('requests.Session.post', mock_post)
+    client = MessengerClient(12345678, rate_limiter=limiter)
+
+    client.send_batch([({'text': 'a'}, 1), ({'text': 'b'}, 2), ({'text': 'c'}, 3)])
+    assert [c[0][0] for c in limiter.reserve.call_args_list] == [1, 2, 3]
+
+
+def response(data, status_code=200):
+    r = mock.Mock()
+    r.status_code = status_code
+    r.json.return_value = data
+    return r
+
+
+def test_send_retries_transient_errors(monkeypatch, recipient_id):
+    throttled = {'error': {'message': 'Too many calls', 'code': 613}}
+    mock_post = mock.Mock(side_effect=[
+        response(throttled, 400),
+        response(None, 500),
+        response({'message_id': 'mid.1'}),
+    ])
+    mock_sleep = mock.Mock()
+    monkeypatch.setattr('requests.Session.post', mock_post)
+    monkeypatch.setattr('time.sleep', mock_sleep)
+    client = MessengerClient(12345678, retry_policy=RetryPolicy(max_attempts=3, backoff=1, jitter=False))
+
+    assert client.send({'text': 'Test message'}, recipient_id) == {'message_id': 'mid.1'}
+    assert mock_post.call_count == 3
+    assert [c[0][0] for c in mock_sleep.call_args_list] == [1, 2]
+
+
+def test_send_gives_up_after_max_attempts(monkeypatch, recipient_id):
+    throttled = {'error': {'message': 'Too many calls', 'code': 4}}
+    mock_post = mock.Mock(return_value=response(throttled, 400))
+    monkeypatch.setattr('requests.Session.post', mock_post)
+    monkeypatch.setattr('time.sleep', mock.Mock())
+    client = MessengerClient(12345678, retry_policy=RetryPolicy(max_attempts=2))
+
+    assert client.send({'text': 'Test message'}, recipient_id) == throttled
+    assert mock_post.call_count == 2
+
+
+def test_send_does_not_retry_permanent_errors(monkeypatch, recipient_id):
+    invalid = {'error': {'message': 'Invalid parameter', 'code': 100}}
+    mock_post = mock.Mock(return_value=response(invalid, 400))
+    monkeypatch.setattr('requests.Session.post', mock_post)
+    client = MessengerClient(12345678, retry_policy=RetryPolicy())
+
+    assert client.send({'text': 'Test message'}, recipient_id) == invalid
+    assert mock_post.call_count == 1
+
+
+def test_send_does_not_retry_read_timeout(monkeypatch, recipient_id):
+    mock_post = mock.Mock(side_effect=requests.ReadTimeout())
+    monkeypatch.setattr('requests.Session.post', mock_post)
+    client = MessengerClient(12345678, retry_policy=RetryPolicy())
+
+    with pytest.raises(requests.ReadTimeout):
+        client.send({'text': 'Test message'}, recipient_id)
+    assert mock_post.call_count == 1
+
+
+def test_send_retries_connect_timeout(monkeypatch, recipient_id):
+    mock_post = mock.Mock(side_effect=[requests.ConnectTimeout(), response({'message_id': 'mid.1'})])
+    monkeypatch.setattr('requests.Session.post', mock_post)
+    monkeypatch.setattr('time.sleep', mock.Mock())
+    client = MessengerClient(12345678, retry_policy=RetryPolicy())
+
+    assert client.send({'text': 'Test message'}, recipient_id) == {'message_id': 'mid.1'}
+    assert mock_post.call_count == 2
+
+
+def test_send_retries_connection_refused(monkeypatch, recipient_id):
+    # Nothing is listening on a port that was just freed
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    monkeypatch.setattr('time.sleep', mock.Mock())
+    client = MessengerClient(12345678, retry_policy=RetryPolicy(max_attempts=2))
+    client.graph_url = 'http://127.0.0.1:{}/v2.12'.format(port)
+    mock_post = mock.Mock(wraps=client.session.post)
+    monkeypatch.setattr(client.session, 'post', mock_post)
+
+    with pytest.raises(requests.ConnectionError):
+        client.send({'text': 'Test message'}, recipient_id)
+    assert mock_post.call_count == 2
+
+
+def test_send_retries_failed_name_resolution(monkeypatch, recipient_id):
+    reason = NewConnectionError(None, 'Name or service not known')
+    error = requests.ConnectionError(MaxRetryError(None, '/me/messages', reason))
+    mock_post = mock.Mock(side_effect=[error, response({'message_id': 'mid.1'})])
+    monkeypatch.setattr('requests.Session.post', mock_post)
+    monkeypatch.setattr('time.sleep', mock.Mock())
+    client = MessengerClient(12345678, retry_policy=RetryPolicy())
+
+    assert client.send({'text': 'Test message'}, recipient_id) == {'message_id': 'mid.1'}
+    assert mock_post.call_count == 2
+
+
+def test_send_does_not_retry_dropped_connection(monkeypatch, recipient_id):
+    mock_post = mock.Mock(side_effect=requests.ConnectionError('Connection reset by peer'))
+    monkeypatch.setattr('requests.Session.post', mock_post)
+    client = MessengerClient(12345678, retry_policy=RetryPolicy())
+
+    with pytest.raises(requests.ConnectionError):
+        client.send({'text': 'Test message'}, recipient_id)
+    assert mock_post.call_count == 1
+
+
+def test_get_user_data_retries_read_timeout(monkeypatch, recipient_id):
+    mock_get = mock.Mock(side_effect=[requests.ReadTimeout(), response({'first_name': 'Test'})])
+    monkeypatch.setattr('requests.Session.get', mock_get)
+    monkeypatch.setattr('time.sleep', mock.Mock())
+    client = MessengerClient(12345678, retry_policy=RetryPolicy())
+
+    assert client.get_user_data(recipient_id) == {'first_name': 'Test'}
+    assert mock_get.call_count == 2
+
+
+def test_retries_non_json_server_error(monkeypatch, recipient_id):
+    bad_gateway = response(None, 502)
+    bad_gateway.json.side_effect = ValueError('No JSON object could be decoded')
+    mock_get = mock.Mock(side_effect=[bad_gateway, response({'first_name': 'Test'})])
+    monkeypatch.setattr('requests.Session.get', mock_get)
+    monkeypatch.setattr('time.sleep', mock.Mock())
+    client = MessengerClient(12345678, retry_policy=RetryPolicy())
+
+    assert client.get_user_data(recipient_id) == {'first_name': 'Test'}
+
+
+def test_send_does_not_retry_non_json_server_error(monkeypatch, recipient_id):
+    # The message may have been delivered before the gateway timed out
+    gateway_timeout = response(None, 504)
+    gateway_timeout.json.side_effect = ValueError('No JSON object could be decoded')
+    mock_post = mock.Mock(return_value=gateway_timeout)
+    monkeypatch.setattr('requests.Session.post', mock_post)
+    monkeypatch.setattr('time.sleep', mock.Mock())
+    client = MessengerClient(12345678, retry_policy=RetryPolicy(),
+                             circuit_breakers=CircuitBreakers(failure_threshold=1))
+
+    with pytest.raises(ValueError):
+        client.send({'text': 'Test message'}, recipient_id)
+    assert mock_post.call_count == 1
+    # It still counts against the endpoint's health
+    with pytest.raises(CircuitOpenError):
+        client.send({'text': 'Test message'}, recipient_id)
+
+
+def test_no_retry_policy(monkeypatch, recipient_id):
+    mock_post = mock.Mock(return_value=response(None, 500))
+    monkeypatch.setattr('requests.Session.post', mock_post)
+    client = MessengerClient(12345678)
+
+    assert client.send({'text': 'Test message'}, recipient_id) is None
+    assert mock_post.call_count == 1
+
+
+def test_circuit_breaker_fails_fast(monkeypatch, recipient_id):
+    mock_post = mock.Mock(side_effect=requests.ReadTimeout())
+    monkeypatch.setattr('requests.Session.post', mock_post)
+    client = MessengerClient(12345678, circuit_breakers=CircuitBreakers(failure_threshold=2))
+
+    for _ in range(2):
+        with pytest.raises(requests.ReadTimeout):
+            client.send({'text': 'Test message'}, recipient_id)
+    with pytest.raises(CircuitOpenError):
+        client.send({'text': 'Test message'}, recipient_id)
+    assert mock_post.call_count == 2
+
+    # Other endpoints are unaffected
+    mock_post.side_effect = None
+    mock_post.return_value = response({'success': True})
+    assert client.subscribe_app_to_page() == {'success': True}
+
+
+def test_circuit_breaker_ignores_client_errors(monkeypatch, recipient_id):
+    invalid = {'error': {'message': 'Invalid parameter', 'code': 100}}
+    mock_post = mock.Mock(return_value=response(invalid, 400))
+    monkeypatch.setattr('requests.Session.post', mock_post)
+    client = MessengerClient(12345678, circuit_breakers=CircuitBreakers(failure_threshold=1))
+
+    for _ in range(3):
+        assert client.send({'text': 'Test message'}, recipient_id) == invalid
+    assert mock_post.call_count == 3
+
+
+def test_circuit_breaker_with_retries(monkeypatch, recipient_id):
+    mock_post = mock.Mock(return_value=response(None, 503))
+    monkeypatch.setattr('requests.Session.post', mock_post)
+    monkeypatch.setattr('time.sleep', mock.Mock())
+    client = MessengerClient(12345678, retry_policy=RetryPolicy(max_attempts=5),
+                             circuit_breakers=CircuitBreakers(failure_threshold=2))
+
+    with pytest.raises(CircuitOpenError):
+        client.send({'text': 'Test message'}, recipient_id)
+    assert mock_post.call_count == 2
+
+
+def test_circuit_breaker_releases_unfinished_probe(monkeypatch, recipient_id):
+    mock_post = mock.Mock(side_effect=KeyboardInterrupt)
+    monkeypatch.setattr('requests.Session.post', mock_post)
+    breakers = CircuitBreakers(failure_threshold=1, recovery_timeout=0)
+    breakers.get('messages').record_failure()
+    client = MessengerClient(12345678, circuit_breakers=breakers)
+
+    with pytest.raises(KeyboardInterrupt):
+        client.send({'text': 'Test message'}, recipient_id)
+
+    mock_post.side_effect = None
+    mock_post.return_value = response({'message_id': 'mid.1'})
+    assert client.send({'text': 'Test message'}, recipient_id) == {'message_id': 'mid.1'}
+
+
+def test_get_user_data_cached(monkeypatch, recipient_id):
+    mock_get = mock.Mock(return_value=response({'first_name': 'Test', 'locale': 'en_GB', 'id': '1'}))
+    monkeypatch.setattr('requests.Session.get', mock_get)
+    cache = ProfileCache()
+    client = MessengerClient(12345678, profile_cache=cache)
+
+    assert client.get_user_data(recipient_id, fields=['first_name', 'locale'])['first_name'] == 'Test'
+    assert client.get_user_data(recipient_id, fields='first_name') == {'first_name': 'Test', 'id': '1'}
+    assert mock_get.call_count == 1
+    assert cache.stats() == {'hits': 1, 'misses': 1}
+
+    client.get_user_data(recipient_id, fields='gender')
+    assert mock_get.call_count == 2
+
+
+def test_get_user_data_errors_not_cached(monkeypatch, recipient_id):
+    error = {'error': {'message': 'Invalid user id', 'code': 100}}
+    mock_get = mock.Mock(return_value=response(error, 400))
+    monkeypatch.setattr('requests.Session.get', mock_get)
+    client = MessengerClient(12345678, profile_cache=ProfileCache())
+
+    assert client.get_user_data(recipient_id) == error
+    assert client.get_user_data(recipient_id) == error
+    assert mock_get.call_count == 2
+
+
+def test_get_users_data(client, monkeypatch, default_params):
+    def lookup(url, params, timeout):
+        return response(dict(
+            (recipient_id, {'first_name': 'User {}'.format(recipient_id), 'id': recipient_id})
+            for recipient_id in params['ids'].split(',')
+        ))
+
+    mock_get = mock.Mock(side_effect=lookup)
+    monkeypatch.setattr('requests.Session.get', mock_get)
+    recipient_ids = list(range(client.IDS_LIMIT * 2 + 1))
+    resp = client.get_users_data(recipient_ids, fields=['first_name'])
+
+    assert mock_get.call_count == 3
+    assert sorted(resp) == recipient_ids
+    assert resp[7] == {'first_name': 'User 7', 'id': '7'}
+    args, kwargs = mock_get.call_args
+    assert args == ('https://graph.facebook.com/v{api_version}'.format(api_version=client.api_version),)
+    assert kwargs['params']['fields'] == 'first_name'
+    assert kwargs['params']['access_token'] == default_params['access_token']
+    assert len(kwargs['params']['ids'].split(',')) in (1, client.IDS_LIMIT)
+
+
+def test_get_users_data_error(client, monkeypatch):
+    error = {'error': {'message': 'Invalid user id', 'code': 100}}
+    mock_get = mock.Mock(return_value=response(error, 400))
+    monkeypatch.setattr('requests.Session.get', mock_get)
+
+    assert client.get_users_data([1, 2]) == {1: error, 2: error}
+
+
+@pytest.mark.parametrize('body', [None, [], 'ok'])
+def test_get_users_data_unexpected_response(client, monkeypatch, body):
+    monkeypatch.setattr('requests.Session.get', mock.Mock(return_value=response(body)))
+
+    resp = client.get_users_data([1, 2])
+
+    assert sorted(resp) == [1, 2]
+    assert all('Unexpected response' in resp[recipient_id]['error']['message'] for recipient_id in (1, 2))
+
+
+def test_get_users_data_network_error(client, monkeypatch):
+    def lookup(url, params, timeout):
+        if params['ids'].startswith('0,'):
+            raise requests.ReadTimeout('timed out')
+        return response({'50': {'first_name': 'Fifty', 'id': '50'}})
+
+    monkeypatch.setattr('requests.Session.get', mock.Mock(side_effect=lookup))
+
+    resp = client.get_users_data(range(client.IDS_LIMIT + 1))
+
+    assert resp[50] == {'first_name': 'Fifty', 'id': '50'}
+    assert all(isinstance(resp[recipient_id], requests.ReadTimeout) for recipient_id in range(50))
+
+
+def test_get_users_data_cached(monkeypatch):
+    mock_get = mock.Mock(return_value=response({'2': {'first_name': 'Two', 'id': '2'}}))
+    monkeypatch.setattr('requests.Session.get', mock_get)
+    cache = ProfileCache()
+    cache.set(1, ['first_name'], {'first_name': 'One', 'id': '1'})
+    client = MessengerClient(12345678, profile_cache=cache)
+
+    assert client.get_users_data([1, 2], fields='first_name') == {
+        1: {'first_name': 'One', 'id': '1'},
+        2: {'first_name': 'Two', 'id': '2'},
+    }
+    assert mock_get.call_args[1]['params']['ids'] == '2'
+    assert client.get_user_data(2, fields='first_name') == {'first_name': 'Two', 'id': '2'}
+    assert mock_get.call_count == 1
+
+
+def test_upload_attachment_cached(monkeypatch):
+    mock_post = mock.Mock(return_value=response({'attachment_id': '12345'}))
+    monkeypatch.setattr('requests.Session.post', mock_post)
+    client = MessengerClient(12345678, attachment_cache=AttachmentCache())
+
+    attachment = attachments.Image(url='https://some-image.com/image.jpg')
+    assert client.upload_attachment(attachment) == {'attachment_id': '12345'}
+    assert client.upload_attachment(attachment) == {'attachment_id': '12345'}
+    assert mock_post.call_count == 1
+    assert mock_post.call_args[1]['json']['message']['attachment']['payload'] == {
+        'url': 'https://some-image.com/image.jpg',
+        'is_reusable': 'true',
+    }
+
+
+def test_send_reuses_uploaded_attachment(monkeypatch, recipient_id):
+    def post(url, params, json, timeout):
+        if url.endswith('/me/message_attachments'):
+            return response({'attachment_id': '12345'})
+        return response({'message_id': 'mid.1'})
+
+    mock_post = mock.Mock(side_effect=post)
+    monkeypatch.setattr('requests.Session.post', mock_post)
+    client = MessengerClient(12345678, attachment_cache=AttachmentCache())
+    payload = attachments.Video(url='https://some-video.com/video.mp4').to_dict()
+
+    for _ in range(3):
+        client.send(payload, recipient_id)
+
+    urls = [c[0][0].rsplit('/', 1)[1] for c in mock_post.call_args_list]
+    assert urls == ['message_attachments', 'messages', 'messages', 'messages']
+    assert mock_post.call_args[1]['json']['message'] == {
+        'attachment': {
+            'type': 'video',
+            'payload': {
+                'attachment_id': '12345',
+            },
+        },
+    }
+    # The caller's payload is left alone
+    assert payload['attachment']['payload'] == {'url': 'https://some-video.com/video.mp4'}
+
+
+def test_send_falls_back_to_url_when_upload_fails(monkeypatch, recipient_id):
+    error = {'error': {'message': 'Invalid URL', 'code': 100}}
+    mock_post = mock.Mock(side_effect=[response(error, 400), response({'message_id': 'mid.1'})])
+    monkeypatch.setattr('requests.Session.post', mock_post)
+    client = MessengerClient(12345678, attachment_cache=AttachmentCache())
+    payload = attachments.Image(url='https://some-image.com/image.jpg').to_dict()
+
+    assert client.send(payload, recipient_id) == {'message_id': 'mid.1'}
+    assert mock_post.call_args[1]['json']['message'] == payload
+
+
+def test_send_text_ignores_attachment_cache(monkeypatch, recipient_id):
+    mock_post = mock.Mock(return_value=response({'message_id': 'mid.1'}))
+    monkeypatch.setattr('requests.Session.post', mock_post)
+    client = MessengerClient(12345678, attachment_cache=AttachmentCache())
+
+    client.send({'text': 'Test message'}, recipient_id)
+    assert mock_post.call_count == 1
+
+
+def test_upload_attachment_filedata(client, monkeypatch, default_params, tmpdir):
+    path = tmpdir.join('video.mp4')
+    path.write_binary(b'0' * 100000)
+    bodies = []
+
+    def post(url, params, data, headers, timeout):
+        bodies.append(data.read())
+        return response({'attachment_id': '12345'})
+
+    mock_post = mock.Mock(side_effect=post)
+    monkeypatch.setattr('requests.Session.post', mock_post)
+    attachment = attachments.Video()
+    assert client.upload_attachment(attachment, filedata=str(path)) == {'attachment_id': '12345'}
+
+    args, kwargs = mock_post.call_args
+    assert args == ('https://graph.facebook.com/v{api_version}/me/message_attachments'.format(
+        api_version=client.api_version),)
+    assert kwargs['params'] == default_params
+    assert isinstance(kwargs['data'], MultipartEncoder)
+    assert kwargs['headers'] == {'Content-Type': kwargs['data'].content_type}
+    assert b'{"attachment": {"type": "video", "payload": {}}}' in bodies[0]
+    assert b'filename="video.mp4"\r\nContent-Type: video/mp4' in bodies[0]
+    assert b'0' * 100000 in bodies[0]
+
+
+def test_upload_attachment_filedata_validation(client):
+    with pytest.raises(ValueError):
+        client.upload_attachment(attachments.Image(url='https://some-image.com/image.jpg'),
+                                 filedata=io.BytesIO(b'data'))
+
+
+def test_upload_attachment_filedata_cached_by_content(monkeypatch):
+    mock_post = mock.Mock(return_value=response({'attachment_id': '12345'}))
+    monkeypatch.setattr('requests.Session.post', mock_post)
+    client = MessengerClient(12345678, attachment_cache=AttachmentCache())
+
+    for _ in range(2):
+        assert client.upload_attachment(attachments.Image(), filedata=io.BytesIO(b'data')) == {
+            'attachment_id': '12345',
+        }
+    assert mock_post.call_count == 1
+
+
+def test_upload_attachment_filedata_rewound_on_retry(monkeypatch):
+    bodies = []
+
+    def post(url, params, data, headers, timeout):
+        bodies.append(data.read())
+        return response(None, 503) if len(bodies) == 1 else response({'attachment_id': '12345'})
+
+    monkeypatch.setattr('requests.Session.post', mock.Mock(side_effect=post))
+    monkeypatch.setattr('time.sleep', mock.Mock())
+    client = MessengerClient(12345678, retry_policy=RetryPolicy())
+
+    client.upload_attachment(attachments.File(), filedata=io.BytesIO(b'data'))
+    assert len(bodies) == 2
+    assert bodies[0] == bodies[1]
+
+
+def test_upload_attachments(client, monkeypatch):
+    mock_post = mock.Mock(return_value=response({'attachment_id': '12345'}))
+    monkeypatch.setattr('requests.Session.post', mock_post)
+    uploads = [
+        (attachments.Image(url='https://some-image.com/image.jpg'), None),
+        (attachments.File(), io.BytesIO(b'data')),
+    ]
+    results = list(client.upload_attachments(uploads, concurrency=2))
+
+    assert len(results) == 2
+    assert all(r == {'attachment_id': '12345'} for _, r in results)
+    assert mock_post.call_count == 2
+
+
+@pytest.fixture
+def messenger_profile():
+    return thread_settings.MessengerProfile(
+        greetings=[thread_settings.GreetingText(text='Welcome')],
+        get_started=thread_settings.GetStartedButton(payload='start'),
+    )
+
+
+def test_sync_profile_up_to_date(client, monkeypatch, messenger_profile, default_params):
+    mock_get = mock.Mock(return_value=response({'data': [messenger_profile.to_dict()]}))
+    mock_post = mock.Mock()
+    monkeypatch.setattr('requests.Session.get', mock_get)
+    monkeypatch.setattr('requests.Session.post', mock_post)
+
+    assert client.sync_profile(messenger_profile) == []
+    mock_get.assert_called_once_with(
+        'https://graph.facebook.com/v{api_version}/me/messenger_profile'.format(api_version=client.api_version),
+        params=dict({'fields': 'get_started,greeting'}, **default_params),
+        timeout=None
+    )
+    assert mock_post.call_count == 0
+
+
+def test_sync_profile_sets_changed_fields(client, monkeypatch, messenger_profile):
+    current = messenger_profile.to_dict()
+    current['greeting'] = [{'locale': 'default', 'text': 'Old greeting'}]
+    monkeypatch.setattr('requests.Session.get', mock.Mock(return_value=response({'data': [current]})))
+    mock_post = mock.Mock(return_value=response({'result': 'success'}))
+    monkeypatch.setattr('requests.Session.post', mock_post)
+
+    assert client.sync_profile(messenger_profile) == [{'result': 'success'}]
+    assert mock_post.call_count == 1
+    assert mock_post.call_args[1]['json'] == {'greeting': [{'locale': 'default', 'text': 'Welcome'}]}
+
+
+def test_sync_profile_empty_profile(client, monkeypatch, messenger_profile):
+    monkeypatch.setattr('requests.Session.get', mock.Mock(return_value=response({'data': []})))
+    mock_post = mock.Mock(return_value=response({'result': 'success'}))
+    monkeypatch.setattr('requests.Session.post', mock_post)
+
+    client.sync_profile(messenger_profile)
+    assert mock_post.call_args[1]['json'] == messenger_profile.to_dict()
+
+
+def test_sync_profile_delete_missing(client, monkeypatch, messenger_profile):
+    current = dict(messenger_profile.to_dict(), persistent_menu=[{'locale': 'default'}])
+    mock_get = mock.Mock(return_value=response({'data': [current]}))
+    mock_post = mock.Mock()
+    mock_delete = mock.Mock(return_value=response({'result': 'success'}))
+    monkeypatch.setattr('requests.Session.get', mock_get)
+    monkeypatch.setattr('requests.Session.post', mock_post)
+    monkeypatch.setattr('requests.Session.delete', mock_delete)
+
+    assert client.sync_profile(messenger_profile, delete_missing=True) == [{'result': 'success'}]
+    assert mock_get.call_args[1]['params']['fields'] == 'get_started,greeting,persistent_menu'
+    assert mock_post.call_count == 0
+    assert mock_delete.call_args[1]['json'] == {'fields': ['persistent_menu']}
+
+
+def test_sync_profile_fetch_failed(client, monkeypatch, messenger_profile):
+    error = {'error': {'message': 'Unknown error', 'code': 1}}
+    monkeypatch.setattr('requests.Session.get', mock.Mock(return_value=response(error, 500)))
+    mock_post = mock.Mock(return_value=response({'result': 'success'}))
+    monkeypatch.setattr('requests.Session.post', mock_post)
+
+    client.sync_profile(messenger_profile)
+    assert mock_post.call_args[1]['json'] == messenger_profile.to_dict()
+
+
+def test_send_json_codec(monkeypatch, recipient_id):
+    codec = mock.Mock(wraps=JSON_CODEC)
+    mock_post = mock.Mock()
+    mock_post.return_value.content = b'{"message_id": "mid.1"}'
+    monkeypatch.setattr('requests.Session.post', mock_post)
+    client = MessengerClient(12345678, json_codec=codec)
+
+    assert client.send({'text': 'Test message'}, recipient_id) == {'message_id': 'mid.1'}
+    args, kwargs = mock_post.call_args
+    assert 'json' not in kwargs
+    assert kwargs['headers'] == {'Content-Type': 'application/json'}
+    assert json.loads(kwargs['data'].decode('utf8'))['message'] == {'text': 'Test message'}
+    assert codec.dumps.called
+    codec.loads.assert_called_with(b'{"message_id": "mid.1"}')
+
+
+def test_send_json_codec_invalid_response(monkeypatch, recipient_id):
+    mock_post = mock.Mock()
+    mock_post.return_value.content = b'<html>Bad Gateway</html>'
+    mock_post.return_value.status_code = 502
+    monkeypatch.setattr('requests.Session.post', mock_post)
+    client = MessengerClient(12345678, json_codec='json')
+
+    with pytest.raises(ValueError):
+        client.send({'text': 'Test message'}, recipient_id)
+
+
+def test_send_pre_encoded_payload(client, monkeypatch, recipient_id):
+    mock_post = mock.Mock()
+    mock_post.return_value.json.return_value = {'message_id': 'mid.1'}
+    monkeypatch.setattr('requests.Session.post', mock_post)
+
+    client.send(b'{"text": "Test message"}', recipient_id)
+    args, kwargs = mock_post.call_args
+    assert kwargs['headers'] == {'Content-Type': 'application/json'}
+    assert json.loads(kwargs['data'].decode('utf8')) == {
+        'messaging_type': 'RESPONSE',
+        'notification_type': 'REGULAR',
+        'recipient': {'id': recipient_id},
+        'message': {'text': 'Test message'},
+    }
+
+
+def test_send_batch_json_codec(monkeypatch):
+    mock_post = mock.Mock()
+    mock_post.return_value.content = json.dumps([
+        {'code': 200, 'body': json.dumps({'message_id': 'mid.1'})},
+    ]).encode('utf8')
+    monkeypatch.setattr('requests.Session.post', mock_post)
+    client = MessengerClient(12345678, json_codec='json')
+
+    assert client.send_batch([(b'{"text": "a"}', 1)]) == [{'message_id': 'mid.1'}]
+    args, kwargs = mock_post.call_args
+    body = parse_qs(json.loads(kwargs['data']['batch'])[0]['body'])
+    assert json.loads(body['message'][0]) == {'text': 'a'}
+
+
+def test_send_typed_responses(monkeypatch, recipient_id):
+    mock_post = mock.Mock(return_value=response({'recipient_id': recipient_id, 'message_id': 'mid.1'}))
+    monkeypatch.setattr('requests.Session.post', mock_post)
+    client = MessengerClient(12345678, typed_responses=True)
+
+    result = client.send({'text': 'Test message'}, recipient_id)
+    assert isinstance(result, SendResult)
+    assert result.ok
+    assert result.message_id == 'mid.1'
+    assert result.recipient_id == recipient_id
+    assert result.status_code == 200
+    assert result.latency >= 0
+    assert result.raw == {'recipient_id': recipient_id, 'message_id': 'mid.1'}
+
+
+def test_send_action_typed_responses_error(monkeypatch, recipient_id):
+    error = {'error': {'message': 'Invalid parameter', 'code': 100, 'fbtrace_id': 'AbCdEf'}}
+    monkeypatch.setattr('requests.Session.post', mock.Mock(return_value=response(error, 400)))
+    client = MessengerClient(12345678, typed_responses=True)
+
+    result = client.send_action('typing_on', recipient_id)
+    assert not result.ok
+    assert result.error.code == 100
+    assert result.error.fbtrace_id == 'AbCdEf'
+    assert result.error.error_class == 'permanent'
+    assert result.status_code == 400
+
+
+def test_send_batch_typed_responses(monkeypatch):
+    mock_post = mock.Mock(return_value=response([
+        {'code': 200, 'body': json.dumps({'recipient_id': '1', 'message_id': 'mid.1'})},
+        None,
+    ]))
+    monkeypatch.setattr('requests.Session.post', mock_post)
+    client = MessengerClient(12345678, typed_responses=True)
+
+    first, second = client.send_batch([({'text': 'a'}, 1), ({'text': 'b'}, 2)])
+    assert first.message_id == 'mid.1'
+    assert first.status_code == 200
+    assert first.latency >= 0
+    assert second is None
+
+
+def test_get_user_data_ignores_typed_responses(monkeypatch, recipient_id):
+    monkeypatch.setattr('requests.Session.get', mock.Mock(return_value=response({'first_name': 'Test'})))
+    client = MessengerClient(12345678, typed_responses=True)
+    assert client.get_user_data(recipient_id) == {'first_name': 'Test'}
+
+
+def test_send_typed_responses_reuses_attachments(monkeypatch, recipient_id):
+    mock_post = mock.Mock(side_effect=[
+        response({'attachment_id': '1234'}),
+        response({'recipient_id': recipient_id, 'message_id': 'mid.1'}),
+    ])
+    monkeypatch.setattr('requests.Session.post', mock_post)
+    client = MessengerClient(12345678, typed_responses=True, attachment_cache=AttachmentCache())
+
+    image = attachments.Image(url='https://example.com/image.jpg')
+    assert client.send(image.to_dict(), recipient_id).ok
+    assert client.attachment_cache.get('image', 'https://example.com/image.jpg') == '1234'
+    args, kwargs = mock_post.call_args
+    assert kwargs['json']['message']['attachment']['payload'] == {'attachment_id': '1234'}
+
+    result = client.upload_attachment(image)
+    assert result.attachment_id == '1234'
+    assert mock_post.call_count == 2
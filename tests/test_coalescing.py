@@ -0,0 +1,122 @@
+import threading
+
+import mock
+import pytest
+
+from fbmessenger import MessengerClient
+from fbmessenger.coalescing import DEFER, SEND, SKIP, ActionCoalescer, Scheduler
+from fbmessenger.transports import FakeGraphTransport
+
+CLOCK = 'fbmessenger.coalescing.monotonic'
+
+
+class FakeScheduler(object):
+
+    def __init__(self):
+        self.calls = []
+
+    def call_later(self, delay, callback):
+        handle = mock.Mock()
+        self.calls.append((delay, callback, handle))
+        return handle
+
+
+@pytest.fixture
+def scheduler():
+    return FakeScheduler()
+
+
+def test_typing_on_is_skipped_within_window(clock, scheduler):
+    coalescer = ActionCoalescer(window=2, scheduler=scheduler)
+    assert coalescer.before_action(1, 'typing_on') == SEND
+    assert coalescer.before_action(1, 'typing_on') == SKIP
+    assert coalescer.before_action(2, 'typing_on') == SEND
+    clock[0] += 2
+    assert coalescer.before_action(1, 'typing_on') == SEND
+    assert coalescer.skipped == 1
+
+
+def test_typing_on_is_sent_again_after_a_message(clock, scheduler):
+    coalescer = ActionCoalescer(window=2, scheduler=scheduler)
+    assert coalescer.before_action(1, 'typing_on') == SEND
+    coalescer.before_send(1)
+    assert coalescer.before_action(1, 'typing_on') == SEND
+
+
+def test_typing_off_is_cancelled_by_a_message(clock, scheduler):
+    coalescer = ActionCoalescer(window=2, scheduler=scheduler)
+    callback = mock.Mock()
+    assert coalescer.before_action(1, 'typing_off') == DEFER
+    coalescer.defer(1, callback)
+    assert coalescer.before_action(1, 'typing_off') == SKIP
+
+    delay, fire, handle = scheduler.calls[0]
+    assert delay == 2
+    coalescer.before_send(1)
+    handle.cancel.assert_called_with()
+    fire()
+    assert not callback.called
+
+
+def test_typing_off_is_sent_after_window(clock, scheduler):
+    coalescer = ActionCoalescer(window=2, scheduler=scheduler)
+    callback = mock.Mock()
+    coalescer.before_action(1, 'typing_on')
+    coalescer.defer(1, callback)
+    scheduler.calls[0][1]()
+    callback.assert_called_with()
+    # Typing is off, so it can be turned on again
+    assert coalescer.before_action(1, 'typing_on') == SEND
+
+
+def test_typing_on_cancels_pending_typing_off(clock, scheduler):
+    coalescer = ActionCoalescer(window=2, scheduler=scheduler)
+    coalescer.before_action(1, 'typing_on')
+    coalescer.defer(1, mock.Mock())
+    assert coalescer.before_action(1, 'typing_on') == SKIP
+    scheduler.calls[0][2].cancel.assert_called_with()
+
+
+def test_mark_seen_is_merged(clock, scheduler):
+    coalescer = ActionCoalescer(window=2, scheduler=scheduler)
+    assert coalescer.before_action(1, 'mark_seen') == SEND
+    clock[0] += 1
+    assert coalescer.before_action(1, 'mark_seen') == SKIP
+    clock[0] += 1
+    assert coalescer.before_action(1, 'mark_seen') == SEND
+
+
+def test_maxsize(clock, scheduler):
+    coalescer = ActionCoalescer(window=2, maxsize=2, scheduler=scheduler)
+    for recipient_id in (1, 2, 3):
+        coalescer.before_action(recipient_id, 'typing_on')
+    assert coalescer.before_action(1, 'typing_on') == SEND
+    assert coalescer.before_action(3, 'typing_on') == SKIP
+
+
+def test_scheduler():
+    scheduler = Scheduler()
+    done = threading.Event()
+    cancelled = mock.Mock()
+    scheduler.call_later(0.01, cancelled).cancel()
+    scheduler.call_later(0.02, done.set)
+    assert done.wait(2)
+    assert not cancelled.called
+
+
+def test_client_coalesces_sender_actions():
+    transport = FakeGraphTransport()
+    coalescer = ActionCoalescer(window=0.05)
+    client = MessengerClient(12345678, transport=transport, action_coalescer=coalescer)
+
+    assert client.send_action('typing_on', 1) == {'recipient_id': '1'}
+    assert client.send_action('typing_on', 1) == {'recipient_id': 1}
+    assert client.send_action('typing_off', 1) == {'recipient_id': 1}
+    client.send({'text': 'Hello'}, 1)
+    assert transport.calls['post', 'me/messages'] == 2
+
+    done = threading.Event()
+    client._send_action = mock.Mock(side_effect=lambda *args: done.set())
+    client.send_action('typing_off', 1)
+    assert done.wait(2)
+    client._send_action.assert_called_with('typing_off', 1, None)
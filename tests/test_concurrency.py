@@ -0,0 +1,64 @@
+import threading
+import time
+
+import pytest
+
+from fbmessenger.concurrency import imap_unordered
+
+
+def test_imap_unordered():
+    results = dict(imap_unordered(lambda x: x * 2, range(20), 4))
+    assert results == dict((x, x * 2) for x in range(20))
+
+
+def test_imap_unordered_bounds_in_flight():
+    lock = threading.Lock()
+    state = {'running': 0, 'max': 0, 'consumed': 0}
+
+    def items():
+        for i in range(30):
+            state['consumed'] += 1
+            yield i
+
+    def work(item):
+        with lock:
+            state['running'] += 1
+            state['max'] = max(state['max'], state['running'])
+        time.sleep(0.001)
+        with lock:
+            state['running'] -= 1
+        return item
+
+    results = imap_unordered(work, items(), 3)
+    next(results)
+    # Only enough items to fill the pool are pulled from the input
+    assert state['consumed'] <= 4
+
+    assert len(list(results)) == 29
+    assert state['max'] <= 3
+
+
+def test_imap_unordered_propagates_errors():
+    def work(item):
+        raise RuntimeError(item)
+
+    with pytest.raises(RuntimeError):
+        list(imap_unordered(work, range(3), 2))
+
+
+def test_imap_unordered_return_exceptions():
+    def work(item):
+        if item == 3:
+            raise RuntimeError(item)
+        return item
+
+    results = dict(imap_unordered(work, range(10), 2, return_exceptions=True))
+
+    assert len(results) == 10
+    assert isinstance(results.pop(3), RuntimeError)
+    assert results == dict((x, x) for x in range(10) if x != 3)
+
+
+def test_imap_unordered_invalid_concurrency():
+    with pytest.raises(ValueError):
+        list(imap_unordered(lambda x: x, range(3), 0))
@@ -0,0 +1,242 @@
+import io
+import time
+
+import mock
+import pytest
+import requests
+
+from fbmessenger import MessengerClient, attachments
+from fbmessenger.dead_letters import DeadLetterStore
+from fbmessenger.outbox import Outbox
+from fbmessenger.retry import PERMANENT, THROTTLED, TRANSIENT, RetryPolicy
+from fbmessenger.transports import FakeGraphTransport
+
+INVALID = {'error': {'code': 100, 'message': 'Invalid parameter', 'type': 'OAuthException'}}
+THROTTLE = {'error': {'code': 613, 'message': 'Calls to this api have exceeded the rate limit.'}}
+
+
+class FailingTransport(FakeGraphTransport):
+    """
+        Answers with each of `responses` in turn, then successfully.
+    """
+
+    def __init__(self, *responses):
+        super(FailingTransport, self).__init__()
+        self.responses = list(responses)
+
+    def request(self, method, url, **kwargs):
+        if self.responses:
+            response = self.responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            with self._lock:
+                self.calls[method, self._path(url)] += 1
+            return self._response(400, response)
+        return super(FailingTransport, self).request(method, url, **kwargs)
+
+
+@pytest.fixture
+def store():
+    return DeadLetterStore()
+
+
+def make_client(store, *responses, **kwargs):
+    return MessengerClient('page_access_token', transport=FailingTransport(*responses),
+                           dead_letters=store, **kwargs)
+
+
+def test_failed_send_is_stored(store):
+    client = make_client(store, INVALID)
+
+    response = client.send({'text': 'hello'}, 12345, messaging_type='UPDATE')
+
+    assert response == INVALID
+    [dead_letter] = store.list()
+    assert dead_letter.method == 'send'
+    assert dead_letter.recipient_id == '12345'
+    assert dead_letter.request == {
+        'payload': {'text': 'hello'},
+        'recipient_id': 12345,
+        'messaging_type': 'UPDATE',
+        'notification_type': 'REGULAR',
+        'timeout': None,
+        'tag': None,
+    }
+    assert dead_letter.error_class == PERMANENT
+    assert dead_letter.error_code == 100
+    assert dead_letter.status_code == 400
+    assert dead_letter.error == 'Invalid parameter'
+    assert len(dead_letter.attempts) == 1
+    assert dead_letter.attempts[0]['path'] == 'me/messages'
+
+
+def test_successful_send_is_not_stored(store):
+    make_client(store).send({'text': 'hello'}, 12345)
+    assert len(store) == 0
+
+
+def test_attempt_history_includes_retries(store):
+    client = make_client(store, THROTTLE, THROTTLE, THROTTLE,
+                         retry_policy=RetryPolicy(max_attempts=3, backoff=0, jitter=False))
+
+    client.send({'text': 'hello'}, 12345)
+
+    [dead_letter] = store.list()
+    assert dead_letter.error_class == THROTTLED
+    assert [attempt['error_code'] for attempt in dead_letter.attempts] == [613, 613, 613]
+
+
+def test_network_errors_are_stored_and_raised(store):
+    client = make_client(store, requests.ReadTimeout('timed out'))
+
+    with pytest.raises(requests.ReadTimeout):
+        client.send_action('typing_on', 12345)
+
+    [dead_letter] = store.list()
+    assert dead_letter.method == 'send_action'
+    assert dead_letter.request == {'sender_action': 'typing_on', 'recipient_id': 12345, 'timeout': None}
+    assert dead_letter.error_class == PERMANENT
+    assert 'timed out' in dead_letter.error
+
+
+def test_failed_upload_is_stored(store):
+    client = make_client(store, INVALID)
+
+    client.upload_attachment(attachments.Image(url='https://example.com/cat.jpg'))
+
+    [dead_letter] = store.list()
+    assert dead_letter.method == 'upload_attachment'
+    assert dead_letter.recipient_id is None
+    assert dead_letter.request['url'] == 'https://example.com/cat.jpg'
+    assert dead_letter.request['attachment_type'] == 'image'
+
+
+def test_upload_of_unnamed_file_is_not_stored(store):
+    client = make_client(store, INVALID)
+    client.upload_attachment(attachments.Image(), filedata=io.BytesIO(b'image'))
+    assert len(store) == 0
+
+
+def test_failed_upload_inside_send(store):
+    cache = mock.Mock()
+    cache.get.return_value = None
+    client = make_client(store, INVALID, attachment_cache=cache)
+
+    client.send(attachments.Image(url='https://example.com/cat.jpg').to_dict(), 12345)
+
+    # The upload fails, and the message is sent by URL instead
+    [dead_letter] = store.list()
+    assert dead_letter.method == 'upload_attachment'
+
+
+def test_list_filters(store):
+    client = make_client(store, INVALID, THROTTLE, INVALID)
+    client.send({'text': 'one'}, 1)
+    client.send({'text': 'two'}, 2)
+    started = time.time()
+    client.send_action('mark_seen', 3)
+
+    assert [d.recipient_id for d in store.list(error_class=PERMANENT)] == ['1', '3']
+    assert [d.recipient_id for d in store.list(error_class=[THROTTLED, TRANSIENT])] == ['2']
+    assert [d.recipient_id for d in store.list(method='send_action')] == ['3']
+    assert [d.recipient_id for d in store.list(since=started)] == ['3']
+    assert [d.recipient_id for d in store.list(until=started)] == ['1', '2']
+    assert [d.recipient_id for d in store.list(limit=1)] == ['1']
+
+
+def test_persists_between_instances(tmpdir):
+    path = str(tmpdir.join('dead_letters.db'))
+    make_client(DeadLetterStore(path), INVALID).send({'text': 'hello'}, 12345)
+    assert DeadLetterStore(path).list()[0].request['payload'] == {'text': 'hello'}
+
+
+def test_pre_encoded_payload_is_stored_decoded(store):
+    make_client(store, INVALID).send(b'{"text":"hello"}', 12345)
+    assert store.list()[0].request['payload'] == {'text': 'hello'}
+
+
+def test_redrive(store):
+    client = make_client(store, INVALID, INVALID)
+    client.send({'text': 'hello'}, 12345)
+    client.upload_attachment(attachments.Image(url='https://example.com/cat.jpg'))
+
+    results = store.redrive(client, rate=100)
+
+    assert results[0][1]['recipient_id'] == '12345'
+    assert 'attachment_id' in results[1][1]
+    assert len(store) == 0
+    assert client.session.calls['post', 'me/messages'] == 2
+
+
+def test_failed_redrive_adds_attempts(store):
+    client = make_client(store, INVALID, INVALID)
+    client.send({'text': 'hello'}, 12345)
+    [dead_letter] = store.list()
+
+    [(redriven, response)] = store.redrive(client, rate=100)
+
+    assert response == INVALID
+    [dead_letter] = store.list()
+    assert dead_letter.id == redriven.id
+    assert len(dead_letter.attempts) == 2
+    assert dead_letter.updated >= dead_letter.created
+
+
+def test_redrive_exception(store):
+    client = make_client(store, requests.ConnectionError('reset'), requests.ConnectionError('reset'))
+    with pytest.raises(requests.ConnectionError):
+        client.send({'text': 'hello'}, 12345)
+
+    [(_, response)] = store.redrive(client, rate=100)
+
+    assert isinstance(response, requests.ConnectionError)
+    assert len(store.list()[0].attempts) == 2
+
+
+@mock.patch('fbmessenger.dead_letters.time.sleep')
+def test_redrive_is_rate_limited(sleep, store):
+    client = make_client(store, INVALID, INVALID, INVALID)
+    for recipient_id in range(3):
+        client.send({'text': 'hello'}, recipient_id)
+
+    store.redrive(client, rate=2, burst=1)
+
+    assert len(store) == 0
+    delays = [call[0][0] for call in sleep.call_args_list]
+    assert len(delays) == 2
+    assert all(0 < delay <= 1 for delay in delays)
+
+
+def test_redrive_filters(store):
+    client = make_client(store, INVALID, THROTTLE)
+    client.send({'text': 'one'}, 1)
+    client.send({'text': 'two'}, 2)
+
+    results = store.redrive(client, rate=100, error_class=THROTTLED)
+
+    assert [d.recipient_id for d, _ in results] == ['2']
+    assert [d.recipient_id for d in store.list()] == ['1']
+
+
+def test_redrive_stops_when_throttled(store):
+    client = make_client(store, INVALID, INVALID, THROTTLE)
+    client.send({'text': 'one'}, 1)
+    client.send({'text': 'two'}, 2)
+
+    results = store.redrive(client, rate=100)
+
+    assert len(results) == 1
+    assert len(store) == 2
+    assert len(store.redrive(client, rate=100, stop_on_throttle=False)) == 2
+
+
+def test_outbox_drops_to_dead_letters(store, tmpdir):
+    transport = FailingTransport(INVALID)
+    with Outbox(str(tmpdir.join('outbox.db'))) as outbox:
+        client = MessengerClient('page_access_token', transport=transport, outbox=outbox,
+                                 dead_letters=store)
+        client.send({'text': 'hello'}, 12345).result(timeout=5)
+
+    [dead_letter] = store.list()
+    assert dead_letter.method == 'send'
+    assert dead_letter.request['payload'] == {'text': 'hello'}
@@ -0,0 +1,82 @@
+import threading
+import time
+
+import mock
+import pytest
+
+from fbmessenger.dispatcher import OrderedDispatcher
+
+
+@pytest.fixture
+def client():
+    client = mock.Mock()
+    client.sent = []
+    lock = threading.Lock()
+
+    def send(payload, recipient_id, **kwargs):
+        time.sleep(0.001)
+        with lock:
+            client.sent.append((recipient_id, payload))
+        return {'recipient_id': recipient_id}
+
+    client.send.side_effect = send
+    client.send_action.return_value = {'recipient_id': 1}
+    return client
+
+
+def test_preserves_order_per_recipient(client):
+    with OrderedDispatcher(client, workers=4) as dispatcher:
+        futures = [
+            dispatcher.send({'text': str(i)}, recipient_id)
+            for i in range(20)
+            for recipient_id in range(5)
+        ]
+
+    assert all(f.done() for f in futures)
+    for recipient_id in range(5):
+        payloads = [p['text'] for r, p in client.sent if r == recipient_id]
+        assert payloads == [str(i) for i in range(20)]
+
+
+def test_send_returns_future(client):
+    with OrderedDispatcher(client, workers=2) as dispatcher:
+        future = dispatcher.send({'text': 'hello'}, 1, messaging_type='UPDATE')
+        assert future.result(timeout=1) == {'recipient_id': 1}
+    client.send.assert_called_with({'text': 'hello'}, 1, messaging_type='UPDATE')
+
+
+def test_send_action(client):
+    with OrderedDispatcher(client, workers=2) as dispatcher:
+        future = dispatcher.send_action('typing_on', 1)
+        assert future.result(timeout=1) == {'recipient_id': 1}
+    client.send_action.assert_called_with('typing_on', 1)
+
+
+def test_same_queue_for_equivalent_ids(client):
+    dispatcher = OrderedDispatcher(client, workers=8)
+    assert dispatcher._queue_for(123) is dispatcher._queue_for('123')
+    dispatcher.close()
+
+
+def test_errors_are_set_on_future(client):
+    client.send.side_effect = ValueError('boom')
+    with OrderedDispatcher(client, workers=1) as dispatcher:
+        failed = dispatcher.send({'text': 'a'}, 1)
+        with pytest.raises(ValueError):
+            failed.result(timeout=1)
+        client.send.side_effect = None
+        client.send.return_value = {'recipient_id': 1}
+        # The worker carries on after a failure
+        assert dispatcher.send({'text': 'b'}, 1).result(timeout=1) == {'recipient_id': 1}
+
+
+def test_submit_after_close(client):
+    dispatcher = OrderedDispatcher(client, workers=1)
+    dispatcher.close()
+    with pytest.raises(RuntimeError):
+        dispatcher.send({'text': 'a'}, 1)
+
+
+def test_invalid_workers(client):
+    with pytest.raises(ValueError):
+        OrderedDispatcher(client, workers=0)
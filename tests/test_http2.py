@@ -0,0 +1,153 @@
+import asyncio
+import io
+import json
+
+import pytest
+import requests
+
+httpx = pytest.importorskip('httpx')
+
+from fbmessenger import MessengerClient, attachments
+from fbmessenger.http2 import HTTP2Session
+from fbmessenger.retry import RetryPolicy
+
+
+def session(handler):
+    return HTTP2Session(client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+
+
+def test_default_session():
+    client = MessengerClient(12345678, http2=True, pool_maxsize=4)
+    assert isinstance(client.session, HTTP2Session)
+    client.session.close()
+
+
+def test_send():
+    requests_made = []
+
+    def handler(request):
+        requests_made.append(request)
+        return httpx.Response(200, json={'recipient_id': '1', 'message_id': 'mid.1'})
+
+    client = MessengerClient(12345678, session=session(handler))
+    assert client.send({'text': 'Test message'}, 1) == {'recipient_id': '1', 'message_id': 'mid.1'}
+
+    request, = requests_made
+    assert request.method == 'POST'
+    assert request.url.path == '/v2.12/me/messages'
+    assert request.url.params['access_token'] == '12345678'
+    assert json.loads(request.content)['message'] == {'text': 'Test message'}
+
+
+def test_send_batch_form_data():
+    def handler(request):
+        form = dict(item.split('=', 1) for item in request.content.decode('utf8').split('&'))
+        assert form['include_headers'] == 'false'
+        return httpx.Response(200, json=[{'code': 200, 'body': '{"message_id": "mid.1"}'}])
+
+    client = MessengerClient(12345678, session=session(handler))
+    assert client.send_batch([({'text': 'a'}, 1)]) == [{'message_id': 'mid.1'}]
+
+
+def test_upload_attachment_streams_file():
+    async def handler(request):
+        body = await request.aread()
+        assert request.headers['Content-Length'] == str(len(body))
+        assert b'file contents' in body
+        return httpx.Response(200, json={'attachment_id': '1234'})
+
+    client = MessengerClient(12345678, session=session(handler))
+    response = client.upload_attachment(attachments.File(), filedata=io.BytesIO(b'file contents'))
+    assert response == {'attachment_id': '1234'}
+
+
+@pytest.mark.parametrize('error, expected', [
+    (httpx.ConnectTimeout('timed out'), requests.ConnectTimeout),
+    (httpx.ReadTimeout('timed out'), requests.ReadTimeout),
+    (httpx.ConnectError('refused'), requests.ConnectionError),
+])
+def test_errors_are_raised_as_requests_exceptions(error, expected):
+    def handler(request):
+        raise error
+
+    client = MessengerClient(12345678, session=session(handler))
+    with pytest.raises(expected):
+        client.send({'text': 'Test message'}, 1)
+
+
+def test_retries_connect_errors(monkeypatch):
+    monkeypatch.setattr('time.sleep', lambda delay: None)
+    responses = [httpx.ConnectError('refused'), httpx.Response(200, json={'first_name': 'Test'})]
+
+    def handler(request):
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    client = MessengerClient(12345678, session=session(handler), retry_policy=RetryPolicy(jitter=False))
+    assert client.get_user_data(1, fields='first_name') == {'first_name': 'Test'}
+
+
+def test_retries_sends_that_never_connected(monkeypatch):
+    monkeypatch.setattr('time.sleep', lambda delay: None)
+    responses = [httpx.ConnectError('refused'), httpx.Response(200, json={'message_id': 'mid.1'})]
+
+    def handler(request):
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    client = MessengerClient(12345678, session=session(handler), retry_policy=RetryPolicy(jitter=False))
+    assert client.send({'text': 'Test message'}, 1) == {'message_id': 'mid.1'}
+
+
+def test_async_send():
+    aio = pytest.importorskip('fbmessenger.aio')
+    requests_made = []
+
+    def handler(request):
+        requests_made.append(request)
+        return httpx.Response(200, json={'message_id': 'mid.1'})
+
+    async def send():
+        http2_session = aio.AsyncHTTP2Session(client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+        async with aio.AsyncMessengerClient(12345678, session=http2_session) as client:
+            return await client.send({'text': 'Test message'}, 1, timeout=5)
+
+    assert asyncio.run(send()) == {'message_id': 'mid.1'}
+    assert json.loads(requests_made[0].content)['message'] == {'text': 'Test message'}
+
+
+def test_async_upload_attachment():
+    aio = pytest.importorskip('fbmessenger.aio')
+
+    async def handler(request):
+        body = await request.aread()
+        assert request.headers['Content-Type'].startswith('multipart/form-data')
+        assert b'file contents' in body
+        return httpx.Response(200, json={'attachment_id': '1234'})
+
+    async def upload():
+        http2_session = aio.AsyncHTTP2Session(client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+        async with aio.AsyncMessengerClient(12345678, session=http2_session) as client:
+            return await client.upload_attachment(attachments.File(), filedata=io.BytesIO(b'file contents'))
+
+    assert asyncio.run(upload()) == {'attachment_id': '1234'}
+
+
+def test_async_connect_error_is_transient():
+    aio = pytest.importorskip('fbmessenger.aio')
+
+    def handler(request):
+        raise httpx.ConnectError('refused')
+
+    async def send():
+        http2_session = aio.AsyncHTTP2Session(client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+        async with aio.AsyncMessengerClient(12345678, session=http2_session) as client:
+            await client.send({'text': 'Test message'}, 1)
+
+    with pytest.raises(aio.HTTP2ConnectError) as e:
+        asyncio.run(send())
+    assert aio.AsyncMessengerClient._classify_exception('post', e.value) == 'transient'
@@ -0,0 +1,45 @@
+import json
+
+import pytest
+
+from fbmessenger.json_codecs import CODECS, JSON_CODEC, StdlibCodec, encode, get_codec
+
+
+@pytest.fixture(params=sorted(CODECS))
+def codec(request):
+    if request.param != 'json':
+        pytest.importorskip(request.param)
+    return get_codec(request.param)
+
+
+def test_round_trip(codec):
+    body = {'recipient': {'id': 1}, 'message': {'text': u'h\xe9llo'}}
+    data = codec.dumps(body)
+    assert isinstance(data, bytes)
+    assert json.loads(data.decode('utf8')) == body
+    assert codec.loads(data) == body
+
+
+def test_invalid_json_raises_value_error(codec):
+    with pytest.raises(ValueError):
+        codec.loads(b'<html>Bad Gateway</html>')
+
+
+def test_get_codec():
+    assert get_codec(None) is None
+    assert get_codec(JSON_CODEC) is JSON_CODEC
+    assert isinstance(get_codec('json'), StdlibCodec)
+    assert get_codec('auto').name in ('orjson', 'msgspec', 'ujson', 'json')
+    with pytest.raises(ValueError):
+        get_codec('yaml')
+
+
+def test_get_codec_auto_falls_back_to_stdlib(monkeypatch):
+    monkeypatch.setattr('fbmessenger.json_codecs.AUTO_CODECS', ())
+    assert get_codec('auto') is JSON_CODEC
+
+
+def test_encode_passes_raw_bytes_through():
+    assert encode(JSON_CODEC, b'{"text":"hi"}') == b'{"text":"hi"}'
+    data = encode(JSON_CODEC, {'recipient': {'id': 1}, 'message': b'{"text":"hi"}'})
+    assert json.loads(data.decode('utf8')) == {'recipient': {'id': 1}, 'message': {'text': 'hi'}}
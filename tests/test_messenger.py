@@ -1,4 +1,7 @@
 import copy
+import threading
+import time
+
 import pytest
 from mock import Mock
 
@@ -189,6 +192,94 @@ def test_account_linking(messenger, payload_account_linking):
     mock_account_linking.assert_called_with(payload_account_linking['entry'][0]['messaging'][0])
 
 
+def test_handle_dispatches_every_event(messenger):
+    messenger.message = Mock(side_effect=lambda message: message['message']['text'])
+    messenger.read = Mock(return_value='read')
+    payload = {
+        'entry': [
+            {'messaging': [
+                {'sender': {'id': 1}, 'message': {'text': 'one'}},
+                {'sender': {'id': 2}, 'read': {'watermark': 1}},
+            ]},
+            {'messaging': [
+                {'sender': {'id': 1}, 'message': {'text': 'two'}},
+                {'sender': {'id': 3}, 'unknown': {}},
+            ]},
+            {'changes': []},
+        ]
+    }
+
+    assert messenger.handle(payload) == ['one', 'read', 'two', None]
+    assert messenger.message.call_count == 2
+
+
+def test_handle_concurrently_keeps_each_senders_order(messenger):
+    handled = []
+    threads = set()
+
+    def message(message):
+        time.sleep(0.01)
+        handled.append((messenger.get_user_id(), message['message']['text']))
+        threads.add(threading.current_thread())
+        return message['message']['text']
+
+    messenger.message = message
+    events = [{'sender': {'id': sender_id}, 'message': {'text': '{}-{}'.format(sender_id, i)}}
+              for i in range(3) for sender_id in range(4)]
+
+    results = messenger.handle({'entry': [{'messaging': events}]}, concurrency=4)
+
+    assert results == [event['message']['text'] for event in events]
+    for sender_id in range(4):
+        texts = [text for user_id, text in handled if user_id == sender_id]
+        assert texts == ['{}-{}'.format(sender_id, i) for i in range(3)]
+    assert len(threads) > 1
+
+
+def test_handle_concurrently_raises_handler_errors(messenger):
+    messenger.message = Mock(side_effect=RuntimeError('Broken handler'))
+    events = [{'sender': {'id': sender_id}, 'message': {'text': 'hi'}} for sender_id in range(2)]
+    with pytest.raises(RuntimeError):
+        messenger.handle({'entry': [{'messaging': events}]}, concurrency=2)
+
+
+@pytest.mark.parametrize('concurrency', [None, 2])
+def test_handle_carries_on_after_handler_errors(messenger, concurrency):
+    def message(message):
+        if message['message']['text'] == 'bad':
+            raise RuntimeError('Broken handler {}'.format(message['sender']['id']))
+        return message['sender']['id']
+
+    messenger.message = Mock(side_effect=message)
+    events = [{'sender': {'id': sender_id}, 'message': {'text': 'bad' if sender_id in (1, 2) else 'hi'}}
+              for sender_id in range(4)]
+    with pytest.raises(RuntimeError) as e:
+        messenger.handle({'entry': [{'messaging': events}]}, concurrency=concurrency)
+    # The first event's error is raised once every event has been handled
+    assert str(e.value) == 'Broken handler 1'
+    assert messenger.message.call_count == 4
+
+
+@pytest.mark.parametrize('concurrency', [None, 2])
+def test_handle_return_exceptions(messenger, concurrency):
+    messenger.message = Mock(side_effect=[RuntimeError('Broken handler'), 'ok', 'ok'])
+    events = [{'sender': {'id': 1}, 'message': {'text': 'hi'}} for _ in range(3)]
+
+    results = messenger.handle({'entry': [{'messaging': events}]}, concurrency=concurrency, return_exceptions=True)
+    assert isinstance(results[0], RuntimeError)
+    assert results[1:] == ['ok', 'ok']
+
+
+def test_last_message_is_per_thread(messenger, entry):
+    messenger.last_message = entry
+    seen = []
+    thread = threading.Thread(target=lambda: seen.append(messenger.last_message))
+    thread.start()
+    thread.join()
+    assert seen == [{}]
+    assert messenger.last_message is entry
+
+
 def test_get_user(messenger, monkeypatch, recipient_id):
     mock = Mock()
     mock.return_value = {
@@ -310,3 +401,126 @@ def test_upload_attachment(messenger, monkeypatch):
     res = messenger.upload_attachment(attachment)
     assert res == mock.return_value
     mock.assert_called_with(attachment, timeout=None)
+
+
+def test_sync_profile(messenger, monkeypatch):
+    mock = Mock(return_value=[])
+    monkeypatch.setattr(messenger.client, 'sync_profile', mock)
+    profile = thread_settings.MessengerProfile(get_started=thread_settings.GetStartedButton(payload='start'))
+    assert messenger.sync_profile(profile) == []
+    mock.assert_called_with(profile, delete_missing=False, timeout=None)
+
+
+def test_typing_indicator_for_slow_replies(messenger, monkeypatch, payload_message):
+    messenger = type(messenger)(page_access_token=12345678, typing_delay=0.01, typing_refresh=0.02)
+    shown = threading.Event()
+    calls = []
+    monkeypatch.setattr(messenger.client, 'send_action',
+                        Mock(side_effect=lambda *args, **kwargs: (calls.append(args), shown.set())))
+    monkeypatch.setattr(messenger.client, 'send', Mock(side_effect=lambda *args, **kwargs: calls.append(args)))
+
+    def message(message):
+        assert shown.wait(2)
+        time.sleep(0.05)
+        return messenger.send({'text': 'Hello'})
+
+    messenger.message = message
+    messenger.handle(payload_message)
+    time.sleep(0.05)
+
+    sender_id = payload_message['entry'][0]['messaging'][0]['sender']['id']
+    assert calls[0] == ('typing_on', sender_id)
+    # Refreshed until the reply, and not after it
+    reply = calls.index(({'text': 'Hello'}, sender_id))
+    assert reply > 1
+    assert all(call == ('typing_off', sender_id) for call in calls[reply + 1:])
+
+
+def test_stalled_typing_indicator_does_not_hold_up_the_reply(messenger, monkeypatch, payload_message):
+    messenger = type(messenger)(page_access_token=12345678, typing_delay=0.01)
+    shown = threading.Event()
+    release = threading.Event()
+    actions = []
+
+    def send_action(sender_action, recipient_id, timeout=None):
+        actions.append((sender_action, timeout))
+        if sender_action == 'typing_on':
+            shown.set()
+            release.wait(2)
+
+    monkeypatch.setattr(messenger.client, 'send_action', Mock(side_effect=send_action))
+    monkeypatch.setattr(messenger.client, 'send', Mock())
+
+    def message(message):
+        assert shown.wait(2)
+        started = time.time()
+        messenger.send({'text': 'Hello'})
+        return time.time() - started
+
+    messenger.message = message
+    [elapsed] = messenger.handle(payload_message)
+    assert elapsed < 0.5
+
+    # The late `typing_on` is followed by a `typing_off`
+    release.set()
+    time.sleep(0.05)
+    assert actions == [('typing_on', 5), ('typing_off', 5)]
+
+
+def test_no_typing_indicator_for_fast_replies(messenger, monkeypatch, payload_message):
+    messenger = type(messenger)(page_access_token=12345678, typing_delay=0.05)
+    mock_send_action = Mock()
+    monkeypatch.setattr(messenger.client, 'send_action', mock_send_action)
+    monkeypatch.setattr(messenger.client, 'send', Mock())
+    messenger.message = lambda message: messenger.send({'text': 'Hello'})
+
+    messenger.handle(payload_message)
+    time.sleep(0.1)
+    assert not mock_send_action.called
+
+
+def test_typing_indicator_stops_when_handler_returns(messenger, monkeypatch, payload_message):
+    messenger = type(messenger)(page_access_token=12345678, typing_delay=0.05)
+    mock_send_action = Mock()
+    monkeypatch.setattr(messenger.client, 'send_action', mock_send_action)
+    messenger.message = lambda message: None
+
+    messenger.handle(payload_message)
+    time.sleep(0.1)
+    assert not mock_send_action.called
+
+
+def test_typing_indicator_is_hidden_when_handler_does_not_reply(messenger, monkeypatch, payload_message):
+    messenger = type(messenger)(page_access_token=12345678, typing_delay=0.01)
+    shown = threading.Event()
+    actions = []
+    monkeypatch.setattr(messenger.client, 'send_action',
+                        Mock(side_effect=lambda sender_action, *args, **kwargs: (actions.append(sender_action),
+                                                                                shown.set())))
+
+    def message(message):
+        assert shown.wait(2)
+
+    messenger.message = message
+    messenger.handle(payload_message)
+    time.sleep(0.05)
+    assert actions == ['typing_on', 'typing_off']
+
+
+def test_typing_indicator_is_hidden_after_mark_seen(messenger, monkeypatch, payload_message):
+    messenger = type(messenger)(page_access_token=12345678, typing_delay=0.01)
+    shown = threading.Event()
+    actions = []
+    monkeypatch.setattr(messenger.client, 'send_action',
+                        Mock(side_effect=lambda sender_action, *args, **kwargs: (actions.append(sender_action),
+                                                                                shown.set())))
+
+    def message(message):
+        assert shown.wait(2)
+        messenger.send_action('mark_seen')
+
+    messenger.message = message
+    messenger.handle(payload_message)
+    time.sleep(0.05)
+    assert actions[0] == 'typing_on'
+    assert sorted(actions[1:]) == ['mark_seen', 'typing_off']
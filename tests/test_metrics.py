@@ -0,0 +1,148 @@
+import threading
+
+import pytest
+import requests
+
+from fbmessenger import MessengerClient
+from fbmessenger.circuit_breaker import CircuitBreakers
+from fbmessenger.metrics import SHARDS, Counter, Histogram, Metrics, prometheus_text
+from fbmessenger.retry import RetryPolicy
+from fbmessenger.transports import FakeGraphTransport
+
+
+def test_counter_adds_up_thread_shards():
+    counter = Counter('requests_total', 'Requests.', ('endpoint',))
+
+    def work():
+        for _ in range(1000):
+            counter.inc(('messages',))
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    counter.inc(('attachments',), 2)
+
+    assert counter.collect() == {('messages',): 8000, ('attachments',): 2}
+    assert sum(1 for shard in counter._shards if shard) > 1
+
+
+def test_short_lived_threads_do_not_add_shards():
+    metrics = Metrics()
+    for _ in range(100):
+        thread = threading.Thread(target=metrics.record_event, args=('message', 0.1))
+        thread.start()
+        thread.join()
+
+    assert len(metrics.events._shards) == SHARDS
+    assert sum(len(shard) for shard in metrics.events._shards) <= SHARDS
+    assert metrics.snapshot()['fbmessenger_events_total'] == {('message',): 100}
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram('latency_seconds', 'Latency.', ('endpoint',), buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(('messages',), value)
+
+    assert histogram.collect() == {
+        ('messages',): {
+            'buckets': [(0.1, 2), (1, 3), (float('inf'), 4)],
+            'count': 4,
+            'sum': pytest.approx(3.65),
+        }
+    }
+
+
+def test_client_records_requests():
+    metrics = Metrics()
+    client = MessengerClient('page_access_token', transport=FakeGraphTransport(), metrics=metrics)
+
+    client.send({'text': 'hello'}, 1)
+    client.send_action('typing_on', 1)
+    client.get_user_data(1)
+
+    snapshot = metrics.snapshot()
+    assert snapshot['fbmessenger_requests_total'] == {
+        ('messages', 'post', '200', ''): 2,
+        ('user_profile', 'get', '200', ''): 1,
+    }
+    assert snapshot['fbmessenger_request_duration_seconds'][('messages',)]['count'] == 2
+
+
+def test_multi_id_lookups_are_user_profile_requests():
+    metrics = Metrics()
+    client = MessengerClient('page_access_token', transport=FakeGraphTransport(), metrics=metrics,
+                             circuit_breakers=CircuitBreakers())
+
+    client.get_users_data([1, 2])
+
+    assert metrics.snapshot()['fbmessenger_requests_total'] == {('user_profile', 'get', '200', ''): 1}
+    assert list(client.circuit_breakers._breakers) == ['user_profile']
+
+
+def test_client_records_each_attempt():
+    metrics = Metrics()
+    transport = FakeGraphTransport(throttle_rate=1)
+    client = MessengerClient('page_access_token', transport=transport, metrics=metrics,
+                             retry_policy=RetryPolicy(max_attempts=3, backoff=0, jitter=False))
+
+    client.send({'text': 'hello'}, 1)
+
+    assert metrics.snapshot()['fbmessenger_requests_total'] == {('messages', 'post', '400', '613'): 3}
+
+
+def test_client_records_network_errors():
+    class BrokenTransport(FakeGraphTransport):
+        def request(self, method, url, **kwargs):
+            raise requests.ConnectionError('Connection refused')
+
+    metrics = Metrics()
+    client = MessengerClient('page_access_token', transport=BrokenTransport(), metrics=metrics)
+
+    with pytest.raises(requests.ConnectionError):
+        client.send({'text': 'hello'}, 1)
+
+    assert metrics.snapshot()['fbmessenger_requests_total'] == {('messages', 'post', 'error', ''): 1}
+
+
+def test_handle_records_events(echo_messenger, event):
+    metrics = Metrics()
+    messenger = echo_messenger('page_access_token', transport=FakeGraphTransport(), metrics=metrics)
+
+    [response] = messenger.handle(event(message={'text': 'hello'}))
+    assert response['message_id']
+    with pytest.raises(RuntimeError):
+        messenger.handle(event(postback={'payload': 'START'}))
+
+    snapshot = metrics.snapshot()
+    assert snapshot['fbmessenger_events_total'] == {('message',): 1, ('postback',): 1}
+    assert snapshot['fbmessenger_handler_errors_total'] == {('postback',): 1}
+    assert snapshot['fbmessenger_handler_duration_seconds'][('message',)]['count'] == 1
+
+
+def test_prometheus_text():
+    metrics = Metrics(buckets=(0.1, 1))
+    metrics.record_request('messages', 'post', 200, None, 0.05)
+    metrics.record_request('messages', 'post', 400, 613, 0.5)
+    metrics.record_event('message', 0.2)
+
+    text = prometheus_text(metrics)
+
+    assert text.endswith('\n')
+    lines = text.splitlines()
+    assert '# TYPE fbmessenger_requests_total counter' in lines
+    assert 'fbmessenger_requests_total{endpoint="messages",method="post",status="200",error_code=""} 1' in lines
+    assert 'fbmessenger_requests_total{endpoint="messages",method="post",status="400",error_code="613"} 1' in lines
+    assert '# TYPE fbmessenger_request_duration_seconds histogram' in lines
+    assert 'fbmessenger_request_duration_seconds_bucket{endpoint="messages",le="0.1"} 1' in lines
+    assert 'fbmessenger_request_duration_seconds_bucket{endpoint="messages",le="+Inf"} 2' in lines
+    assert 'fbmessenger_request_duration_seconds_sum{endpoint="messages"} 0.55' in lines
+    assert 'fbmessenger_request_duration_seconds_count{endpoint="messages"} 2' in lines
+    assert 'fbmessenger_events_total{event_type="message"} 1' in lines
+
+
+def test_prometheus_escapes_label_values():
+    metrics = Metrics()
+    metrics.record_event('say "hi"\\', 0)
+    assert 'fbmessenger_events_total{event_type="say \\"hi\\"\\\\"} 1' in prometheus_text(metrics).splitlines()
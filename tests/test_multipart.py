@@ -0,0 +1,79 @@
+import io
+
+import pytest
+import requests
+
+from fbmessenger.multipart import MultipartEncoder, guess_content_type, open_filedata
+
+
+@pytest.fixture
+def encoder():
+    return MultipartEncoder([
+        ('message', u'{"attachment": {"type": "image"}}'),
+        ('filedata', ('image.png', io.BytesIO(b'0123456789' * 1000), 'image/png')),
+    ], boundary='boundary')
+
+
+def test_encoder_body(encoder):
+    body = encoder.read()
+    assert len(body) == len(encoder)
+    assert body.startswith(
+        b'--boundary\r\n'
+        b'Content-Disposition: form-data; name="message"\r\n\r\n'
+        b'{"attachment": {"type": "image"}}\r\n'
+        b'--boundary\r\n'
+        b'Content-Disposition: form-data; name="filedata"; filename="image.png"\r\n'
+        b'Content-Type: image/png\r\n\r\n'
+        b'0123456789'
+    )
+    assert body.endswith(b'0123456789\r\n--boundary--\r\n')
+    assert encoder.read() == b''
+
+
+def test_encoder_reads_in_chunks(encoder):
+    full = encoder.read()
+    encoder.seek(0)
+    chunks = list(iter(lambda: encoder.read(100), b''))
+    assert all(len(chunk) <= 100 for chunk in chunks)
+    assert b''.join(chunks) == full
+    assert encoder.tell() == len(encoder)
+
+
+def test_encoder_seek(encoder):
+    encoder.read(5000)
+    encoder.seek(0)
+    assert encoder.tell() == 0
+    assert len(encoder.read()) == len(encoder)
+    with pytest.raises(IOError):
+        encoder.seek(10)
+
+
+def test_encoder_starts_from_file_position():
+    fileobj = io.BytesIO(b'skip-data')
+    fileobj.seek(5)
+    encoder = MultipartEncoder([('filedata', ('a.bin', fileobj, 'application/octet-stream'))], 'b')
+    assert b'\r\n\r\ndata\r\n' in encoder.read()
+
+
+def test_encoder_with_requests(encoder):
+    request = requests.Request('POST', 'https://graph.facebook.com/v2.12/me/message_attachments',
+                               data=encoder, headers={'Content-Type': encoder.content_type}).prepare()
+    assert request.body is encoder
+    assert request.headers['Content-Length'] == str(len(encoder))
+    assert 'Transfer-Encoding' not in request.headers
+
+
+def test_open_filedata(tmpdir):
+    path = tmpdir.join('video.mp4')
+    path.write_binary(b'data')
+    fileobj, filename, should_close = open_filedata(str(path))
+    assert (fileobj.read(), filename, should_close) == (b'data', 'video.mp4', True)
+    fileobj.close()
+
+    fileobj = io.BytesIO(b'data')
+    assert open_filedata(fileobj) == (fileobj, 'file', False)
+
+
+def test_guess_content_type():
+    assert guess_content_type('image.png') == 'image/png'
+    assert guess_content_type('unknown') == 'application/octet-stream'
@@ -0,0 +1,214 @@
+import sqlite3
+import threading
+
+import mock
+import pytest
+import requests
+
+from fbmessenger import MessengerClient
+from fbmessenger.outbox import _ACK, _APPEND, _STOP, ACK_RETRIES, Outbox, _Entry
+from fbmessenger.retry import RetryPolicy
+from fbmessenger.transports import FakeGraphTransport
+
+
+class RecordingTransport(FakeGraphTransport):
+
+    def __init__(self, fail=0, **kwargs):
+        super(RecordingTransport, self).__init__(**kwargs)
+        self.fail = fail
+        self.sent = []
+
+    def request(self, method, url, **kwargs):
+        with self._lock:
+            if self.fail:
+                self.fail -= 1
+                raise requests.ConnectionError('Connection reset')
+        return super(RecordingTransport, self).request(method, url, **kwargs)
+
+    def respond(self, method, path, params, body):
+        with self._lock:
+            self.sent.append((body['recipient']['id'], body['message']['text']))
+        return super(RecordingTransport, self).respond(method, path, params, body)
+
+
+@pytest.fixture
+def path(tmpdir):
+    return str(tmpdir.join('outbox.db'))
+
+
+def no_backoff(max_attempts=3):
+    return RetryPolicy(max_attempts=max_attempts, backoff=0, jitter=False)
+
+
+def test_send_is_queued_and_delivered(path):
+    transport = RecordingTransport()
+    outbox = Outbox(path)
+    client = MessengerClient('page_access_token', transport=transport, outbox=outbox)
+
+    future = client.send({'text': 'hello'}, 12345)
+
+    assert future.result(timeout=5)['recipient_id'] == '12345'
+    assert transport.sent == [(12345, 'hello')]
+    assert outbox.join(timeout=5)
+    outbox.close()
+    assert Outbox(path)._conn.execute('SELECT COUNT(*) FROM outbox').fetchone()[0] == 0
+
+
+def test_preserves_order_per_recipient(path):
+    transport = RecordingTransport()
+    with Outbox(path, flushers=4) as outbox:
+        client = MessengerClient('page_access_token', transport=transport, outbox=outbox)
+        for i in range(20):
+            for recipient_id in range(5):
+                client.send({'text': str(i)}, recipient_id)
+
+    assert len(transport.sent) == 100
+    for recipient_id in range(5):
+        texts = [text for r, text in transport.sent if r == recipient_id]
+        assert texts == [str(i) for i in range(20)]
+
+
+def test_unacknowledged_messages_are_replayed(path):
+    # The first process never gets a response before "crashing"
+    blocked = threading.Event()
+    crashed = Outbox(path)
+    client = mock.Mock()
+    client._send.side_effect = lambda **kwargs: blocked.wait()
+    client._capture.side_effect = lambda method, request, call: call()
+    crashed.open(client)
+    crashed.put({'text': 'hello'}, 12345, messaging_type='UPDATE')
+
+    transport = RecordingTransport()
+    outbox = Outbox(path)
+    MessengerClient('page_access_token', transport=transport, outbox=outbox)
+
+    assert outbox.join(timeout=5)
+    assert transport.sent == [(12345, 'hello')]
+    blocked.set()
+    outbox.close()
+
+
+def test_group_commit(path):
+    outbox = Outbox(path)
+    # Queue appends before the writer starts, as if they arrived during a sync
+    entries = [_Entry('{"recipient_id":1}', 1) for _ in range(10)]
+    for entry in entries:
+        outbox._writes.put((_APPEND, entry))
+
+    with mock.patch.object(outbox, '_write', wraps=outbox._write) as write:
+        outbox.open(mock.Mock())
+        for entry in entries:
+            assert entry.committed.wait(5)
+
+    assert write.call_args_list[0] == mock.call([(_APPEND, entry) for entry in entries])
+    assert sorted(entry.id for entry in entries) == list(range(1, 11))
+    outbox.close(wait=False)
+
+
+def test_retries_network_errors(path):
+    transport = RecordingTransport(fail=2)
+    with Outbox(path, retry_policy=no_backoff()) as outbox:
+        client = MessengerClient('page_access_token', transport=transport, outbox=outbox)
+        future = client.send({'text': 'hello'}, 12345)
+        assert future.result(timeout=5)['recipient_id'] == '12345'
+    assert transport.sent == [(12345, 'hello')]
+
+
+def test_client_retry_policy_is_not_applied_on_top(path):
+    transport = FakeGraphTransport(throttle_rate=1)
+    with Outbox(path, retry_policy=no_backoff(4)) as outbox:
+        client = MessengerClient('page_access_token', transport=transport, outbox=outbox,
+                                 retry_policy=no_backoff(3))
+        response = client.send({'text': 'hello'}, 12345).result(timeout=5)
+    assert response['error']['code'] == 613
+    assert transport.calls['post', 'me/messages'] == 4
+
+
+def test_failed_acks_stay_unacknowledged(path):
+    outbox = Outbox(path)
+    outbox._unacked = 1
+    outbox._conn = mock.MagicMock()
+    outbox._conn.executemany.side_effect = sqlite3.OperationalError('disk I/O error')
+
+    outbox._write([(_ACK, 1)])
+
+    assert len(outbox) == 1
+    # Queued to be written again
+    assert outbox._writes.get_nowait() == (_ACK, 1)
+
+
+def test_acks_that_keep_failing_are_given_up(path):
+    outbox = Outbox(path)
+    outbox._unacked = 1
+    outbox._conn = mock.MagicMock()
+    outbox._conn.executemany.side_effect = sqlite3.OperationalError('disk I/O error')
+
+    for _ in range(ACK_RETRIES + 1):
+        outbox._write([outbox._writes.get_nowait() if outbox._writes.qsize() else (_ACK, 1)])
+
+    assert len(outbox) == 0
+    assert outbox._writes.empty()
+    assert outbox.join(timeout=0)
+
+
+def test_appends_left_when_the_writer_stops_fail(path):
+    outbox = Outbox(path, batch_size=1)
+    entry = _Entry('{"recipient_id":1}', 1)
+    outbox._writes.put((_STOP, None))
+    outbox._writes.put((_APPEND, entry))
+
+    outbox.open(mock.Mock())
+    outbox._writer.join(5)
+
+    assert entry.committed.is_set()
+    assert isinstance(entry.error, RuntimeError)
+
+
+def test_drops_messages_that_keep_failing(path):
+    transport = RecordingTransport(fail=10)
+    with Outbox(path, retry_policy=no_backoff(2)) as outbox:
+        client = MessengerClient('page_access_token', transport=transport, outbox=outbox)
+        future = client.send({'text': 'hello'}, 12345)
+        with pytest.raises(requests.ConnectionError):
+            future.result(timeout=5)
+        assert outbox.join(timeout=5)
+    assert transport.fail == 8
+
+
+def test_permanent_errors_are_not_retried(path):
+    transport = FakeGraphTransport()
+    transport.respond = mock.Mock(return_value={'error': {'code': 100, 'message': 'Invalid parameter'}})
+    with Outbox(path, retry_policy=no_backoff()) as outbox:
+        client = MessengerClient('page_access_token', transport=transport, outbox=outbox)
+        response = client.send({'text': 'hello'}, 12345).result(timeout=5)
+    assert response['error']['code'] == 100
+    assert transport.calls['post', 'me/messages'] == 1
+
+
+def test_pre_encoded_payload(path):
+    transport = RecordingTransport()
+    with Outbox(path) as outbox:
+        client = MessengerClient('page_access_token', transport=transport, outbox=outbox)
+        client.send(b'{"text":"hello"}', 12345).result(timeout=5)
+    assert transport.sent == [(12345, 'hello')]
+
+
+def test_invalid_message_is_not_queued(path):
+    with Outbox(path) as outbox:
+        client = MessengerClient('page_access_token', transport=FakeGraphTransport(), outbox=outbox)
+        with pytest.raises(ValueError):
+            client.send({'text': 'hello'}, 12345, messaging_type='INVALID')
+        assert len(outbox) == 0
+
+
+def test_closed_outbox_rejects_messages(path):
+    outbox = Outbox(path)
+    client = MessengerClient('page_access_token', transport=FakeGraphTransport(), outbox=outbox)
+    outbox.close()
+    with pytest.raises(RuntimeError):
+        client.send({'text': 'hello'}, 12345)
+
+
+def test_invalid_synchronous(path):
+    with pytest.raises(ValueError):
+        Outbox(path, synchronous='SOMETIMES')
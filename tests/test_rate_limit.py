@@ -0,0 +1,56 @@
+import mock
+import pytest
+
+from fbmessenger.rate_limit import RateLimiter, TokenBucket
+
+CLOCK = 'fbmessenger.rate_limit.monotonic'
+
+
+def test_token_bucket_burst_then_wait(clock):
+    bucket = TokenBucket(rate=2, capacity=2)
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(0.5)
+    # Concurrent callers queue up behind the one already waiting
+    assert bucket.reserve() == pytest.approx(1.0)
+
+
+def test_token_bucket_refills(clock):
+    bucket = TokenBucket(rate=10)
+    for _ in range(10):
+        assert bucket.reserve() == 0
+    assert bucket.reserve() > 0
+    clock[0] += 10
+    assert bucket.reserve() == 0
+
+
+def test_token_bucket_invalid_rate():
+    with pytest.raises(ValueError):
+        TokenBucket(rate=0)
+
+
+def test_rate_limiter_per_recipient(clock):
+    limiter = RateLimiter(rate=100, recipient_rate=1)
+    assert limiter.reserve(1) == 0
+    assert limiter.reserve(2) == 0
+    assert limiter.reserve(1) == pytest.approx(1.0)
+    assert limiter.reserve() == 0
+
+
+def test_rate_limiter_evicts_least_recently_used_recipient(clock):
+    limiter = RateLimiter(rate=100, recipient_rate=1, max_recipients=2)
+    limiter.reserve(1)
+    limiter.reserve(2)
+    limiter.reserve(1)
+    limiter.reserve(3)
+    assert list(limiter._recipients) == [1, 3]
+
+
+def test_rate_limiter_acquire_sleeps(clock, monkeypatch):
+    mock_sleep = mock.Mock()
+    monkeypatch.setattr('time.sleep', mock_sleep)
+    limiter = RateLimiter(rate=1)
+    limiter.acquire()
+    assert mock_sleep.call_count == 0
+    limiter.acquire()
+    mock_sleep.assert_called_once_with(pytest.approx(1.0))
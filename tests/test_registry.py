@@ -0,0 +1,70 @@
+import pytest
+
+from fbmessenger import MessengerClient
+from fbmessenger.adapters import GRAPH_API_PREFIX
+from fbmessenger.registry import ClientRegistry
+
+
+def test_clients_share_session():
+    registry = ClientRegistry(app_secret='secret', max_connections=4)
+    registry.register(1, 'token-1')
+    registry.register(2, 'token-2')
+
+    first, second = registry.get(1), registry[2]
+    assert isinstance(first, MessengerClient)
+    assert first.session is second.session is registry.session
+    assert first.page_access_token == 'token-1'
+    assert second.page_access_token == 'token-2'
+    assert first.app_secret == 'secret'
+    assert registry.get(1) is first
+
+
+def test_default_session_caps_connections():
+    registry = ClientRegistry(max_connections=4)
+    adapter = registry.session.get_adapter(GRAPH_API_PREFIX)
+    assert adapter._pool_maxsize == 4
+    assert adapter._pool_block is True
+
+
+def test_client_kwargs():
+    registry = ClientRegistry(api_version=3.0)
+    registry.register(1, 'token')
+    assert registry.get(1).api_version == 3.0
+
+
+@pytest.mark.parametrize('option', ['outbox', 'dead_letters', 'attachment_cache'])
+def test_per_page_kwargs_are_rejected(option):
+    with pytest.raises(ValueError) as e:
+        ClientRegistry(**{option: object()})
+    assert option in str(e.value)
+
+
+def test_auth_args_are_computed_once():
+    registry = ClientRegistry(app_secret='secret')
+    registry.register(1, 'token')
+    client = registry.get(1)
+    assert client.auth_args['appsecret_proof'] == client.generate_appsecret_proof()
+    assert registry.get(1).auth_args is client.auth_args
+
+
+def test_register_new_token_replaces_client():
+    registry = ClientRegistry(app_secret='secret')
+    registry.register(1, 'token')
+    client = registry.get(1)
+    registry.register(1, 'token')
+    assert registry.get(1) is client
+
+    registry.register(1, 'new-token')
+    assert registry.get(1) is not client
+    assert registry.get(1).page_access_token == 'new-token'
+
+
+def test_unregister():
+    registry = ClientRegistry()
+    registry.register(1, 'token')
+    assert 1 in registry
+    assert len(registry) == 1
+    registry.unregister(1)
+    assert 1 not in registry
+    with pytest.raises(KeyError):
+        registry.get(1)
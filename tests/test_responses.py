@@ -0,0 +1,58 @@
+from fbmessenger.responses import GraphError, SendResult, raw_response
+from fbmessenger.retry import PERMANENT, THROTTLED
+
+
+def test_send_result():
+    data = {'recipient_id': '1', 'message_id': 'mid.1'}
+    result = SendResult.from_response(data, 200, 0.25)
+    assert result.ok
+    assert result.recipient_id == '1'
+    assert result.message_id == 'mid.1'
+    assert result.attachment_id is None
+    assert result.error is None
+    assert result.status_code == 200
+    assert result.latency == 0.25
+    assert result.raw is data
+    assert raw_response(result) is data
+
+
+def test_send_result_error():
+    data = {
+        'error': {
+            'message': 'Too many calls',
+            'type': 'OAuthException',
+            'code': 613,
+            'error_subcode': 2018022,
+            'fbtrace_id': 'AbCdEf',
+        }
+    }
+    result = SendResult.from_response(data, 400)
+    assert not result.ok
+    assert result.message_id is None
+    assert isinstance(result.error, GraphError)
+    assert result.error.code == 613
+    assert result.error.error_subcode == 2018022
+    assert result.error.fbtrace_id == 'AbCdEf'
+    assert result.error.error_class == THROTTLED
+
+
+def test_send_result_error_class_given():
+    result = SendResult.from_response({'error': {'code': 613}}, 400, error_class=PERMANENT)
+    assert result.error.error_class == PERMANENT
+
+
+def test_send_result_unexpected_response():
+    result = SendResult.from_response(None)
+    assert not result.ok
+    assert result.raw is None
+
+
+def test_slots():
+    result = SendResult()
+    assert not hasattr(result, '__dict__')
+    assert not hasattr(GraphError(), '__dict__')
+
+
+def test_raw_response():
+    data = {'message_id': 'mid.1'}
+    assert raw_response(data) is data
@@ -0,0 +1,72 @@
+import pytest
+
+from fbmessenger import retry
+from fbmessenger.retry import (
+    PERMANENT,
+    THROTTLED,
+    TRANSIENT,
+    RetryPolicy,
+    classify_error,
+    get_error,
+)
+
+
+def error(code, **kwargs):
+    return {'error': dict({'message': 'Error', 'code': code}, **kwargs)}
+
+
+def test_get_error():
+    assert get_error(error(1)) == {'message': 'Error', 'code': 1}
+    assert get_error({'message_id': 'mid.1'}) is None
+    assert get_error([{'code': 200}]) is None
+
+
+@pytest.mark.parametrize('data, status_code, expected', [
+    ({'message_id': 'mid.1'}, 200, None),
+    (None, 502, TRANSIENT),
+    (error(1), 500, TRANSIENT),
+    (error(2), 503, TRANSIENT),
+    (error(1200), 500, TRANSIENT),
+    (error(4), 400, THROTTLED),
+    (error(17), 400, THROTTLED),
+    (error(613), 400, THROTTLED),
+    (error(100), 400, PERMANENT),
+    (error(190), 400, PERMANENT),
+    (error(100, is_transient=True), 400, TRANSIENT),
+    (error(100), None, PERMANENT),
+])
+def test_classify_error(data, status_code, expected):
+    assert classify_error(data, status_code) == expected
+
+
+def test_backoff_is_capped_and_exponential():
+    policy = RetryPolicy(backoff=1, max_backoff=5, jitter=False)
+    assert [policy.get_backoff(attempt) for attempt in range(1, 6)] == [1, 2, 4, 5, 5]
+
+
+def test_backoff_jitter():
+    policy = RetryPolicy(backoff=1, max_backoff=5)
+    for attempt in range(1, 6):
+        assert 0 <= policy.get_backoff(attempt) <= min(5, 2 ** (attempt - 1))
+
+
+def test_next_delay(monkeypatch):
+    monkeypatch.setattr(retry, 'monotonic', lambda: 100.0)
+    policy = RetryPolicy(max_attempts=3, backoff=1, jitter=False)
+    assert policy.next_delay(1, 100.0, TRANSIENT) == 1
+    assert policy.next_delay(2, 100.0, THROTTLED) == 2
+    assert policy.next_delay(3, 100.0, TRANSIENT) is None
+    assert policy.next_delay(1, 100.0, PERMANENT) is None
+    assert policy.next_delay(1, 100.0, None) is None
+
+
+def test_next_delay_respects_deadline(monkeypatch):
+    monkeypatch.setattr(retry, 'monotonic', lambda: 109.5)
+    policy = RetryPolicy(max_attempts=10, backoff=1, jitter=False, deadline=10)
+    assert policy.next_delay(1, 100.0, TRANSIENT) is None
+    assert policy.next_delay(1, 109.0, TRANSIENT) == 1
+
+
+def test_invalid_max_attempts():
+    with pytest.raises(ValueError):
+        RetryPolicy(max_attempts=0)
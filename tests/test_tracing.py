@@ -0,0 +1,195 @@
+import asyncio
+import sys
+
+import pytest
+import requests
+
+from fbmessenger import MessengerClient
+from fbmessenger.adapters import GraphAdapter, TracedHTTPSConnectionPool
+from fbmessenger.retry import RetryPolicy
+from fbmessenger.tracing import CallbackTracer, Tracer, current_span, end_span, start_span
+from fbmessenger.transports import FakeGraphTransport
+
+
+class Recorder(CallbackTracer):
+
+    def __init__(self):
+        self.spans = []
+        super(Recorder, self).__init__(self.spans.append)
+
+
+def test_spans_nest_and_restore_the_active_span():
+    tracer = Tracer()
+    outer = start_span(tracer, 'outer')
+    inner = start_span(tracer, 'inner', key='value')
+    assert current_span() is inner
+    assert inner.parent is outer
+    assert inner.attributes == {'key': 'value'}
+
+    end_span(tracer, inner)
+    assert current_span() is outer
+    end_span(tracer, outer)
+    assert current_span() is None
+    assert inner.duration >= 0
+
+
+def test_inactive_spans():
+    span = start_span(Tracer(), 'detached', activate=False)
+    assert current_span() is None
+    end_span(Tracer(), span)
+
+
+def test_broken_tracer_does_not_break_sending():
+    def broken(span):
+        raise RuntimeError('Tracer bug')
+
+    client = MessengerClient('page_access_token', transport=FakeGraphTransport(), tracer=CallbackTracer(broken))
+    assert client.send({'text': 'hello'}, 1)['recipient_id'] == '1'
+    assert current_span() is None
+
+
+def test_request_spans():
+    tracer = Recorder()
+    transport = FakeGraphTransport(throttle_rate=1)
+    client = MessengerClient('page_access_token', transport=transport, tracer=tracer,
+                             retry_policy=RetryPolicy(max_attempts=2, backoff=0, jitter=False))
+
+    client.send({'text': 'hello'}, 1)
+
+    assert [span.name for span in tracer.spans] == ['graph.request', 'graph.request']
+    first, second = tracer.spans
+    assert first.attributes == {
+        'endpoint': 'messages',
+        'method': 'POST',
+        'attempt': 1,
+        'status_code': 400,
+        'fbtrace_id': 'fake',
+        'error_code': 613,
+    }
+    assert second.attributes['attempt'] == 2
+    assert first.fbtrace_id == 'fake'
+
+
+def test_request_span_on_network_error():
+    class BrokenTransport(FakeGraphTransport):
+        def request(self, method, url, **kwargs):
+            raise requests.ConnectionError('Connection refused')
+
+    tracer = Recorder()
+    client = MessengerClient('page_access_token', transport=BrokenTransport(), tracer=tracer)
+
+    with pytest.raises(requests.ConnectionError):
+        client.send({'text': 'hello'}, 1)
+
+    [span] = tracer.spans
+    assert isinstance(span.error, requests.ConnectionError)
+    assert span.attributes['status_code'] is None
+
+
+def test_handle_span_is_the_parent_of_requests(echo_messenger, event):
+    tracer = Recorder()
+    messenger = echo_messenger('page_access_token', transport=FakeGraphTransport(), tracer=tracer)
+
+    messenger.handle(event(message={'text': 'hi'}))
+
+    request, handle = tracer.spans
+    assert handle.name == 'messenger.handle'
+    assert handle.attributes == {'event_type': 'message', 'sender_id': 1}
+    assert request.parent is handle
+    assert current_span() is None
+
+
+def test_handle_span_records_errors(echo_messenger, event):
+    tracer = Recorder()
+    messenger = echo_messenger('page_access_token', transport=FakeGraphTransport(), tracer=tracer)
+    with pytest.raises(RuntimeError):
+        messenger.handle(event(postback={'payload': 'START'}))
+
+    [span] = tracer.spans
+    assert isinstance(span.error, RuntimeError)
+
+
+def test_default_session_is_only_traced_with_a_tracer():
+    plain = MessengerClient('page_access_token')
+    traced = MessengerClient('page_access_token', tracer=Tracer())
+
+    def pool_class(client):
+        adapter = client.session.get_adapter('https://graph.facebook.com/')
+        return adapter.poolmanager.pool_classes_by_scheme['https']
+
+    assert pool_class(plain) is not TracedHTTPSConnectionPool
+    assert pool_class(traced) is TracedHTTPSConnectionPool
+
+
+def test_graph_adapter_records_phases(server):
+    tracer = Recorder()
+    session = requests.Session()
+    session.mount('http://', GraphAdapter(tracing=True))
+    client = MessengerClient('page_access_token', session=session, tracer=tracer)
+    client.graph_url = server.url('/v2.12', host='localhost')
+
+    client.send({'text': 'hello'}, 1)
+    client.send({'text': 'hello'}, 1)
+
+    first, second = tracer.spans
+    assert set(first.phases) == {'pool_wait', 'dns', 'connect', 'send', 'ttfb'}
+    assert all(seconds >= 0 for seconds in first.phases.values())
+    assert sum(first.phases.values()) <= first.duration
+    assert first.fbtrace_id == 'AbCdEf'
+    # The connection is reused
+    assert set(second.phases) == {'pool_wait', 'send', 'ttfb'}
+
+
+def test_graph_adapter_without_active_span(server):
+    session = requests.Session()
+    session.mount('http://', GraphAdapter(tracing=True))
+    client = MessengerClient('page_access_token', session=session)
+    client.graph_url = server.url('/v2.12', host='localhost')
+    assert client.send({'text': 'hello'}, 1)['message_id'] == 'mid.1'
+
+
+@pytest.mark.skipif(sys.version_info < (3, 8), reason='fbmessenger.aio requires Python 3.8+')
+def test_async_client_records_phases(server):
+    pytest.importorskip('aiohttp')
+    from fbmessenger.aio import AsyncMessengerClient
+
+    tracer = Recorder()
+
+    async def send():
+        async with AsyncMessengerClient('page_access_token', tracer=tracer) as client:
+            client.graph_url = server.url('/v2.12', host='localhost')
+            await client.send({'text': 'hello'}, 1)
+            await client.send({'text': 'hello'}, 1)
+
+    asyncio.run(send())
+
+    first, second = tracer.spans
+    assert {'dns', 'connect', 'ttfb'} <= set(first.phases)
+    assert first.attributes['status_code'] == 200
+    assert first.fbtrace_id == 'AbCdEf'
+    assert 'connect' not in second.phases
+
+
+def test_opentelemetry_tracer(echo_messenger, event):
+    pytest.importorskip('opentelemetry.sdk')
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+    from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+    from fbmessenger.tracing import OpenTelemetryTracer
+
+    exporter = InMemorySpanExporter()
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    tracer = OpenTelemetryTracer(provider.get_tracer('fbmessenger'))
+    messenger = echo_messenger('page_access_token', transport=FakeGraphTransport(), tracer=tracer)
+
+    messenger.handle(event(message={'text': 'hi'}))
+
+    request, handle = exporter.get_finished_spans()
+    assert request.name == 'graph.request'
+    assert request.parent.span_id == handle.context.span_id
+    assert request.attributes['endpoint'] == 'messages'
+    assert request.attributes['status_code'] == 200
+    assert 'fbtrace_id' not in request.attributes
+    assert handle.attributes['event_type'] == 'message'
+    assert request.end_time >= request.start_time
@@ -0,0 +1,145 @@
+import io
+import json
+import socket
+
+import mock
+import pytest
+import requests
+
+from fbmessenger import MessengerClient, attachments
+from fbmessenger.retry import RetryPolicy
+from fbmessenger.transports import FakeGraphTransport, RequestsTransport, StdlibTransport, Transport
+
+
+def test_stdlib_transport_json(server):
+    transport = StdlibTransport()
+    r = transport.post(server.url('/v2.12/me/messages'), params={'access_token': 1234},
+                       json={'message': {'text': 'Hello'}})
+    assert r.status_code == 200
+    assert r.json() == {'recipient_id': '1', 'message_id': 'mid.1'}
+
+    path, headers, body = server.requests[0]
+    assert path == '/v2.12/me/messages?access_token=1234'
+    assert headers['Content-Type'] == 'application/json'
+    assert json.loads(body.decode('utf8')) == {'message': {'text': 'Hello'}}
+
+
+def test_stdlib_transport_reuses_connections(server):
+    transport = StdlibTransport()
+    transport.post(server.url('/'), data={'batch': '[]'})
+    transport.post(server.url('/'), data=b'{}', headers={'Content-Type': 'application/json'})
+    assert server.connections == 1
+    assert server.requests[0][2] == b'batch=%5B%5D'
+
+    transport.close()
+    transport.post(server.url('/'), data=b'{}')
+    assert server.connections == 2
+
+
+def test_stdlib_transport_without_reuse(server):
+    transport = StdlibTransport(reuse_connections=False)
+    transport.post(server.url('/'), data=b'{}')
+    transport.post(server.url('/'), data=b'{}')
+    assert server.connections == 2
+
+
+def test_stdlib_transport_upload(server):
+    client = MessengerClient(12345678, transport=StdlibTransport())
+    client.graph_url = server.url('/v2.12')
+    assert client.upload_attachment(attachments.File(), filedata=io.BytesIO(b'file contents')) == {
+        'recipient_id': '1',
+        'message_id': 'mid.1',
+    }
+    path, headers, body = server.requests[0]
+    assert headers['Content-Type'].startswith('multipart/form-data')
+    assert b'file contents' in body
+
+
+def test_stdlib_transport_read_timeout(server):
+    with pytest.raises(requests.ReadTimeout):
+        StdlibTransport().post(server.url('/slow'), data=b'{}', timeout=0.1)
+
+
+def test_stdlib_transport_connection_error():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    with pytest.raises(requests.ConnectionError):
+        StdlibTransport().post('http://127.0.0.1:{}/'.format(port), data=b'{}')
+
+
+def test_transport_must_implement_request():
+    class Incomplete(Transport):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_requests_transport():
+    session = mock.Mock()
+    transport = RequestsTransport(session)
+    transport.post('https://graph.facebook.com/v2.12/me/messages', json={})
+    session.post.assert_called_with('https://graph.facebook.com/v2.12/me/messages', json={})
+    transport.close()
+    session.close.assert_called_with()
+
+
+def test_fake_transport():
+    transport = FakeGraphTransport()
+    client = MessengerClient(12345678, transport=transport)
+
+    assert client.send({'text': 'Hello'}, 1) == {'recipient_id': '1', 'message_id': 'm_1'}
+    assert client.send_action('typing_on', 1) == {'recipient_id': '1'}
+    assert client.send_batch([({'text': 'a'}, 2), ({'text': 'b'}, 3)]) == [
+        {'recipient_id': '2', 'message_id': 'm_2'},
+        {'recipient_id': '3', 'message_id': 'm_3'},
+    ]
+    assert dict(client.broadcast({'text': 'Hello'}, [4, 5])) == {
+        4: {'recipient_id': '4', 'message_id': mock.ANY},
+        5: {'recipient_id': '5', 'message_id': mock.ANY},
+    }
+    assert client.get_user_data(1, fields='first_name') == {'first_name': 'first_name_1', 'id': '1'}
+    assert client.get_users_data([1, 2], fields='first_name') == {
+        1: {'first_name': 'first_name_1', 'id': '1'},
+        2: {'first_name': 'first_name_2', 'id': '2'},
+    }
+    assert 'attachment_id' in client.upload_attachment(attachments.File(), filedata=io.BytesIO(b'data'))
+    assert client.subscribe_app_to_page() == {'result': 'success'}
+
+    assert transport.calls['post', 'me/messages'] == 4
+    assert transport.calls['post', ''] == 1
+    assert transport.calls['get', '1'] == 1
+
+
+def test_fake_transport_errors(monkeypatch):
+    monkeypatch.setattr('time.sleep', lambda delay: None)
+    client = MessengerClient(12345678, transport=FakeGraphTransport(error_rate=1))
+    assert client.send({'text': 'Hello'}, 1)['error']['code'] == 2
+
+    transport = FakeGraphTransport(error_rate=0.5, seed=1)
+    client = MessengerClient(12345678, transport=transport,
+                             retry_policy=RetryPolicy(max_attempts=10, jitter=False))
+    assert 'message_id' in client.send({'text': 'Hello'}, 1)
+    assert transport.calls['post', 'me/messages'] > 1
+
+
+def test_fake_transport_throttling():
+    client = MessengerClient(12345678, transport=FakeGraphTransport(throttle_rate=1, throttle_code=4))
+    assert client.send({'text': 'Hello'}, 1)['error']['code'] == 4
+
+
+def test_fake_transport_latency(monkeypatch):
+    mock_sleep = mock.Mock()
+    monkeypatch.setattr('time.sleep', mock_sleep)
+    client = MessengerClient(12345678, transport=FakeGraphTransport(latency=lambda: 0.05))
+    client.send({'text': 'Hello'}, 1)
+    mock_sleep.assert_called_with(0.05)
+
+
+def test_base_messenger_with_fake_transport(echo_messenger, event):
+    transport = FakeGraphTransport()
+    messenger = echo_messenger(12345678, transport=transport)
+    assert messenger.handle(event(message={'text': 'Hello'})) == [{'recipient_id': '1', 'message_id': 'm_1'}]
+    assert transport.calls['post', 'me/messages'] == 1